@@ -1,90 +1,148 @@
 import requests
 import json
 import time
-import random
 import logging
 import datetime
 import re
-import mysql.connector
 import os
+from db_config import DB_CONFIG
+from db_pool import ConnectionPool
+from rate_limiter import AdaptiveRateLimiter
+from http_pool import SessionPool
+from metrics import Metrics, MetricsServer, SnapshotWriter
+from raw_archive import RawArchive, ArchiveReader
+from topic_leases import LeaseQueue, AsyncLeaseQueue
+from storage import STORAGE_BACKENDS, MySQLStorage, open_storage, tree_post
+from tree_codec import TREE_FORMATS
+import threading
 from threading import Thread
-from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
 import sys
+import argparse
+import asyncio
+import importlib
+
+try:
+    import aiohttp  # 仅 asyncio 引擎需要
+except ImportError:
+    aiohttp = None
 
 # ============ 日志配置 ============
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
-# 用当前时间生成一个字符串，比如 "20250226_192211"
-timestamp = time.strftime("%Y%m%d_%H%M%S")
+def setup_logging():
+    """
+    在 main() 里调用，而不是 import 时就建日志文件（bench_crawler.py 会 import 本模块）
+    """
+    # 用当前时间生成一个字符串，比如 "20250226_192211"
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
 
-# 拼出一个唯一的日志文件路径
-log_filename = os.path.join(SCRIPT_DIR, f'crawler_{timestamp}.log')
+    # 拼出一个唯一的日志文件路径
+    log_filename = os.path.join(SCRIPT_DIR, f'crawler_{timestamp}.log')
 
-logging.basicConfig(
-    filename=log_filename,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    filemode='w'  # 以写模式打开（非追加），这样每次运行都会生成一个新日志文件
-)
+    logging.basicConfig(
+        filename=log_filename,
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filemode='w'  # 以写模式打开（非追加），这样每次运行都会生成一个新日志文件
+    )
 
-# ============ 数据库配置(请根据实际情况修改) ============
-DB_CONFIG = {
-    'host': '147.8.219.19',   # 云端 MySQL 主机/IP
-    'port': 3306,          # 默认 MySQL 端口
-    'database': 'my_crawler_db',
-    'user': 'crawler_gexinlin',
-    'password': 'QAZwsx520'
-}
+# ============ 数据库连接 (配置见 db_config.py) ============
+# producer 读 progress + BulkWriter 写库，两个连接足够；连接懒创建、断线自动重连
+DB_POOL = ConnectionPool(DB_CONFIG, size=2)
 
+# topics / posts / progress 和增量状态的读写都经过它，main() 里按 --storage 重建
+STORAGE = MySQLStorage(DB_POOL)
 
-# ============ 线性获取所有话题 ============
+AJAX_URL = 'https://artofproblemsolving.com/m/community/ajax.php'
+
+# 所有 ajax.php 请求（producer + 所有 worker）都要先过这个限速器，main() 里按命令行参数重建
+RATE_LIMITER = AdaptiveRateLimiter()
+MAX_RETRIES = 5
+
+# 各阶段的计数 / 延迟直方图 / 队列深度，main() 里每次运行重建，--metrics-port / --metrics-file 对外暴露
+METRICS = Metrics()
+
+# --archive 时把每个 ajax.php 原始响应存一份，之后可以 --replay 离线重建数据库
+ARCHIVE = None
+
+# --build-trees 时 02_topic_tree.TreeBuilder: 每个 topic 的 progress 落库后直接用内存里的帖子建树
+TREE_BUILDER = None
+
+
+def archive_response(kind, key, page, body):
+    if ARCHIVE is not None:
+        ARCHIVE.append(kind, key, int(page), body)
 
-def insert_topics_batch(conn, topics):
+
+def post_ajax(session, headers, data, log_prefix):
+    """
+    经过 RATE_LIMITER 发一次 ajax.php 请求。
+    网络异常 / 非 200 按指数退避重试，连续失败 MAX_RETRIES 次返回 None。
     """
-    插入一批topics到数据库
+    action = data.get('a')
+    for attempt in range(1, MAX_RETRIES + 1):
+        with METRICS.timer('rate_limit_wait_seconds'):
+            RATE_LIMITER.acquire()
+        start = time.monotonic()
+        try:
+            response = session.post(AJAX_URL, headers=headers, data=data, timeout=20)
+        except requests.exceptions.RequestException as e:
+            record_request(action, time.monotonic() - start, None, attempt)
+            logging.error(f"{log_prefix} 请求异常: {e}")
+            time.sleep(RATE_LIMITER.backoff(attempt))
+            continue
+
+        record_request(action, time.monotonic() - start, response.status_code, attempt)
+        if response.status_code != 200:
+            logging.error(f"{log_prefix} 请求失败，状态码: {response.status_code}")
+            time.sleep(RATE_LIMITER.backoff(attempt, response.headers.get('Retry-After')))
+            continue
+        return response
+
+    METRICS.inc('requests_given_up_total')
+    logging.error(f"{log_prefix} 超过最大重试次数，放弃。")
+    return None
+
+
+def record_request(action, latency, status, attempt):
     """
-    insert_sql = """
-        INSERT INTO topics(topic_id, topic_title, category_id, category_name)
-        VALUES (%s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE
-          topic_title = VALUES(topic_title),
-          category_id = VALUES(category_id),
-          category_name = VALUES(category_name)
+    一次请求结束: 回报给限速器，并按接口记延迟直方图和状态码计数。status 为 None 表示网络异常。
+    失败了并且还有下一次尝试 (attempt < MAX_RETRIES) 才算一次重试，最后一次失败记在 requests_given_up_total
     """
-    cur = conn.cursor()
-    for t in topics:
-        cur.execute(insert_sql, (
-            t['topic_id'], t['topic_title'],
-            t.get('category_id'), t.get('category_name')
-        ))
-    conn.commit()
-    cur.close()
+    RATE_LIMITER.record(latency, status=status, error=status is None)
+    METRICS.observe(f'request_seconds.{action}', latency)
+    METRICS.inc('requests_total')
+    METRICS.inc(f'http_status_total.{status or "error"}')
+    if status != 200 and attempt < MAX_RETRIES:
+        METRICS.inc('request_retries_total')
+
 
-def fetch_topics_producer(session, headers, topic_queue):
+# ============ 线性获取所有话题 ============
+
+def load_done_topic_ids():
     """
-    边抓topics边写数据库，并将新的topics放进队列供后续爬帖子。
-    同时读取progress表，跳过已经完成（爬过）的topic_id，实现断点续抓。
+    读取progress表，获取已经处理完的topic_id
     """
-    # 建立连接
-    conn = mysql.connector.connect(**DB_CONFIG)
-    cur = conn.cursor()
-    
-    # 1) 读取progress表，获取已经处理完的topic_id
     done_ids = set()
     try:
-        cur.execute("SELECT topic_id FROM progress")
-        rows = cur.fetchall()
-        for r in rows:
-            done_ids.add(r[0])
+        done_ids = STORAGE.load_done_topic_ids()
         logging.info(f"progress表中已有 {len(done_ids)} 个已完成的topic。")
     except Exception as e:
         logging.error(f"读取 progress 表失败: {e}")
-        
-        
-    # 准备抓 topic
-    url = 'https://artofproblemsolving.com/m/community/ajax.php'
-    data = {
+    return done_ids
+
+# 默认要爬的板块ID,我们选取一个话题数量少的作为验证。https://artofproblemsolving.com/community/c463183_airsoft，这个id是463183
+# 用 --categories 可以传多个
+DEFAULT_CATEGORIES = ['463183']
+
+def topics_request_data(category_id):
+    """
+    fetch_topics 的请求参数，fetch_before 从当前时间开始往前翻。
+    """
+    return {
         'category_type': 'forum',
         'log_visit': '0',
         'required_tag': '',
@@ -92,25 +150,281 @@ def fetch_topics_producer(session, headers, topic_queue):
         'user_id': '0',
         'fetch_archived': '0',
         'fetch_announcements': '0',
-        'category_id': '463183',  # 修改为你要爬的板块ID,我们选取一个话题数量少的作为验证。https://artofproblemsolving.com/community/c463183_airsoft，这个id是463183
+        'category_id': str(category_id),
         'a': 'fetch_topics',
         'aops_logged_in': 'false',
         'aops_user_id': '1',
         'aops_session_id': '21d6f40cfb511982e4424e0e250a9557',
     }
-    retries = 0
-    max_retries = 5
+
+# ============ 增量抓取状态 ============
+# 表结构和读写见 storage.py，这里只是加上日志的薄包装
+
+def ensure_state_tables():
+    STORAGE.ensure_schema()
+
+def load_topic_state():
+    """
+    读取 topic_state => {topic_id: (last_post_time, last_post_number)}。
+    第一次用增量模式时 topic_state 是空的，先用 posts 表里已有的最大 post_number 补一份，
+    last_post_time 记 0，这样这些 topic 下次会从已知的最后一楼之后接着抓一次。
+    """
+    state = STORAGE.load_topic_state()
+    logging.info(f"topic_state 中有 {len(state)} 个topic的增量状态。")
+    return state
+
+def load_checkpoints():
+    """
+    读取 topic_checkpoints => {topic_id: start_post_num}，上次中途退出的大帖从这里接着翻
+    """
+    checkpoints = STORAGE.load_checkpoints()
+    if checkpoints:
+        logging.info(f"有 {len(checkpoints)} 个topic上次没抓完，将从断点继续。")
+    return checkpoints
+
+def load_high_water_mark(category_id):
+    return STORAGE.load_high_water_mark(category_id)
+
+def save_high_water_mark(category_id, high_water_mark):
+    STORAGE.save_high_water_mark(category_id, high_water_mark)
+    logging.info(f"板块 {category_id} 的 high-water mark 更新为 {high_water_mark}")
+
+
+class TopicLister:
+    """
+    fetch_topics 的翻页状态，两个引擎共用，不做任何 IO。
+    决定哪些 topic 需要抓帖子、从第几楼开始抓，以及什么时候停止翻页。
+
+    普通模式: progress 里没有的 topic 才抓，一直翻到没有 topic 为止（原逻辑）。
+    增量模式: progress 里已有、但 last_post_time 比 topic_state 里新的 topic 也要抓，
+             从已知的最后一楼之后开始；翻到比上次 high-water mark 还旧的 topic 就停。
+    """
+
+    def __init__(self, category_id, done_ids, topic_state=None, high_water_mark=0,
+                 incremental=False, checkpoints=None):
+        self.data = topics_request_data(category_id)
+        self.category_id = int(category_id)
+        self.done_ids = done_ids
+        self.topic_state = topic_state or {}
+        self.checkpoints = checkpoints or {}
+        self.incremental = incremental
+        self.high_water_mark = high_water_mark
+        self.new_high_water_mark = high_water_mark
+        self.finished = False   # 是否正常翻到了结尾（只有这样才能推进 high-water mark）
+        self.seen_ids = set()
+        # 按时间窗口并行翻页时多个线程会同时调用 select
+        self._lock = threading.Lock()
+
+    def select(self, topics):
+        """返回本页中需要抓帖子的 topic，续抓起点放在 topic['resume_post_num']"""
+        with self._lock:
+            return self._select(topics)
+
+    def _select(self, topics):
+        selected = []
+        for t in topics:
+            tid = t['topic_id']
+            last_post_time = int(t.get('last_post_time') or 0)
+            self.new_high_water_mark = max(self.new_high_water_mark, last_post_time)
+            # 翻页期间有新回复的 topic 会跑到更新的窗口/页里再出现一次，只取第一次
+            if tid in self.seen_ids:
+                continue
+            self.seen_ids.add(tid)
+
+            if tid not in self.done_ids:
+                if tid in self.checkpoints:
+                    t['resume_post_num'] = self.checkpoints[tid]
+                selected.append(t)
+                continue
+            if not self.incremental:
+                continue
+            known_time, known_number = self.topic_state.get(tid, (0, 0))
+            if last_post_time > known_time:
+                t['resume_post_num'] = max(known_number + 1, self.checkpoints.get(tid, 1))
+                selected.append(t)
+        return selected
+
+    def safe_high_water_mark(self, failed_topics):
+        """
+        这次可以存下的 high-water mark。本次列出来、但没抓完的 topic (failed_topics) 必须还在 mark 之上，
+        不然下次增量翻到 mark 就停，它们要等有人回复才会再出现在列表里
+        """
+        failed_times = [t for tid, t in failed_topics.items() if t and tid in self.seen_ids]
+        if not failed_times:
+            return self.new_high_water_mark
+        return max(self.high_water_mark, min(self.new_high_water_mark, min(failed_times) - 1))
+
+    def leftover_topics(self):
+        """
+        增量模式下翻到 high-water mark 就停了，比它旧、但上次没抓完的 topic
+        (topic_state.last_post_time == 0) 不会出现在列表里，这里单独补回来。
+        """
+        if not (self.incremental and self.finished and self.high_water_mark):
+            return []
+        leftovers = []
+        for tid, (known_time, known_number) in self.topic_state.items():
+            if known_time == 0 and tid not in self.seen_ids:
+                leftovers.append({'topic_id': tid, 'resume_post_num': known_number + 1})
+        return leftovers
+
+    def advance(self, topics):
+        """翻页，返回 False 表示该停了"""
+        last_topic = topics[-1]
+        if 'last_post_time' not in last_topic:
+            self.finished = True
+            return False
+        if self.incremental and int(last_topic['last_post_time']) <= self.high_water_mark:
+            logging.info(f"已翻到上次的 high-water mark ({self.high_water_mark})，停止翻页。")
+            self.finished = True
+            return False
+        self.data['fetch_before'] = str(int(last_topic['last_post_time']) - 1)
+        return True
+
+    def windows(self, oldest, newest, count):
+        """
+        把 (oldest, newest] 等分成 count 个 ListingWindow，从新到旧排列。
+        最旧的窗口一直翻到底 (增量模式下翻到 high-water mark)，所以 oldest 估得不准也不会漏。
+        """
+        floor = self.high_water_mark if self.incremental else 0
+        oldest = max(oldest, floor)
+        step = max(1, (newest - oldest) // count)
+        bounds = [newest - i * step for i in range(count)] + [floor]
+        return [ListingWindow(self, bounds[i + 1], bounds[i]) for i in range(count)
+                if bounds[i] > bounds[i + 1]]
+
+
+class ListingWindow:
+    """
+    TopicLister 的一个时间窗口 (start, end]: 从 fetch_before=end 往前翻，翻过 start 就停。
+    接口和 TopicLister 相同 (data / select / advance / finished / leftover_topics)，
+    list_category_topics 不用区分；选哪些 topic、去重都交回所属的 TopicLister。
+    """
+
+    def __init__(self, lister, start, end):
+        self.lister = lister
+        self.category_id = lister.category_id
+        self.start = start
+        self.end = end
+        self.data = topics_request_data(lister.category_id)
+        self.data['fetch_before'] = str(end)
+        self.finished = False
+
+    def select(self, topics):
+        return self.lister.select(topics)
+
+    def leftover_topics(self):
+        return []
+
+    def advance(self, topics):
+        last_topic = topics[-1]
+        if 'last_post_time' not in last_topic or int(last_topic['last_post_time']) <= self.start:
+            self.finished = True
+            return False
+        self.data['fetch_before'] = str(int(last_topic['last_post_time']) - 1)
+        return True
+
+
+class OldestTopicProbe:
+    """
+    用 fetch_before 二分查找板块里最旧 topic 的 last_post_time，精确到 precision 秒，
+    给按时间窗口并行翻页定范围。和 PostPager 一样只管状态，请求由调用方发:
+        while not probe.done(): probe.record(请求 probe.data 得到的 topics)
+    结束后 (probe.low, probe.high] 里一定有最旧的 topic (板块为空时 high 就是当前时间)。
+    """
+
+    def __init__(self, category_id, precision=3600):
+        self.precision = precision
+        self.low = 0
+        self.high = int(time.time())
+        self.data = topics_request_data(category_id)
+        self.data['fetch_before'] = str((self.low + self.high) // 2)
+
+    def done(self):
+        return self.high - self.low <= self.precision
+
+    def record(self, topics):
+        middle = int(self.data['fetch_before'])
+        if topics:
+            # 比 middle 旧的 topic 存在，本页里最旧的那个就是新的上界
+            self.high = min(int(t.get('last_post_time') or middle) for t in topics)
+        else:
+            self.low = middle
+        self.data['fetch_before'] = str((self.low + self.high) // 2)
+
+
+def topics_of(response_text):
+    try:
+        return json.loads(response_text).get('response', {}).get('topics', [])
+    except ValueError:
+        return None
+
+
+def fetch_topics_producer(session, headers, topic_queue, writer, listers, list_windows=1):
+    """
+    依次翻每个板块的 topic 列表（每个板块一个 TopicLister）。
+    list_windows > 1 时每个板块按时间窗口并行翻页，见 list_category_windows。
+    """
+    for lister in listers:
+        if list_windows > 1:
+            list_category_windows(session, headers, topic_queue, writer, lister, list_windows)
+        else:
+            list_category_topics(session, headers, topic_queue, writer, lister)
+
+
+def find_oldest_topic_time(session, headers, category_id):
+    probe = OldestTopicProbe(category_id)
+    while not probe.done():
+        response = post_ajax(session, headers, probe.data, f"[板块 {category_id} 二分查找]")
+        topics = topics_of(response.text) if response is not None else None
+        if topics is None:
+            return None
+        probe.record(topics)
+    logging.info(f"板块 {category_id} 最旧的 topic 在 {probe.low} 之后")
+    return probe.low
+
+
+def list_category_windows(session, headers, topic_queue, writer, lister, list_windows):
+    """
+    把板块的时间范围切成 list_windows * 4 个窗口，用 list_windows 个线程同时翻页；
+    窗口比线程多，近期 topic 密集的窗口翻得慢也不会拖住其它线程。
+    增量模式下范围就是 (high-water mark, 现在]，不需要先查最旧的 topic。
+    """
+    if lister.incremental and lister.high_water_mark:
+        oldest = lister.high_water_mark
+    else:
+        oldest = find_oldest_topic_time(session, headers, lister.category_id)
+        if oldest is None:
+            logging.error(f"板块 {lister.category_id} 时间范围查找失败，改为顺序翻页")
+            list_category_topics(session, headers, topic_queue, writer, lister)
+            return
+
+    windows = lister.windows(oldest, int(time.time()), list_windows * 4)
+    logging.info(f"板块 {lister.category_id} 分成 {len(windows)} 个时间窗口，{list_windows} 个线程并行翻页")
+    with ThreadPoolExecutor(list_windows, thread_name_prefix="lister") as pool:
+        list(pool.map(lambda w: list_category_topics(session, headers, topic_queue, writer, w), windows))
+
+    lister.finished = all(w.finished for w in windows)
+    for t in lister.leftover_topics():
+        topic_queue.put(t)
+    logging.info(f"板块 {lister.category_id} 所有窗口翻页结束, 共 {len(lister.seen_ids)} 个不同的topic")
+
+def list_category_topics(session, headers, topic_queue, writer, lister):
+    """
+    边抓一个板块的topics边写数据库，并将新的topics放进队列供后续爬帖子。
+    lister 里带着 progress 表的已完成 topic_id，跳过它们实现断点续抓；
+    增量模式下还会挑出有新回复的旧 topic。topics 的写入交给 writer (BulkWriter) 攒批。
+    topic_queue 可以是进程内的 Queue，也可以是多进程共享的 LeaseQueue。
+    """
+    logging.info(f"开始抓板块 {lister.category_id} 的 topic 列表 (fetch_before={lister.data['fetch_before']})")
     total_count = 0
 
-    while retries < max_retries:
+    while True:
+        response = post_ajax(session, headers, lister.data, "fetch_topics")
+        if response is None:
+            break
+        archive_response('topics', lister.category_id, lister.data['fetch_before'], response.text)
         try:
-            response = session.post(url, headers=headers, data=data, timeout=20)
             response_data = response.json()
-        except requests.exceptions.RequestException as e:
-            logging.error(f"fetch_topics 请求异常: {e}")
-            retries += 1
-            time.sleep(5)
-            continue
         except ValueError:
             logging.error("响应不是 JSON 格式")
             break
@@ -119,62 +433,61 @@ def fetch_topics_producer(session, headers, topic_queue):
         topics = content.get('topics', [])
         if not topics:
             logging.info("没有更多 topic 数据，停止。")
+            lister.finished = True
             break
         
-        # 2) 先插数据库
-        insert_topics_batch(conn, topics)
+        # 1) 先插数据库
+        writer.add_topics(topics)
         total_count += len(topics)
+        METRICS.inc('topic_pages_total')
+        METRICS.inc('topics_listed_total', len(topics))
         logging.info(f"本次抓到 {len(topics)} 个topic，累计{total_count}")
 
-        # 3) 跳过progress里已有的，剩下的放队列
-        new_count = 0
-        for t in topics:
-            tid = t['topic_id']
-            if tid not in done_ids:
+        # 2) 跳过progress里已有的（增量模式下保留有新回复的），剩下的放队列
+        selected = lister.select(topics)
+        # 队列满时 put 会阻塞，阻塞时长说明 worker 跟不上
+        with METRICS.timer('lister_blocked_seconds'):
+            for t in selected:
                 topic_queue.put(t)
-                new_count += 1
-        logging.info(f"其中 {new_count} 个topic是新需要抓帖子的。")
+        METRICS.inc('topics_queued_total', len(selected))
+        logging.info(f"其中 {len(selected)} 个topic是新需要抓帖子的。")
 
-        # 4) 翻页
-        last_topic = topics[-1]
-        if 'last_post_time' in last_topic:
-            data['fetch_before'] = str(int(last_topic['last_post_time']) - 1)
-        else:
+        # 3) 翻页（节奏由 RATE_LIMITER 控制，不再固定 sleep）
+        if not lister.advance(topics):
             break
 
-        time.sleep(random.uniform(1, 2))
+    for t in lister.leftover_topics():
+        topic_queue.put(t)
 
-    logging.info(f"Topic 抓取结束, 共获取 {total_count} 个topic(包含已完成的)。")
-    cur.close()
-    conn.close()   # 通知消费者没有更多新topic
+    logging.info(f"板块 {lister.category_id} Topic 抓取结束, 共获取 {total_count} 个topic(包含已完成的)。")
 
 
 # ============ Consumer：抓帖子逻辑(不变，大体) ============
-def fetch_posts_worker(topic_queue, session, headers):
+def fetch_posts_worker(topic_queue, session, headers, writer):
     """
     消费者：不断从 topic_queue 里拿出一个 topic，抓该 topic 的posts
-    并边写 posts表 (每个worker自己开/关MySQL连接)。
+    并把解析好的帖子交给 writer 写 posts表 (worker 自己不再连MySQL)。
     """
     while True:
-        topic = topic_queue.get()
+        # 等 topic 的时间算 idle，抓帖子的时间算 busy
+        with METRICS.timer('worker_idle_seconds'):
+            topic = topic_queue.get()
         if topic is None:
             # 表示没有更多topic
             topic_queue.task_done()
             break
 
+        METRICS.add('workers_busy', 1)
         try:
-            # 每个worker独立连数据库
-            conn = mysql.connector.connect(**DB_CONFIG)
-            cur = conn.cursor()
-
             # === 在这抓帖子 ===
-            fetch_posts_for_topic(topic, session, headers, conn)
-
-            cur.close()
-            conn.close()
+            with METRICS.timer('worker_busy_seconds'):
+                fetch_posts_for_topic(topic, session, headers, writer)
         except Exception as e:
+            METRICS.inc('worker_errors_total')
             logging.error(f"fetch_posts_worker 异常: {e}")
+            writer.mark_failed(topic['topic_id'], topic.get('last_post_time'))
         finally:
+            METRICS.add('workers_busy', -1)
             topic_queue.task_done()
 
     
@@ -183,49 +496,444 @@ def fetch_posts_worker(topic_queue, session, headers):
 
 # ============ 多线程抓取帖子 ============
 
-def fetch_posts_for_topic(topic, session, headers, conn):
+def build_post_params(post, topic_id):
     """
-    同步抓取指定 topic 下的所有帖子，并插入到数据库。
-    返回本次抓取的帖子数量（可用于做统计）。
+    把接口返回的一条 post 转成写 posts 表用的参数字典 (键见 storage.POST_COLUMNS)。
     """
-    topic_id = topic['topic_id']
-    url = 'https://artofproblemsolving.com/m/community/ajax.php'
-    data = {
-        'topic_id': topic_id,
-        'direction': 'forwards',
-        'start_post_id': '-1',
-        'start_post_num': '1',
-        'show_from_time': '-1',
-        'num_to_fetch': '20',
-        'a': 'fetch_posts_for_topic',
-        'aops_logged_in': 'false',
-        'aops_user_id': '1',
-        'aops_session_id': '21d6f40cfb511982e4424e0e250a9557'
+    post_time_unix = post.get('post_time', 0)
+    post_time_dt = datetime.datetime.utcfromtimestamp(post_time_unix)
+
+    # 若 thankers 是 list 或 null，就转成字符串存数据库
+    thankers = post.get('thankers')
+    if thankers is not None:
+        thankers_str = json.dumps(thankers, ensure_ascii=False)
+    else:
+        thankers_str = None
+
+    return {
+        'post_id': int(post['post_id']),
+        'topic_id': int(topic_id),
+        'author': post.get('username'),
+        'post_canonical': post.get('post_canonical', ''),
+        'post_time': post_time_dt,
+        'admin': post.get('admin', False),
+        'attachment': post.get('attachment', False),
+        'avatar': post.get('avatar', ''),
+        'deletable': post.get('deletable', False),
+        'deleted': post.get('deleted', False),
+        'editable': post.get('editable', False),
+        'is_forum_admin': post.get('is_forum_admin', False),
+        'is_nothanked': post.get('is_nothanked', False),
+        'is_thanked': post.get('is_thanked', False),
+        'last_edit_reason': post.get('last_edit_reason', ''),
+        'last_edit_time': post.get('last_edit_time', 0),
+        'last_editor_username': post.get('last_editor_username', ''),
+        'nothanks_received': post.get('nothanks_received', 0),
+        'num_edits': post.get('num_edits', 0),
+        'num_posts': post.get('num_posts', 0),
+        'post_format': post.get('post_format', ''),
+        'post_number': post.get('post_number', 0),
+        'post_rendered': post.get('post_rendered', ''),
+        'poster_id': post.get('poster_id', 0),
+        'reported': post.get('reported', False),
+        'show_from_end': post.get('show_from_end', False),
+        'show_from_start': post.get('show_from_start', False),
+        'thankers': thankers_str,
+        'thanks_received': post.get('thanks_received', 0)
     }
 
-    fetched_post_ids = set()
-    previous_length = 0
-    no_new_posts_count = 0
-    retries = 0
-    max_retries = 5
 
-    cur = conn.cursor()
-    total_inserted = 0  # 统计插入的帖子数量
+class PageSizer:
+    """
+    帖子翻页每次要多少条 (num_to_fetch)，所有 topic 共用一个。
+    先按 max_size 要；服务器少给了、而下一页还有帖子，说明 num_to_fetch 被服务器截断了，
+    之后都按这个上限要。confirmed 是服务器一次实际给过的最多条数：要的不超过它却少给了，就是到结尾了。
+    调小之后每 probe_interval 页按 max_size 试探一次，服务器给得更多 (上限调高了，或者当初判断错了) 就调回去。
+    """
+
+    def __init__(self, max_size=100, probe_interval=50):
+        self.max_size = max_size
+        self.size = max_size
+        self.confirmed = 0
+        self.probe_interval = probe_interval
+        self._pages_since_probe = 0
+        self._lock = threading.Lock()
+
+    def next_size(self):
+        """下一页的 num_to_fetch"""
+        with self._lock:
+            if self.size < self.max_size:
+                self._pages_since_probe += 1
+                if self._pages_since_probe >= self.probe_interval:
+                    self._pages_since_probe = 0
+                    return self.max_size
+            return self.size
+
+    def observe(self, returned):
+        with self._lock:
+            self.confirmed = max(self.confirmed, returned)
+            if returned > self.size:
+                logging.info(f"服务器一页给了 {returned} 条帖子，num_to_fetch 从 {self.size} 调回 {returned}")
+                self.size = min(self.max_size, returned)
+
+    def limit(self, returned):
+        """没到结尾却只给了 returned 条：服务器的上限就是它"""
+        with self._lock:
+            if 0 < returned < self.size:
+                logging.info(f"服务器每页最多返回 {returned} 条帖子，num_to_fetch 从 {self.size} 调为 {returned}")
+                self.size = returned
+                self._pages_since_probe = 0
+
+
+# 所有 PostPager 默认共用，main() 里按 --page-size 重建
+PAGE_SIZER = PageSizer()
+
+
+class PostPager:
+    """
+    单个 topic 的翻页状态，线程引擎和 asyncio 引擎共用。
+    只负责"请求参数是什么、哪些帖子是新的、什么时候该停"，不做任何 IO。
+
+    num_posts 是 topic 列表里的帖子总数：知道它就能在最后一页之后直接停，不用再多请求一次空页。
+    补抓 / 租约领来的 topic 没有它，靠"短页"和"连续两次没有新帖子"判断结尾。
+    """
+
+    def __init__(self, topic_id, start_post_num=1, num_posts=None, sizer=None):
+        self.topic_id = topic_id
+        self.sizer = sizer or PAGE_SIZER
+        self.num_posts = int(num_posts) if num_posts else None
+        self.data = {
+            'topic_id': topic_id,
+            'direction': 'forwards',
+            'start_post_id': '-1',
+            'start_post_num': str(start_post_num),
+            'show_from_time': '-1',
+            'num_to_fetch': str(self.sizer.next_size()),
+            'a': 'fetch_posts_for_topic',
+            'aops_logged_in': 'false',
+            'aops_user_id': '1',
+            'aops_session_id': '21d6f40cfb511982e4424e0e250a9557'
+        }
+        self.fetched_post_ids = set()
+        self.previous_length = 0
+        self.no_new_posts_count = 0
+        self.last_post_number = start_post_num - 1   # 已抓到的最大 post_number
+        self._short_page = None   # 上一页比要的少，但还不知道是到结尾了还是被服务器截断了
+
+    def exhausted(self):
+        """续抓起点已经在最后一帖之后 (增量时没有新回复)，一次都不用请求"""
+        return self.num_posts is not None and int(self.data['start_post_num']) > self.num_posts
+
+    def new_posts(self, posts):
+        """过滤掉没有 post_id 或已经抓过的帖子"""
+        fresh = []
+        for post in posts:
+            post_id = post.get('post_id')
+            if not post_id:
+                continue
+            if post_id in self.fetched_post_ids:
+                continue
+            self.fetched_post_ids.add(post_id)
+            self.last_post_number = max(self.last_post_number, int(post.get('post_number') or 0))
+            fresh.append(post)
+        return fresh
+
+    def checkpoint(self):
+        """下一页的 start_post_num，随本页帖子一起提交，重启后从这里继续"""
+        return (self.topic_id, int(self.data['start_post_num']))
+
+    def advance(self, posts):
+        """
+        翻到下一页 (posts 非空)。返回 False 表示已经是最后一页了:
+        - 知道 num_posts 时，这一页已经覆盖到最后一帖
+        - 不知道 num_posts 时，要的不超过服务器给过的条数，却少给了
+        - 兜底: 连续两次没有新帖子
+        其他少给了的页先记在 _short_page，下一页还有帖子才确认是服务器截断、调小 sizer；
+        列表里的 num_posts 可能是旧的 (帖子被删了)，不能单凭它认定短页是截断，这时多请求一次空页结束
+        """
+        requested = int(self.data['num_to_fetch'])
+        next_start = int(self.data['start_post_num']) + len(posts)
+        self.data['start_post_num'] = str(next_start)
+        self.sizer.observe(len(posts))
+        if self._short_page is not None:
+            # 上一页少给了，这一页还有帖子：那是服务器截断，不是结尾
+            self.sizer.limit(self._short_page)
+            self._short_page = None
+
+        if len(self.fetched_post_ids) == self.previous_length:
+            self.no_new_posts_count += 1
+        else:
+            self.no_new_posts_count = 0
+        self.previous_length = len(self.fetched_post_ids)
+        if self.no_new_posts_count >= 2:
+            return False
+
+        if self.num_posts is not None and next_start > self.num_posts:
+            return False
+        if len(posts) < requested:
+            if self.num_posts is None and requested <= self.sizer.confirmed:
+                return False
+            self._short_page = len(posts)
+
+        self.data['num_to_fetch'] = str(self.sizer.next_size())
+        return True
+
+
+# ============ 批量写库 ============
+
+def estimate_bytes(items):
+    """
+    粗略估算一批 topic / post 字典占的内存：字符串按长度算，其余字段每个按 64 字节算。
+    只用来做内存预算，不需要精确。
+    """
+    total = 0
+    for item in items:
+        for value in item.values():
+            total += len(value) + 64 if isinstance(value, str) else 64
+    return total
+
+
+class BulkWriter:
+    """
+    独立的写库线程。crawl worker 只把解析好的 topics / posts / 完成标记丢进来,
+    这里攒够 batch_size 行或者距上次提交超过 flush_interval 秒就交给 STORAGE.write_batch
+    一次写入 (MySQL / SQLite 都是 executemany + 一个事务，Parquet 是每张表一个 part 文件)。
+
+    所有东西走同一个 FIFO 队列，某个 topic 的 progress 标记一定排在它的帖子后面，
+    所以 "progress 里有 => 帖子已落库" 这个语义不变。每页帖子附带的断点
+    (topic_checkpoints) 和帖子在同一个事务里提交，topic 完成时删掉断点。
+    重试用完也没翻完的 topic 走 mark_failed: 断点留着，不写 progress / topic_state，
+    下次运行 (或者别的进程认领租约后) 从断点接着翻。
+
+    内存上限: 还没落库的数据 (队列里 + 缓冲区里) 估算超过 max_pending_bytes 时，
+    add_topics / add_leases / add_posts 会阻塞，直到 writer 提交掉一批。数据库慢或者断开时
+    worker 就停下来等，而不是把帖子越攒越多。asyncio 引擎里阻塞的是整个事件循环，
+    效果一样是所有协程暂停抓取。mark_done 不占预算，永远不阻塞。
+
+    "topic 抓完" 事件: mark_done 可以带一个 event，这个 topic 的 progress 提交成功之后，
+    在 writer 线程里调用 on_done(*event) (--build-trees 时是 TreeBuilder.topic_done)。
+    on_done 慢了 writer 就跟着慢，最后一样是抓取暂停等它。
+    on_settled(topic_ids): 每次提交成功后，用这批里 done / failed 的 topic_id 调一次
+    (--lease 时是 LeaseQueue.release，租约状态落库之后才允许把同一个 topic 再发出去)。
+    """
+
+    def __init__(self, batch_size=500, flush_interval=2.0, max_pending_bytes=256 * 1024 * 1024, on_done=None):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending_bytes = max_pending_bytes
+        self._pending_bytes = 0       # 已经 add 进来、还没提交成功的估算字节数
+        self._batch_bytes = 0         # 其中已经从队列取进缓冲区的部分
+        self._capacity = threading.Condition()
+        self._failing = False
+        self._queue = Queue()
+        self._thread = Thread(target=self._run, name="bulk-writer", daemon=True)
+        self._topics = []
+        self._posts = []
+        self._leases = []
+        self._checkpoints = {}
+        self._done = []
+        self._failed = []
+        self._events = []
+        self.failed_topics = {}
+        self.on_done = on_done
+        self.on_settled = None
+        # 累计写入量和每次批量提交的耗时
+        self.stats = {'topics': 0, 'posts': 0, 'unchanged_posts': 0, 'done': 0,
+                      'flush_seconds': [], 'peak_pending_bytes': 0}
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _put(self, kind, payload, size):
+        """超出内存预算就等 writer 提交；缓冲区是空的时候单个大批次也放行，避免永远等下去"""
+        with self._capacity:
+            while self._pending_bytes and self._pending_bytes + size > self.max_pending_bytes:
+                self._capacity.wait()
+            self._pending_bytes += size
+            self.stats['peak_pending_bytes'] = max(self.stats['peak_pending_bytes'], self._pending_bytes)
+        self._queue.put((kind, payload, size))
+
+    def _release(self, size):
+        with self._capacity:
+            self._pending_bytes -= size
+            self._capacity.notify_all()
+
+    def add_topics(self, topics):
+        self._put('topics', topics, estimate_bytes(topics))
+
+    def add_leases(self, topics):
+        """--lease 模式下 lister 发现的待抓 topic，写进 topic_leases"""
+        self._put('leases', topics, estimate_bytes(topics))
+
+    def add_posts(self, rows, checkpoint=None):
+        """checkpoint = (topic_id, 下一页 start_post_num)"""
+        if rows or checkpoint:
+            self._put('posts', (rows, checkpoint), estimate_bytes(rows))
+
+    def mark_done(self, topic_id, last_post_time=0, last_post_number=0, event=None):
+        self._queue.put(('done', ((topic_id, last_post_time, last_post_number), event), 0))
 
-    while retries < max_retries:
+    def mark_failed(self, topic_id, last_post_time=None):
+        """
+        topic 没抓完就放弃了: 保留断点，--lease 模式下把租约置为 'failed' 交出去。
+        本次运行放弃的 topic 记在 failed_topics {topic_id: 列表里的 last_post_time}，
+        main() 推进 high-water mark 时不能越过它们
+        """
+        self.failed_topics[topic_id] = int(last_post_time or 0)
+        self._queue.put(('failed', topic_id, 0))
+
+    def idle(self):
+        """队列和缓冲区都空了（粗略判断，LeaseQueue 用来确认 lister 的输出都已落库）"""
+        return self._queue.empty() and not (self._pending() or self._leases or self._done or self._failed)
+
+    def close(self):
+        """把剩下的都写完再返回"""
+        self._queue.put(('close', None, 0))
+        self._thread.join()
+
+    def _pending(self):
+        return len(self._topics) + len(self._posts) + len(self._leases)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        closing = False
+        while not closing:
+            timeout = max(0.0, self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                kind, payload, size = self._queue.get(timeout=timeout)
+                self._batch_bytes += size
+                if kind == 'topics':
+                    self._topics.extend(payload)
+                elif kind == 'leases':
+                    self._leases.extend(payload)
+                elif kind == 'posts':
+                    rows, checkpoint = payload
+                    self._posts.extend(rows)
+                    if checkpoint:
+                        self._checkpoints[checkpoint[0]] = checkpoint[1]
+                elif kind == 'done':
+                    done, event = payload
+                    self._done.append(done)
+                    if event is not None:
+                        self._events.append(event)
+                elif kind == 'failed':
+                    self._failed.append(payload)
+                else:
+                    closing = True
+            except Empty:
+                pass
+
+            # 攒够行数、或者攒到内存预算的一半就提交，别让 add_* 的调用方等到 flush_interval；
+            # 上次提交失败时只按 flush_interval 重试，不要在数据库断开时空转
+            full = (self._pending() >= self.batch_size
+                    or self._batch_bytes * 2 >= self.max_pending_bytes)
+            if (closing or (full and not self._failing)
+                    or time.monotonic() - last_flush >= self.flush_interval):
+                if self._pending() or self._done or self._failed or self._checkpoints:
+                    self._flush()
+                last_flush = time.monotonic()
+
+    def _flush(self):
+        topics, posts, leases = self._topics, self._posts, self._leases
+        checkpoints, done, failed, events = self._checkpoints, self._done, self._failed, self._events
+        self._topics, self._posts, self._leases, self._checkpoints, self._done = [], [], [], {}, []
+        self._failed, self._events = [], []
+        batch_bytes, self._batch_bytes = self._batch_bytes, 0
+
+        start = time.monotonic()
         try:
-            response = session.post(url, headers=headers, data=data, timeout=20)
-        except requests.exceptions.RequestException as e:
-            logging.error(f"[topic_id={topic_id}] 请求异常: {e}")
-            retries += 1
-            time.sleep(random.uniform(1, 2))
-            continue
+            skipped = STORAGE.write_batch(topics, posts, leases, list(checkpoints.items()), done, failed)
+            self._record_flush(topics, posts, done, start)
+            self.stats['unchanged_posts'] += skipped
+            METRICS.observe('db_batch_seconds', time.monotonic() - start)
+            METRICS.inc('db_posts_written_total', len(posts) - skipped)
+            METRICS.inc('db_posts_unchanged_total', skipped)
+            METRICS.inc('db_topics_done_total', len(done))
+            self._release(batch_bytes)
+            self._failing = False
+            logging.info(f"BulkWriter 提交 {len(topics)} 个topic, {len(posts)} 条帖子 "
+                         f"(其中 {skipped} 条内容没变未重写), {len(done)} 个progress, "
+                         f"耗时 {time.monotonic() - start:.2f}s")
+        except Exception as e:
+            # 数据库暂时不可用: 放回缓冲区，下次 flush 再试
+            METRICS.inc('db_batch_failures_total')
+            logging.error(f"BulkWriter 写库失败，{len(posts)} 条帖子留待下次提交: {e}")
+            self._topics[:0] = topics
+            self._posts[:0] = posts
+            self._leases[:0] = leases
+            self._checkpoints = {**checkpoints, **self._checkpoints}
+            self._done[:0] = done
+            self._failed[:0] = failed
+            self._events[:0] = events
+            self._batch_bytes += batch_bytes
+            self._failing = True
+            return
+        if self.on_settled and (done or failed):
+            self.on_settled([d[0] for d in done] + list(failed))
+        self._emit(events)
 
-        if response.status_code != 200:
-            logging.error(f"[topic_id={topic_id}] 请求失败，状态码: {response.status_code}")
-            retries += 1
-            time.sleep(random.uniform(1, 2))
-            continue
+    def _emit(self, events):
+        for event in events:
+            try:
+                self.on_done(*event)
+            except Exception as e:
+                METRICS.inc('topic_done_handler_failures_total')
+                logging.error(f"[topic_id={event[0]}] topic 抓完事件处理失败: {e}")
+
+    def _record_flush(self, topics, posts, done, start):
+        self.stats['topics'] += len(topics)
+        self.stats['posts'] += len(posts)
+        self.stats['done'] += len(done)
+        self.stats['flush_seconds'].append(time.monotonic() - start)
+
+
+def topic_done_event(topic, tree_posts):
+    """
+    --build-trees 时 "topic 抓完" 事件的参数: (topic_id, topic_title, 这次抓到的帖子, 是否从第 1 帖抓起)，
+    见 TreeBuilder.topic_done
+    """
+    if tree_posts is None:
+        return None
+    return (topic['topic_id'], topic.get('topic_title'), tree_posts, topic.get('resume_post_num', 1) == 1)
+
+
+def finish_topic(topic, pager, writer, completed, tree_posts):
+    """
+    翻完的写 progress / topic_state 并删断点；重试用完放弃的只发 mark_failed，
+    断点留着，这次运行不再管它，下次运行从断点续抓
+    """
+    topic_id = topic['topic_id']
+    if not completed:
+        METRICS.inc('topics_failed_total')
+        logging.error(f"[topic_id={topic_id}] 没有抓完，保留断点 start_post_num={pager.checkpoint()[1]}")
+        writer.mark_failed(topic_id, topic.get('last_post_time'))
+        return
+    # 补抓的 topic 没有列表里的 last_post_time，用本次抓取时间代替：之后的新回复一定比它晚
+    last_post_time = int(topic.get('last_post_time') or time.time())
+    METRICS.inc('topics_completed_total')
+    writer.mark_done(topic_id, last_post_time, pager.last_post_number, topic_done_event(topic, tree_posts))
+    archive_response('done', topic_id, 0, {'last_post_time': last_post_time,
+                                           'last_post_number': pager.last_post_number})
+
+
+def fetch_posts_for_topic(topic, session, headers, writer):
+    """
+    同步抓取指定 topic 下的所有帖子，并交给 writer 写入数据库。
+    返回本次抓取的帖子数量（可用于做统计）。
+    """
+    topic_id = topic['topic_id']
+    pager = PostPager(topic_id, topic.get('resume_post_num', 1), topic.get('num_posts'))
+    # 正常翻到结尾才记录 last_post_time，失败的下次增量还会再抓；增量时没有新回复的直接算翻完
+    completed = pager.exhausted()
+    total_fetched = 0  # 统计抓到的帖子数量
+    tree_posts = [] if TREE_BUILDER is not None else None
+
+    while not completed:
+        response = post_ajax(session, headers, pager.data, f"[topic_id={topic_id}]")
+        if response is None:
+            break
+        archive_response('posts', topic_id, pager.data['start_post_num'], response.text)
 
         try:
             response_data = response.json()
@@ -236,193 +944,385 @@ def fetch_posts_for_topic(topic, session, headers, conn):
         posts = response_data.get('response', {}).get('posts', [])
         if not posts:
             logging.info(f"[topic_id={topic_id}] 无更多帖子可爬，结束。")
+            completed = True
             break
 
-        for post in posts:
-            post_id = post.get('post_id')
-            if not post_id:
-                continue
-            if post_id in fetched_post_ids:
-                continue
-            fetched_post_ids.add(post_id)
-
-
-            post_time_unix = post.get('post_time', 0)
-            post_time_dt = datetime.datetime.utcfromtimestamp(post_time_unix)
-
-            # ========== 新增: 取出所有额外字段 ==========
-            admin = post.get('admin', False)
-            attachment = post.get('attachment', False)
-            avatar = post.get('avatar', '')
-            deletable = post.get('deletable', False)
-            deleted = post.get('deleted', False)
-            editable = post.get('editable', False)
-            is_forum_admin = post.get('is_forum_admin', False)
-            is_nothanked = post.get('is_nothanked', False)
-            is_thanked = post.get('is_thanked', False)
-            last_edit_reason = post.get('last_edit_reason', '')
-            last_edit_time = post.get('last_edit_time', 0)
-            last_editor_username = post.get('last_editor_username', '')
-            nothanks_received = post.get('nothanks_received', 0)
-            num_edits = post.get('num_edits', 0)
-            num_posts = post.get('num_posts', 0)
-            post_canonical = post.get('post_canonical', '')
-            post_format = post.get('post_format', '')
-            post_number = post.get('post_number', 0)
-            post_rendered = post.get('post_rendered', '')
-            poster_id = post.get('poster_id', 0)
-            reported = post.get('reported', False)
-            show_from_end = post.get('show_from_end', False)
-            show_from_start = post.get('show_from_start', False)
-            thankers = post.get('thankers')
-            thanks_received = post.get('thanks_received', 0)
-
-            # 若 thankers 是 list 或 null，就转成字符串存数据库
-            if thankers is not None:
-                thankers_str = json.dumps(thankers, ensure_ascii=False)
-            else:
-                thankers_str = None
-
-
-            # MySQL upsert 写法
-            insert_sql = """
-                INSERT INTO posts(
-                    post_id, topic_id, author, post_canonical, post_time, 
-                    admin, attachment, avatar, deletable, deleted, editable,
-                    is_forum_admin, is_nothanked, is_thanked, last_edit_reason,
-                    last_edit_time, last_editor_username, nothanks_received,
-                    num_edits, num_posts,  post_format, post_number,
-                    post_rendered, poster_id, reported, show_from_end, show_from_start,
-                    thankers, thanks_received
-                )
-                VALUES (
-                    %(post_id)s, %(topic_id)s, %(author)s, %(post_canonical)s, %(post_time)s, 
-                    %(admin)s, %(attachment)s, %(avatar)s, %(deletable)s, %(deleted)s, %(editable)s,
-                    %(is_forum_admin)s, %(is_nothanked)s, %(is_thanked)s, %(last_edit_reason)s,
-                    %(last_edit_time)s, %(last_editor_username)s, %(nothanks_received)s,
-                    %(num_edits)s, %(num_posts)s,  %(post_format)s, %(post_number)s,
-                    %(post_rendered)s, %(poster_id)s, %(reported)s, %(show_from_end)s, %(show_from_start)s,
-                    %(thankers)s, %(thanks_received)s
-                )
-                ON DUPLICATE KEY UPDATE
-                    topic_id = VALUES(topic_id),
-                    author = VALUES(author),
-                    post_canonical = VALUES(post_canonical),
-                    post_time = VALUES(post_time),
-                    admin = VALUES(admin),
-                    attachment = VALUES(attachment),
-                    avatar = VALUES(avatar),
-                    deletable = VALUES(deletable),
-                    deleted = VALUES(deleted),
-                    editable = VALUES(editable),
-                    is_forum_admin = VALUES(is_forum_admin),
-                    is_nothanked = VALUES(is_nothanked),
-                    is_thanked = VALUES(is_thanked),
-                    last_edit_reason = VALUES(last_edit_reason),
-                    last_edit_time = VALUES(last_edit_time),
-                    last_editor_username = VALUES(last_editor_username),
-                    nothanks_received = VALUES(nothanks_received),
-                    num_edits = VALUES(num_edits),
-                    num_posts = VALUES(num_posts),
-                    
-                    post_format = VALUES(post_format),
-                    post_number = VALUES(post_number),
-                    post_rendered = VALUES(post_rendered),
-                    poster_id = VALUES(poster_id),
-                    reported = VALUES(reported),
-                    show_from_end = VALUES(show_from_end),
-                    show_from_start = VALUES(show_from_start),
-                    thankers = VALUES(thankers),
-                    thanks_received = VALUES(thanks_received)
-            """
-            params = {
-                'post_id': int(post_id),
-                'topic_id': int(topic_id),
-                'author': post.get('username'),
-                'post_canonical': post_canonical, 
-                'post_time': post_time_dt,
-                'admin': admin,
-                'attachment': attachment,
-                'avatar': avatar,
-                'deletable': deletable,
-                'deleted': deleted,
-                'editable': editable,
-                'is_forum_admin': is_forum_admin,
-                'is_nothanked': is_nothanked,
-                'is_thanked': is_thanked,
-                'last_edit_reason': last_edit_reason,
-                'last_edit_time': last_edit_time,
-                'last_editor_username': last_editor_username,
-                'nothanks_received': nothanks_received,
-                'num_edits': num_edits,
-                'num_posts': num_posts,
-                'post_format': post_format,
-                'post_number': post_number,
-                'post_rendered': post_rendered,
-                'poster_id': poster_id,
-                'reported': reported,
-                'show_from_end': show_from_end,
-                'show_from_start': show_from_start,
-                'thankers': thankers_str,
-                'thanks_received': thanks_received
-            }
+        rows = [build_post_params(post, topic_id) for post in pager.new_posts(posts)]
+        more = pager.advance(posts)
+        METRICS.inc('post_pages_total')
+        METRICS.inc('posts_fetched_total', len(rows))
+        # 本页帖子和下一页的断点一起提交
+        writer.add_posts(rows, pager.checkpoint())
+        total_fetched += len(rows)
+        if tree_posts is not None:
+            tree_posts.extend(tree_post(r) for r in rows)
+        
+        logging.info(f"[topic_id={topic_id}] 开始抓posts...")
 
+        # 到最后一页就退出 (见 PostPager.advance)
+        if not more:
+            logging.info(f"[topic_id={topic_id}] 已到最后一页，结束。")
+            completed = True
+            break
 
+        logging.debug(f"[topic_id={topic_id}] 本批新增 {len(posts)} 条帖子, 累计爬取 {len(pager.fetched_post_ids)}")
 
+    finish_topic(topic, pager, writer, completed, tree_posts)
+    return total_fetched
+  
 
-            try:
-                cur.execute(insert_sql, params)
-                if cur.rowcount > 0:
-                    total_inserted += 1
+# ============ asyncio 引擎 ============
+# 和上面的线程版语义相同：一个 producer 抓 topic 列表并填队列，
+# N 个协程 worker 并发抓帖子，抓完写 progress。
+# HTTP 走 aiohttp；写库交给 BulkWriter 线程，协程里只剩读 progress 需要 asyncio.to_thread。
 
-            except Exception as e:
-                logging.error(f"[topic_id={topic_id}] 插入帖子 {post_id} 失败: {e}")
+async def post_ajax_async(http, data, log_prefix):
+    """
+    post_ajax 的协程版本，返回响应文本；连续失败 MAX_RETRIES 次返回 None。
+    """
+    action = data.get('a')
+    for attempt in range(1, MAX_RETRIES + 1):
+        wait_start = time.monotonic()
+        await RATE_LIMITER.acquire_async()
+        METRICS.inc('rate_limit_wait_seconds', time.monotonic() - wait_start)
+        start = time.monotonic()
+        try:
+            async with http.post(AJAX_URL, data=data) as response:
+                status = response.status
+                retry_after = response.headers.get('Retry-After')
+                text = await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            record_request(action, time.monotonic() - start, None, attempt)
+            logging.error(f"{log_prefix} 请求异常: {e}")
+            await asyncio.sleep(RATE_LIMITER.backoff(attempt))
+            continue
 
-        conn.commit()
-        
-        logging.info(f"[topic_id={topic_id}] 开始抓posts...")
+        record_request(action, time.monotonic() - start, status, attempt)
+        if status != 200:
+            logging.error(f"{log_prefix} 请求失败，状态码: {status}")
+            await asyncio.sleep(RATE_LIMITER.backoff(attempt, retry_after))
+            continue
+        return text
+
+    METRICS.inc('requests_given_up_total')
+    logging.error(f"{log_prefix} 超过最大重试次数，放弃。")
+    return None
 
-        data['start_post_num'] = str(int(data['start_post_num']) + len(posts))
 
-        if len(fetched_post_ids) == previous_length:
-            no_new_posts_count += 1
+async def fetch_topics_producer_async(http, topic_queue, writer, listers, list_windows=1):
+    """
+    fetch_topics_producer 的协程版本：依次翻每个板块，新的topic放进 asyncio.Queue / AsyncLeaseQueue。
+    """
+    for lister in listers:
+        if list_windows > 1:
+            await list_category_windows_async(http, topic_queue, writer, lister, list_windows)
         else:
-            no_new_posts_count = 0
-        previous_length = len(fetched_post_ids)
+            await list_category_topics_async(http, topic_queue, writer, lister)
+
+
+async def find_oldest_topic_time_async(http, category_id):
+    probe = OldestTopicProbe(category_id)
+    while not probe.done():
+        text = await post_ajax_async(http, probe.data, f"[板块 {category_id} 二分查找]")
+        topics = topics_of(text) if text is not None else None
+        if topics is None:
+            return None
+        probe.record(topics)
+    logging.info(f"板块 {category_id} 最旧的 topic 在 {probe.low} 之后")
+    return probe.low
+
+
+async def list_category_windows_async(http, topic_queue, writer, lister, list_windows):
+    """list_category_windows 的协程版本，用信号量限制同时在翻的窗口数"""
+    if lister.incremental and lister.high_water_mark:
+        oldest = lister.high_water_mark
+    else:
+        oldest = await find_oldest_topic_time_async(http, lister.category_id)
+        if oldest is None:
+            logging.error(f"板块 {lister.category_id} 时间范围查找失败，改为顺序翻页")
+            await list_category_topics_async(http, topic_queue, writer, lister)
+            return
+
+    windows = lister.windows(oldest, int(time.time()), list_windows * 4)
+    logging.info(f"板块 {lister.category_id} 分成 {len(windows)} 个时间窗口，{list_windows} 个协程并行翻页")
+    semaphore = asyncio.Semaphore(list_windows)
+
+    async def list_window(window):
+        async with semaphore:
+            await list_category_topics_async(http, topic_queue, writer, window)
 
-        # 如果连续两次没有新帖子，就退出
-        if no_new_posts_count >= 2:
-            logging.info(f"[topic_id={topic_id}] 连续2次无新帖子，结束。")
+    await asyncio.gather(*(list_window(w) for w in windows))
+
+    lister.finished = all(w.finished for w in windows)
+    for t in lister.leftover_topics():
+        await topic_queue.put(t)
+    logging.info(f"板块 {lister.category_id} 所有窗口翻页结束, 共 {len(lister.seen_ids)} 个不同的topic")
+
+
+async def list_category_topics_async(http, topic_queue, writer, lister):
+    logging.info(f"开始抓板块 {lister.category_id} 的 topic 列表 (fetch_before={lister.data['fetch_before']})")
+    total_count = 0
+
+    while True:
+        text = await post_ajax_async(http, lister.data, "fetch_topics")
+        if text is None:
+            break
+        archive_response('topics', lister.category_id, lister.data['fetch_before'], text)
+        try:
+            response_data = json.loads(text)
+        except ValueError:
+            logging.error("响应不是 JSON 格式")
             break
 
-        logging.debug(f"[topic_id={topic_id}] 本批新增 {len(posts)} 条帖子, 累计爬取 {len(fetched_post_ids)}")
-        time.sleep(random.uniform(1, 2))
+        content = response_data.get('response', {})
+        topics = content.get('topics', [])
+        if not topics:
+            logging.info("没有更多 topic 数据，停止。")
+            lister.finished = True
+            break
 
-    if retries >= max_retries:
-        logging.error(f"[topic_id={topic_id}] 超过最大重试次数，放弃。")
+        writer.add_topics(topics)
+        total_count += len(topics)
+        METRICS.inc('topic_pages_total')
+        METRICS.inc('topics_listed_total', len(topics))
+        logging.info(f"本次抓到 {len(topics)} 个topic，累计{total_count}")
 
-    # 爬完后更新 progress
+        selected = lister.select(topics)
+        put_start = time.monotonic()
+        for t in selected:
+            await topic_queue.put(t)
+        METRICS.inc('lister_blocked_seconds', time.monotonic() - put_start)
+        METRICS.inc('topics_queued_total', len(selected))
+        logging.info(f"其中 {len(selected)} 个topic是新需要抓帖子的。")
 
-    # 原逻辑是 "ON CONFLICT DO NOTHING", 用 MySQL 可用 INSERT IGNORE or ON DUP KEY
-    try:
-      with conn.cursor() as c:
-        c.execute("INSERT IGNORE INTO progress(topic_id) VALUES(%s)", (topic_id,))
-      conn.commit()
-    except Exception as e:
-      logging.error(f"[topic_id={topic_id}] 插入进度表失败: {e}")
+        if not lister.advance(topics):
+            break
+
+    for t in lister.leftover_topics():
+        await topic_queue.put(t)
+
+    logging.info(f"板块 {lister.category_id} Topic 抓取结束, 共获取 {total_count} 个topic(包含已完成的)。")
+
+
+async def fetch_posts_for_topic_async(topic, http, writer):
+    """
+    fetch_posts_for_topic 的协程版本。等待 HTTP 响应时不占线程，
+    所以可以同时挂起几百个 topic。
+    """
+    topic_id = topic['topic_id']
+    pager = PostPager(topic_id, topic.get('resume_post_num', 1), topic.get('num_posts'))
+    # 正常翻到结尾才记录 last_post_time，失败的下次增量还会再抓；增量时没有新回复的直接算翻完
+    completed = pager.exhausted()
+    total_fetched = 0
+    tree_posts = [] if TREE_BUILDER is not None else None
+
+    while not completed:
+        text = await post_ajax_async(http, pager.data, f"[topic_id={topic_id}]")
+        if text is None:
+            break
+        archive_response('posts', topic_id, pager.data['start_post_num'], text)
+
+        try:
+            response_data = json.loads(text)
+        except ValueError:
+            logging.error(f"[topic_id={topic_id}] 响应非 JSON 格式。内容: {text}")
+            break
+
+        posts = response_data.get('response', {}).get('posts', [])
+        if not posts:
+            logging.info(f"[topic_id={topic_id}] 无更多帖子可爬，结束。")
+            completed = True
+            break
+
+        rows = [build_post_params(post, topic_id) for post in pager.new_posts(posts)]
+        more = pager.advance(posts)
+        METRICS.inc('post_pages_total')
+        METRICS.inc('posts_fetched_total', len(rows))
+        writer.add_posts(rows, pager.checkpoint())
+        total_fetched += len(rows)
+        if tree_posts is not None:
+            tree_posts.extend(tree_post(r) for r in rows)
+
+        if not more:
+            logging.info(f"[topic_id={topic_id}] 已到最后一页，结束。")
+            completed = True
+            break
+
+        logging.debug(f"[topic_id={topic_id}] 本批新增 {len(posts)} 条帖子, 累计爬取 {len(pager.fetched_post_ids)}")
+
+    finish_topic(topic, pager, writer, completed, tree_posts)
+    return total_fetched
+
+
+async def fetch_posts_worker_async(topic_queue, http, writer):
+    """
+    协程版消费者：从 asyncio.Queue 取 topic，直到拿到 None。
+    """
+    while True:
+        idle_start = time.monotonic()
+        topic = await topic_queue.get()
+        METRICS.inc('worker_idle_seconds', time.monotonic() - idle_start)
+        if topic is None:
+            topic_queue.task_done()
+            break
+
+        METRICS.add('workers_busy', 1)
+        busy_start = time.monotonic()
+        try:
+            await fetch_posts_for_topic_async(topic, http, writer)
+        except Exception as e:
+            METRICS.inc('worker_errors_total')
+            logging.error(f"fetch_posts_worker_async 异常: {e}")
+            writer.mark_failed(topic['topic_id'], topic.get('last_post_time'))
+        finally:
+            METRICS.inc('worker_busy_seconds', time.monotonic() - busy_start)
+            METRICS.add('workers_busy', -1)
+            topic_queue.task_done()
+
+
+async def async_main(headers, concurrency, writer, listers, topic_queue, list_windows=1):
+    """
+    asyncio 引擎入口：1 个 producer 协程 + concurrency 个 worker 协程，全部跑在一个线程里。
+    topic_queue 为 asyncio.Queue 或 AsyncLeaseQueue。
+    """
+    if aiohttp is None:
+        raise RuntimeError("asyncio 引擎需要先安装 aiohttp: pip install aiohttp")
+
+    # 所有协程共用一个连接池: 每个抓帖子的 worker + 每个并行翻页的窗口各一个连接，keep-alive 复用；
+    # Accept-Encoding 由 aiohttp 按本机能解压的格式自动加 (gzip/deflate，装了 Brotli 还有 br)
+    connector = aiohttp.TCPConnector(limit=concurrency + list_windows, keepalive_timeout=60,
+                                     ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=20)
+    async with aiohttp.ClientSession(headers=headers, connector=connector,
+                                     timeout=timeout, trust_env=False) as http:
+        workers = [asyncio.create_task(fetch_posts_worker_async(topic_queue, http, writer))
+                   for _ in range(concurrency)]
+        try:
+            await fetch_topics_producer_async(http, topic_queue, writer, listers, list_windows)
+        finally:
+            # 通知所有 worker 没有更多 topic
+            for _ in range(concurrency):
+                await topic_queue.put(None)
+        await asyncio.gather(*workers)
+
+
+# ============ 离线重放 ============
+
+def replay_archive(directory, writer):
+    """
+    按归档顺序把原始响应重新解析写库，不发任何网络请求。
+    修了解析 bug 或者想多存字段时，改 build_post_params 之后重放一遍即可。
+    """
+    counts = {'topics': 0, 'posts': 0, 'done': 0}
+    for record in ArchiveReader(directory).iter_records():
+        kind = record['kind']
+        if kind == 'done':
+            body = record['body']
+            writer.mark_done(record['key'], body['last_post_time'], body['last_post_number'])
+            counts['done'] += 1
+            continue
+
+        try:
+            content = json.loads(record['body']).get('response', {})
+        except ValueError:
+            logging.error(f"归档中 {kind} key={record['key']} page={record['page']} 不是 JSON，跳过")
+            continue
+
+        if kind == 'topics':
+            topics = content.get('topics', [])
+            if topics:
+                writer.add_topics(topics)
+                counts['topics'] += len(topics)
+        elif kind == 'posts':
+            rows = [build_post_params(post, record['key'])
+                    for post in content.get('posts', []) if post.get('post_id')]
+            writer.add_posts(rows)
+            counts['posts'] += len(rows)
+
+    logging.info(f"重放完毕: {counts['topics']} 个topic, {counts['posts']} 条帖子, "
+                 f"{counts['done']} 个完成标记")
+    return counts
 
-    cur.close()
-    return total_inserted
-  
 
 # ============ 主函数 ============
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="AoPS 论坛帖子爬虫")
+    parser.add_argument('--engine', choices=['thread', 'async'], default='thread',
+                        help="thread: 原来的多线程版本; async: asyncio 协程版本")
+    parser.add_argument('--concurrency', type=int, default=5,
+                        help="同时抓取的 topic 数 (thread 引擎下即 worker 线程数)")
+    parser.add_argument('--rate', type=float, default=2.0,
+                        help="初始请求速率 (req/s)，之后根据延迟和错误率自动调整")
+    parser.add_argument('--max-rate', type=float, default=20.0,
+                        help="自动调速的上限 (req/s)")
+    parser.add_argument('--min-rate', type=float, default=0.2,
+                        help="自动调速的下限 (req/s)")
+    parser.add_argument('--categories', default=','.join(DEFAULT_CATEGORIES),
+                        help="要爬的板块ID，逗号分隔")
+    parser.add_argument('--lease', action='store_true',
+                        help="用数据库里的 topic_leases 表代替进程内队列，可以同时跑多个进程/多台机器")
+    parser.add_argument('--role', choices=['all', 'lister', 'worker'], default='all',
+                        help="all: 翻 topic 列表 + 抓帖子; lister: 只翻列表; worker: 只抓帖子 (lister / worker 都需要 --lease)")
+    parser.add_argument('--lease-seconds', type=int, default=300,
+                        help="租约有效期，进程挂掉后这么久别人才能接手它的 topic")
+    parser.add_argument('--idle-exit', type=float, default=60.0,
+                        help="--lease 模式下租约表空了多少秒之后 worker 退出")
+    parser.add_argument('--incremental', action='store_true',
+                        help="增量模式: 重新抓 last_post_time 变新的已完成 topic (只抓新楼层)，"
+                             "topic 列表翻到上次的 high-water mark 就停")
+    parser.add_argument('--archive', metavar='DIR',
+                        help="把 ajax.php 原始响应压缩归档到这个目录")
+    parser.add_argument('--archive-codec', choices=['gzip', 'zstd'], default='gzip',
+                        help="归档压缩格式 (zstd 需要安装 zstandard)")
+    parser.add_argument('--replay', metavar='DIR',
+                        help="不联网，从归档目录重放所有响应重建数据库")
+    parser.add_argument('--storage', choices=STORAGE_BACKENDS, default='mysql',
+                        help="mysql: 远程 MySQL (DB_CONFIG); sqlite: 本地 SQLite 文件; "
+                             "parquet: 只追加的 Parquet 目录 (需要 pyarrow)")
+    parser.add_argument('--storage-path', metavar='PATH',
+                        help="sqlite 的数据库文件 / parquet 的输出目录")
+    parser.add_argument('--list-windows', type=int, default=1,
+                        help="大于 1 时把板块的时间范围切成多个窗口，用这么多个线程/协程并行翻 topic 列表")
+    parser.add_argument('--page-size', type=int, default=100,
+                        help="帖子翻页先按这个 num_to_fetch 要，服务器截断时自动降到它实际给的条数")
+    parser.add_argument('--queue-size', type=int, default=100,
+                        help="待抓 topic 队列的长度上限，满了 topic 列表的翻页就暂停")
+    parser.add_argument('--memory-budget-mb', type=int, default=256,
+                        help="还没写进数据库的 topics/posts 最多占多少内存 (估算)，超过后抓取暂停等写库")
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help="大于 0 时在 127.0.0.1 的这个端口提供 /metrics (JSON，?format=prometheus 为文本格式)")
+    parser.add_argument('--metrics-file', metavar='PATH',
+                        help="每隔 --metrics-interval 秒往这个文件追加一行 JSON 指标快照")
+    parser.add_argument('--metrics-interval', type=float, default=10.0)
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help="BulkWriter 攒够多少行 (topics+posts) 提交一次")
+    parser.add_argument('--flush-interval', type=float, default=2.0,
+                        help="BulkWriter 最长多少秒提交一次")
+    parser.add_argument('--build-trees', action='store_true',
+                        help="边抓边建引用树: 每个 topic 抓完 (progress 落库) 就用内存里的帖子建树写进 post_trees，"
+                             "不用再单独跑 02_topic_tree.py")
+    parser.add_argument('--tree-workers', type=int, default=os.cpu_count(),
+                        help="--build-trees 建树的进程数，1 表示在 writer 线程里建")
+    parser.add_argument('--tree-batch-size', type=int, default=200,
+                        help="--build-trees 时 post_trees 攒够多少行写一次")
+    parser.add_argument('--tree-format', choices=TREE_FORMATS, default='json',
+                        help="--build-trees 时 tree_json 的编码 (同 02_topic_tree.py)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """
+    返回本次运行的统计 (耗时、writer 写入量、限速器)，供 bench_crawler.py 使用
+    """
+    global RATE_LIMITER, ARCHIVE, STORAGE, METRICS, PAGE_SIZER, TREE_BUILDER
+    setup_logging()
+    args = parse_args(argv)
     start_time = time.time()
-    
-    # 先建session
-    session = requests.Session()
-    session.trust_env = False
+    RATE_LIMITER = AdaptiveRateLimiter(rate=args.rate, min_rate=args.min_rate, max_rate=args.max_rate)
+    METRICS = Metrics()
+    METRICS.gauge('rate_limit_per_second', lambda: round(RATE_LIMITER.rate, 3))
+    PAGE_SIZER = PageSizer(args.page_size)
+    METRICS.gauge('post_page_size', lambda: PAGE_SIZER.size)
 
     headers = {
         'Accept': 'application/json, text/javascript, */*; q=0.01',
@@ -446,33 +1346,139 @@ def main():
                        'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36'),
         'X-Requested-With': 'XMLHttpRequest',
     }
-    # 准备一个队列用于topics
-    topic_queue = Queue()
-    # 启动Producer   
-    # 1) 启动一个线程去抓topic + 写topic表 + 往队列放topic
-    producer_thread = Thread(target=fetch_topics_producer, args=(session, headers, topic_queue))
-    producer_thread.start()
-    # 启动多个Consumer
-    # 2) 启动多个worker线程，从队列拿topic，抓posts并写库
-    worker_count = 5
-    worker_threads = []
-    for _ in range(worker_count):
-        t = Thread(target=fetch_posts_worker, args=(topic_queue, session, headers))
-        t.start()
-        worker_threads.append(t)
-
-    # 3) 等producer结束
-    producer_thread.join()
-
-    # 这里确定producer结束后，你也可以再放够数量的None
-    for _ in range(worker_count):
-        topic_queue.put(None)
-
-    # 4) 等worker把队列里的topic处理完
-    # topic_queue.join()  # 如果你要确保全部处理完再往下
-
-    for t in worker_threads:
-        t.join()
+
+    if args.lease and args.storage != 'mysql':
+        raise SystemExit("--lease 需要 --storage mysql (租约表要放在各进程共享的数据库里)")
+    # 没有租约表时 lister 只能往进程内队列里放，没有 worker 消费，队列满了就卡死
+    if args.role != 'all' and not args.lease:
+        raise SystemExit(f"--role {args.role} 需要配合 --lease 使用")
+    STORAGE = open_storage(args.storage, args.storage_path, DB_POOL)
+
+    # 断点续抓 / 增量抓取需要的状态
+    ensure_state_tables()
+
+    # 建树的进程池要在起任何线程 (指标端点、writer、worker) 之前 fork 出来
+    TREE_BUILDER = None
+    if args.build_trees and not args.replay and args.role != 'lister':
+        topic_tree = importlib.import_module('02_topic_tree')
+        TREE_BUILDER = topic_tree.TreeBuilder(STORAGE, args.tree_workers, args.tree_batch_size, args.tree_format)
+    metrics_server = MetricsServer(METRICS, args.metrics_port).start() if args.metrics_port else None
+    snapshot_writer = (SnapshotWriter(METRICS, args.metrics_file, args.metrics_interval).start()
+                       if args.metrics_file else None)
+
+    if args.replay:
+        writer = BulkWriter(args.batch_size, args.flush_interval,
+                            args.memory_budget_mb * 1024 * 1024).start()
+        replay_archive(args.replay, writer)
+        writer.close()
+        STORAGE.close()
+        if snapshot_writer:
+            snapshot_writer.close()
+        if metrics_server:
+            metrics_server.close()
+        print("Done.")
+        return {'elapsed': time.time() - start_time, 'writer': writer.stats, 'limiter': RATE_LIMITER,
+                'metrics': METRICS.snapshot()}
+
+    if args.archive:
+        ARCHIVE = RawArchive(args.archive, codec=args.archive_codec)
+    listers = []
+    if args.role != 'worker':
+        done_ids = load_done_topic_ids()
+        checkpoints = load_checkpoints()
+        topic_state = load_topic_state() if args.incremental else None
+        for category_id in args.categories.split(','):
+            category_id = int(category_id.strip())
+            high_water_mark = load_high_water_mark(category_id) if args.incremental else 0
+            listers.append(TopicLister(category_id, done_ids, topic_state, high_water_mark,
+                                       incremental=args.incremental, checkpoints=checkpoints))
+
+    # 所有写库都经过这一个 writer 线程
+    writer = BulkWriter(args.batch_size, args.flush_interval, args.memory_budget_mb * 1024 * 1024,
+                        on_done=TREE_BUILDER.topic_done if TREE_BUILDER else None).start()
+    METRICS.gauge('writer_queue_depth', writer._queue.qsize)
+    METRICS.gauge('writer_pending_bytes', lambda: writer._pending_bytes)
+
+    lease_queue = None
+    if args.lease:
+        lease_queue = LeaseQueue(DB_POOL, writer, lease_seconds=args.lease_seconds,
+                                 claim_batch=args.concurrency, idle_exit=args.idle_exit)
+        writer.on_settled = lease_queue.release
+
+    # lister 角色不需要抓帖子的 worker
+    worker_count = 0 if args.role == 'lister' else args.concurrency
+
+    if args.engine == 'async':
+        # asyncio 引擎：所有 topic 的抓取都在一个事件循环里并发
+        topic_queue = AsyncLeaseQueue(lease_queue) if lease_queue else asyncio.Queue(args.queue_size)
+        if not lease_queue:
+            METRICS.gauge('topic_queue_depth', topic_queue.qsize)
+        asyncio.run(async_main(headers, worker_count, writer, listers, topic_queue, args.list_windows))
+    else:
+        # 每个线程 (topic 列表的翻页线程 + 每个 worker) 各用一个 keep-alive 的 Session
+        session = SessionPool()
+
+        # 准备一个队列用于topics（--lease 时是数据库里的租约表）
+        # 有长度上限: 队列满了 producer 就阻塞在 put 上，不会一口气把整个板块翻进内存
+        topic_queue = lease_queue if lease_queue else Queue(args.queue_size)
+        if not lease_queue:
+            METRICS.gauge('topic_queue_depth', topic_queue.qsize)
+        # 启动Producer   
+        # 1) 启动一个线程去抓topic + 写topic表 + 往队列放topic
+        producer_thread = Thread(target=fetch_topics_producer,
+                                 args=(session, headers, topic_queue, writer, listers, args.list_windows))
+        producer_thread.start()
+        # 启动多个Consumer
+        # 2) 启动多个worker线程，从队列拿topic，抓posts并写库
+        worker_threads = []
+        for _ in range(worker_count):
+            t = Thread(target=fetch_posts_worker, args=(topic_queue, session, headers, writer))
+            t.start()
+            worker_threads.append(t)
+
+        # 3) 等producer结束
+        producer_thread.join()
+
+        # 这里确定producer结束后，你也可以再放够数量的None
+        for _ in range(max(worker_count, 1)):
+            topic_queue.put(None)
+
+        # 4) 等worker把队列里的topic处理完
+        # topic_queue.join()  # 如果你要确保全部处理完再往下
+
+        for t in worker_threads:
+            t.join()
+        session.close()
+
+    if lease_queue:
+        lease_queue.close()
+
+    # 5) 等 writer 把剩下的批次写完，再等最后几个 topic 的树建完
+    writer.close()
+    trees = 0
+    if TREE_BUILDER is not None:
+        trees = TREE_BUILDER.close()
+        logging.info(f"边抓边建树: {trees} 个 topic, 没有新帖子跳过 {TREE_BUILDER.skipped} 个")
+        TREE_BUILDER = None
+    if ARCHIVE is not None:
+        ARCHIVE.close()
+
+    # 6) 增量模式下 topic 列表完整翻完、所有 topic 也都处理完了，才推进 high-water mark，
+    #    而且停在这次没抓完的 topic 之前，下次还能翻到它们
+    #    (普通模式会跳过有新回复的已完成 topic，不能拿来推进；
+    #     lister 角色不等帖子抓完，也不能推进)
+    if args.incremental and args.role == 'all':
+        for lister in listers:
+            if lister.finished:
+                save_high_water_mark(lister.category_id, lister.safe_high_water_mark(writer.failed_topics))
+    STORAGE.close()
+
+    if snapshot_writer:
+        snapshot_writer.close()
+    if metrics_server:
+        metrics_server.close()
+    final_metrics = METRICS.snapshot()
+    logging.info(f"最终指标: {json.dumps(final_metrics['counters'], ensure_ascii=False)}")
 
     end_time = time.time()
     elapsed = end_time - start_time
@@ -480,6 +1486,8 @@ def main():
     m, s = divmod(rem, 60)
     logging.info(f"总耗时 {int(h)}小时{int(m)}分钟{int(s)}秒.")
     print("Done.")
+    return {'elapsed': elapsed, 'writer': writer.stats, 'limiter': RATE_LIMITER, 'metrics': final_metrics,
+            'trees': trees}
 
     
 
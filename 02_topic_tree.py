@@ -1,10 +1,18 @@
-import mysql.connector
-import json
+import argparse
+import bisect
+import hashlib
 import logging
 import datetime
 import re
 import os
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from db_config import DB_CONFIG
+from db_pool import ConnectionPool
+from parse_cache import ParseCache
+from storage import STORAGE_BACKENDS, MySQLStorage, open_storage, sort_topic_posts
+from tree_codec import TREE_FORMATS, encode_tree, open_tree
 
 # 1) 生成时间戳字符串，例如 "20250305_173245"
 timestamp = time.strftime("%Y%m%d_%H%M%S")
@@ -28,8 +36,9 @@ logging.info("日志系统初始化完毕。")
 
 # ========== 多层解析所需的正则 & 函数 ==========
 
-quote_start_pattern = re.compile(r'\[quote(?:=([^]]+))?\]', re.IGNORECASE)
-quote_end_pattern = re.compile(r'\[/quote\]', re.IGNORECASE)
+# 开始 / 结束标签合成一个正则, 从左到右扫一遍; group(1) 是作者, group(2) 非空表示结束标签。
+# 公共的 "[" 提到最外层, re 才能按字面前缀快速跳到下一个 "["
+quote_tag_pattern = re.compile(r'\[(?:quote(?:=([^]]+))?|(/quote))\]', re.IGNORECASE)
 
 def parse_forum_quotes(post_text):
     """
@@ -46,143 +55,274 @@ def parse_forum_quotes(post_text):
          ...
       ]
     }
+    标签只扫一遍 (每个标签匹配一次), 各节点的文本先收集片段最后各 join 一次, 整体和帖子长度成线性.
+    多余的 [/quote] 忽略, 没闭合的 [quote] 一直延续到帖子结尾.
     """
     root = {"content": "", "children": []}
-    stack = [root]
+    stack = [(root, [])]
+    nodes = [stack[0]]
     idx = 0
-    while True:
-        start_match = quote_start_pattern.search(post_text, idx)
-        end_match = quote_end_pattern.search(post_text, idx)
-        if not start_match and not end_match:
-            stack[-1]["content"] += post_text[idx:]
-            break
-        if start_match and end_match:
-            next_pos = min(start_match.start(), end_match.start())
-        else:
-            next_pos = start_match.start() if start_match else end_match.start()
+    for m in quote_tag_pattern.finditer(post_text):
         # 先把标签前面的文本放进当前节点
-        stack[-1]["content"] += post_text[idx:next_pos]
-        if start_match and start_match.start() == next_pos:
+        stack[-1][1].append(post_text[idx:m.start()])
+        idx = m.end()
+        if m.group(2) is None:
             # [quote=xxx]
-            author = start_match.group(1)
+            author = m.group(1)
             if author is not None:
                 author = author.strip()
-            idx = start_match.end()
             new_node = {"author": author, "content": "", "children": []}
-            stack[-1]["children"].append(new_node)
-            stack.append(new_node)
-        else:
+            stack[-1][0]["children"].append(new_node)
+            stack.append((new_node, []))
+            nodes.append(stack[-1])
+        elif len(stack) > 1:
             # [/quote]
-            idx = end_match.end()
-            if len(stack) > 1:
-                stack.pop()
+            stack.pop()
+    stack[-1][1].append(post_text[idx:])
+    for node, parts in nodes:
+        node["content"] = "".join(parts)
     return root
 
 def collect_refs_and_cleaned_text(root_node):
     """
-    DFS 遍历 parse_forum_quotes 结果, 收集多层引用:
+    先序遍历 parse_forum_quotes 结果 (显式栈, 嵌套再深也不会碰到递归上限), 收集多层引用:
     返回 (refs, cleaned_text)
       refs: [ {"quoted_author":..., "quoted_content":...}, ... ]
+      cleaned_text: 按先序拼接所有节点文本
     """
     refs = []
-    def dfs(node):
+    texts = []
+    stack = [root_node]
+    while stack:
+        node = stack.pop()
         if node.get("author") is not None:
             # 这是一个引用层
             refs.append({
                 "quoted_author": node["author"],
                 "quoted_content": node["content"].strip()
             })
-        for c in node["children"]:
-            dfs(c)
-    dfs(root_node)
-
-    # 拼接 cleaned_text
-    def gather_text(node):
-        txt = node["content"]
-        for c in node["children"]:
-            txt += gather_text(c)
-        return txt
-    cleaned_text = gather_text(root_node).strip()
+        texts.append(node["content"])
+        stack.extend(reversed(node["children"]))
+    cleaned_text = "".join(texts).strip()
 
     return refs, cleaned_text
+
+def quote_spans(post_text):
+    """
+    parse_forum_quotes + collect_refs_and_cleaned_text 的紧凑版本: 不拼字符串, 只记各层文本在原文里的位置.
+    返回 (ref_spans, text_spans):
+      ref_spans:  [(quoted_author, [(start, end), ...]), ...]  每个带作者的 quote 层 (先序),
+                  片段拼起来再 strip 就是 quoted_content
+      text_spans: [(start, end), ...]  所有节点的片段按先序排列, 拼起来再 strip 就是 cleaned_text
+    解析缓存 (parse_cache.py) 存的就是它, 命中时按原文还原 (spans_to_refs / spans_to_text).
+    """
+    root = [None, [], []]   # [author, spans, children]
+    stack = [root]
+    idx = 0
+    for m in quote_tag_pattern.finditer(post_text):
+        if m.start() > idx:
+            stack[-1][1].append((idx, m.start()))
+        idx = m.end()
+        if m.group(2) is None:
+            author = m.group(1)
+            if author is not None:
+                author = author.strip()
+            new_node = [author, [], []]
+            stack[-1][2].append(new_node)
+            stack.append(new_node)
+        elif len(stack) > 1:
+            stack.pop()
+    if idx < len(post_text):
+        stack[-1][1].append((idx, len(post_text)))
+
+    ref_spans = []
+    text_spans = []
+    walk = [root]
+    while walk:
+        author, spans, children = walk.pop()
+        if author is not None:
+            ref_spans.append((author, spans))
+        text_spans.extend(spans)
+        walk.extend(reversed(children))
+    return ref_spans, text_spans
+
+def spans_to_refs(post_text, ref_spans):
+    """[(quoted_author, quoted_content), ...]"""
+    return [(author, "".join(post_text[s:e] for s, e in spans).strip()) for author, spans in ref_spans]
+
+def spans_to_text(post_text, text_spans):
+    """cleaned_text"""
+    return "".join(post_text[s:e] for s, e in text_spans).strip()
   
- # ========== 数据库配置 ==========
+ # ========== 数据库连接 (配置见 db_config.py) ==========
 
-DB_CONFIG = {
-    'host': '147.8.219.19',
-    'port': 3306,
-    'database': 'my_crawler_db',
-    'user': 'crawler_gexinlin',
-    'password': 'QAZwsx520'
-}
+# 读 posts 和写 post_trees 复用连接，不再每棵树连两次；批量模式流式读占一条，写 post_trees 用另一条
+DB_POOL = ConnectionPool(DB_CONFIG, size=2)
+
+# 读 posts / 写 post_trees 都经过它，main() 里按 --storage 重建 (和 01_crawler.py 用同一个库)
+STORAGE = MySQLStorage(DB_POOL)
+
+# --parse-cache 时长帖子的引用解析结果存一份，内容没变就不再解析 (见 parse_cache.py)
+PARSE_CACHE = None
 
 # ========== 引用匹配函数 ==========
 
+# 拼接同一作者帖子时的分隔符, 引用内容里不会出现
+TEXT_SEPARATOR = '\x00'
+
+def quote_key_words(quoted_content):
+    """
+    引用内容里用来查倒排表的词: 去掉首尾两个词 (可能只引了半个词) 后最长的两个.
+    中间的词在被引用帖子里一定也是按空白切出来的完整词.
+    """
+    inner = set(quoted_content.split()[1:-1])
+    return sorted(inner, key=lambda w: (-len(w), w))[:2]
+
+class QuoteIndex:
+    """
+    一个 topic 的引用匹配索引, 建树时每个 topic 建一次, 所有引用都查它.
+    匹配规则和原来逐帖扫描完全一样: 按帖子顺序找第一个 author 相同、且 post_canonical 包含 quoted_content 的帖子.
+
+    - author -> 该作者的帖子下标 (按顺序)
+    - refs 是这个 topic 里所有的 (quoted_author, quoted_content). 每条引用取两个关键词 (quote_key_words),
+      只给这些词建 词 -> 帖子下标 的倒排表: 每个帖子切词后和关键词集合求交集, 循环在 C 里,
+      查询时两个关键词倒排表的交集就是所有可能的帖子, 再按顺序用 in 确认; 关键词不在倒排表里直接判定找不到
+    - 没有关键词的短引用 / 事先不知道的引用: 把该作者所有帖子按顺序用 \\x00 拼成一个串,
+      一次 str.find 找第一个包含它的帖子, 偏移量用 bisect 换回帖子下标
+    - 同一段引用 (author, content) 在一个 topic 里常被反复引用, 结果缓存
+    """
+
+    def __init__(self, posts_list, refs=()):
+        self.posts_list = posts_list
+        self.by_author = {}
+        for i, p in enumerate(posts_list):
+            self.by_author.setdefault(p["author"], []).append(i)
+        self._texts = {}      # author -> (拼接后的文本, 每个帖子在其中的起始偏移)
+        self._keys = {}       # author -> 建了倒排表的关键词
+        self._postings = {}   # author -> {关键词: [帖子下标, ...]}
+        self._cache = {}
+
+        for quoted_author, quoted_content in refs:
+            if quoted_author in self.by_author and quoted_content:
+                self._keys.setdefault(quoted_author, set()).update(quote_key_words(quoted_content))
+        for author, keys in self._keys.items():
+            postings = self._postings[author] = {}
+            for i in self.by_author[author]:
+                for w in keys.intersection(self.posts_list[i]["post_canonical"].split()):
+                    postings.setdefault(w, []).append(i)
+
+    def _author_text(self, author):
+        entry = self._texts.get(author)
+        if entry is None:
+            starts = []
+            offset = 0
+            texts = []
+            for i in self.by_author[author]:
+                text = self.posts_list[i]["post_canonical"]
+                starts.append(offset)
+                texts.append(text)
+                offset += len(text) + 1
+            entry = self._texts[author] = (TEXT_SEPARATOR.join(texts), starts)
+        return entry
+
+    def _find(self, author, quoted_content):
+        """第一个包含 quoted_content 的帖子下标, 没有返回 None"""
+        keys = quote_key_words(quoted_content)
+        if keys and self._keys.get(author, set()).issuperset(keys):
+            postings = self._postings[author]
+            candidates = [postings.get(w, []) for w in keys]
+            if not all(candidates):
+                return None
+            candidates.sort(key=len)
+            found = candidates[0] if len(candidates) == 1 else sorted(set(candidates[0]).intersection(candidates[1]))
+            for i in found:
+                if quoted_content in self.posts_list[i]["post_canonical"]:
+                    return i
+            return None
+
+        if TEXT_SEPARATOR in quoted_content:
+            for i in self.by_author[author]:
+                if quoted_content in self.posts_list[i]["post_canonical"]:
+                    return i
+            return None
+        text, starts = self._author_text(author)
+        pos = text.find(quoted_content)
+        if pos < 0:
+            return None
+        return self.by_author[author][bisect.bisect_right(starts, pos) - 1]
+
+    def match(self, quoted_author, quoted_content):
+        """
+        返回被引用帖子的 post_number, 找不到返回 0 表示无法确定.
+        """
+        if quoted_author not in self.by_author:
+            logging.debug(f"match_quoted_post: author '{quoted_author}' 无匹配 -> lost=0")
+            return 0
+
+        key = (quoted_author, quoted_content)
+        if key in self._cache:
+            return self._cache[key]
+
+        result = 0
+        if quoted_content:
+            i = self._find(quoted_author, quoted_content)
+            if i is not None:
+                result = self.posts_list[i]["post_number"]
+        if result:
+            logging.debug(f"match_quoted_post: author='{quoted_author}', content匹配 -> post_number={result}")
+        else:
+            logging.debug(f"match_quoted_post: author='{quoted_author}' 找到候选但内容不匹配 -> lost=0")
+        self._cache[key] = result
+        return result
+
 def match_quoted_post(topic_id, quoted_author, quoted_content, posts_list):
     """
     尝试在 posts_list 中找出 被引用的那个 post_number。
     简化逻辑：先找 'author == quoted_author' 的帖子,
               再看 'quoted_content' 是否是其 post_canonical 的子串.
-              若找到唯一匹配, 返回其 post_number. 否则返回 0 表示无法确定.
+              若找到, 返回第一个匹配的 post_number. 否则返回 0 表示无法确定.
+    只查一次时用; 同一个 topic 要查很多次请直接建一个 QuoteIndex 复用.
     """
-    # 先筛选出 author 相符的
-    candidates = [p for p in posts_list if p["author"] == quoted_author]
-    if not candidates:
-        logging.debug(f"match_quoted_post: author '{quoted_author}' 无匹配 -> lost=0")
-        return 0
-      
-    best_match_number = 0
-    for c in candidates:
-      # 如果quoted_content是c["post_canonical"]的子串
-        if quoted_content and (quoted_content in c["post_canonical"]):
-            logging.debug(f"match_quoted_post: author='{quoted_author}', content匹配 -> post_number={c['post_number']}")
-            return c["post_number"]
-
-    logging.debug(f"match_quoted_post: author='{quoted_author}' 找到候选但内容不匹配 -> lost=0")
-    return 0
+    return QuoteIndex(posts_list).match(quoted_author, quoted_content)
 
 
   
 # ========== 核心: 构建 tree_json ==========
-def build_tree_for_topic(topic_id):
+def build_tree_for_topic(topic_id, tree_format='json'):
     """
-    从 posts 表里读取 topic_id 对应的所有帖子,
-    多层解析 [quote=xxx] -> (quoted_author, quoted_content),
-    并结合 match_quoted_post 去找被引用的帖子 => 构建 edges.
+    从 posts 表里读取 topic_id 对应的所有帖子, 交给 build_tree 构建.
     """
     logging.info(f"开始构建树状结构: topic_id={topic_id}")
     
-    conn = mysql.connector.connect(**DB_CONFIG)
-    cur = conn.cursor(dictionary=True)
-
-    # 1) 拿到 topic_title
-    cur.execute("SELECT topic_title FROM topics WHERE topic_id = %s", (topic_id,))
-    row_topic = cur.fetchone()
-    topic_title = row_topic["topic_title"] if row_topic else ""
+    # 1) 拿到 topic_title 和所有 posts (按 post_time 排序)
+    topic_title, rows = STORAGE.load_topic_posts(topic_id)
     logging.info(f"话题标题: {topic_title or '[未知]'}")
+    keys, cached = cache_lookup(rows)
+    result = build_tree(topic_id, topic_title, rows, cached, tree_format)
+    cache_store(keys, result["parsed"])
+    return result
 
-    # 2) 获取所有 posts
-    cur.execute("""
-        SELECT post_id, author, post_time, post_canonical
-        FROM posts
-        WHERE topic_id = %s
-        ORDER BY post_time ASC
-    """, (topic_id,))
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-
-    if not rows:
-        logging.warning(f"topic_id={topic_id} 下没有任何帖子.")
-        return {
-            "topic_title": topic_title,
-            "posts_num": 0,
-            "posts_get": 0,
-            "tree_json": json.dumps({"nodes": [], "edges": []}, ensure_ascii=False)
-        }
-    logging.info(f"topic_id={topic_id} 下共{len(rows)}条帖子.")
-
-    # 给帖子分配本地序号 n=1..N
+def cache_lookup(rows):
+    """
+    PARSE_CACHE 打开时查一次这个 topic 的长帖子: 返回 (缓存键, cached)，cached 交给 build_tree / update_tree。
+    没开缓存返回 ({}, None)
+    """
+    if PARSE_CACHE is None:
+        return {}, None
+    keys = PARSE_CACHE.keys(rows)
+    cached = dict.fromkeys(keys)
+    cached.update(PARSE_CACHE.get_many(keys))
+    return keys, cached
+
+def cache_store(keys, parsed):
+    """把 build_tree / update_tree 新解析的长帖子写进 PARSE_CACHE"""
+    if PARSE_CACHE is not None and parsed:
+        PARSE_CACHE.put_many([(post_id, keys[post_id], spans) for post_id, spans in parsed])
+
+def tree_posts(rows):
+    """
+    给帖子分配本地序号 n=1..N
+    """
     posts_list = []
     for i, r in enumerate(rows):
         post_number = i+1
@@ -196,98 +336,372 @@ def build_tree_for_topic(topic_id):
             "post_time": post_time_str,
             "post_canonical": r["post_canonical"] or ""
         })
+    return posts_list
 
-    edges = []
-    N = len(posts_list)
-
-    # 3) 对每个帖解析多层引用 => (quoted_author, quoted_content)
-    for post_obj in posts_list:
-        n = post_obj["post_number"]
-        text = post_obj["post_canonical"]
-        logging.debug(f"[topic_id={topic_id}] 处理第{n}帖 post_id={post_obj['post_id']}")
-
-
-        # a) 多层解析
-        root_struct = parse_forum_quotes(text)
-        refs, cleaned_text = collect_refs_and_cleaned_text(root_struct)
-        logging.debug(f"解析到 {len(refs)} 条引用. (无引用则0)")
-
-        if not refs:
-             # b) 无引用 => 如果不是第一楼 => n->n-1
-            if n>1:
-                edges.append({"from": n, "to": n-1})
-                logging.debug(f"无引用, 且非首贴 => edge: {n}->{n-1}")
-        else:
-            # c) 有引用 => 每条 ref
-            for ref in refs:
-                quoted_author   = ref["quoted_author"] or ""
-                quoted_content  = ref["quoted_content"] or ""
-                logging.debug(f"  引用ref => author='{quoted_author}', content长度={len(quoted_content)}")
-
-                # 尝试匹配
-                m = match_quoted_post(topic_id, quoted_author, quoted_content, posts_list)
-                if m == 0:
-                    # lost
-                    edges.append({"from": n, "to": 0})
-                    logging.debug(f"  match失败 => (n->0) => {n}->0")
-                else:
-                    edges.append({"from": n, "to": m})
-                    logging.debug(f"  match成功 => edge: {n}->{m}")
+def tree_node(p):
+    return {
+        "post_number": p["post_number"],
+        "post_id": p["post_id"],
+        "author": p["author"],
+        "post_time": p["post_time"]
+    }
 
-    # 4) 组装 nodes
-    nodes = []
+def posts_hasher(posts_list, hasher=None):
+    """
+    增量建树用的指纹: 依次喂入每个帖子的 (post_id, author, post_time, post_canonical).
+    之前的帖子被编辑 / 删除 / 中间插进了帖子, 前 posts_num 个帖子的指纹就和上次存的对不上.
+    返回 blake2b 对象; 传入上次返回的 hasher 可以接着喂后面的帖子.
+    """
+    if hasher is None:
+        hasher = hashlib.blake2b(digest_size=8)
     for p in posts_list:
-        nodes.append({
-            "post_number": p["post_number"],
-            "post_id": p["post_id"],
-            "author": p["author"],
-            "post_time": p["post_time"]
-        })
+        hasher.update(repr((p["post_id"], p["author"], p["post_time"], p["post_canonical"])).encode('utf-8'))
+    return hasher
 
-    tree_data = {
-        "nodes": nodes,
-        "edges": edges
-    }
-    tree_json_str = json.dumps(tree_data, ensure_ascii=False)
+def hash_value(hasher):
+    """64 位有符号整数, 直接存 BIGINT"""
+    return int.from_bytes(hasher.digest(), 'big', signed=True)
+
+def parse_post_refs(topic_id, post_obj, cached=None, fresh=None):
+    """
+    多层解析一个帖子 => [(quoted_author, quoted_content), ...]
+    cached: {post_id: quote_spans 的结果或 None} (见 cache_lookup)，有结果的不用再解析；
+            值为 None 的是值得缓存但没命中的帖子，解析结果 (post_id, spans) 记进 fresh
+    """
+    post_id = post_obj["post_id"]
+    text = post_obj["post_canonical"]
+    spans = cached.get(post_id) if cached is not None else None
+    if spans is None:
+        logging.debug(f"[topic_id={topic_id}] 处理第{post_obj['post_number']}帖 post_id={post_id}")
+        spans = quote_spans(text)
+        if fresh is not None and cached is not None and post_id in cached:
+            fresh.append((post_id, spans))
+    refs = spans_to_refs(text, spans[0])
+    logging.debug(f"解析到 {len(refs)} 条引用. (无引用则0)")
+    return refs
+
+def post_edges(n, refs, quote_index):
+    """
+    第 n 帖的所有出边
+    """
+    edges = []
+    if not refs:
+         # b) 无引用 => 如果不是第一楼 => n->n-1
+        if n>1:
+            edges.append({"from": n, "to": n-1})
+            logging.debug(f"无引用, 且非首贴 => edge: {n}->{n-1}")
+    else:
+        # c) 有引用 => 每条 ref
+        for quoted_author, quoted_content in refs:
+            logging.debug(f"  引用ref => author='{quoted_author}', content长度={len(quoted_content)}")
+
+            # 尝试匹配
+            m = quote_index.match(quoted_author, quoted_content)
+            if m == 0:
+                # lost
+                edges.append({"from": n, "to": 0})
+                logging.debug(f"  match失败 => (n->0) => {n}->0")
+            else:
+                edges.append({"from": n, "to": m})
+                logging.debug(f"  match成功 => edge: {n}->{m}")
+    return edges
+
+def tree_result(topic_id, topic_title, posts_list, nodes, edges, hasher, fresh=(), tree_format='json'):
+    tree_json_str = encode_tree(nodes, edges, tree_format)
+    N = len(posts_list)
     logging.info(f"完成构建树状结构: topic_id={topic_id}, 帖子数={N}, edges={len(edges)}")
-    
+
     return {
         "topic_title": topic_title,
         "posts_num": N,
         "posts_get": N,
-        "tree_json": tree_json_str
+        "tree_json": tree_json_str,
+        "tree_hash": hash_value(hasher),
+        "parsed": list(fresh)
     }
 
-def insert_post_tree(topic_id):
+def build_tree(topic_id, topic_title, rows, cached=None, tree_format='json'):
+    """
+    rows: 一个 topic 按 post_time 排好序的帖子 (STORAGE.load_topic_posts / iter_topic_posts 的格式),
+    多层解析 [quote=xxx] -> (quoted_author, quoted_content),
+    并结合 match_quoted_post 去找被引用的帖子 => 构建 edges.
+    不读写数据库, 批量模式下在子进程里跑.
+    cached: 解析缓存的查询结果 (见 parse_post_refs)，新解析的长帖子放在返回值的 "parsed" 里
+    tree_format: tree_json 的编码 (见 tree_codec.py)
+    """
+    if not rows:
+        logging.warning(f"topic_id={topic_id} 下没有任何帖子.")
+        return {
+            "topic_title": topic_title,
+            "posts_num": 0,
+            "posts_get": 0,
+            "tree_json": encode_tree([], [], tree_format),
+            "tree_hash": hash_value(posts_hasher([])),
+            "parsed": []
+        }
+    logging.info(f"topic_id={topic_id} 下共{len(rows)}条帖子.")
+    posts_list = tree_posts(rows)
+
+    # 3) 对每个帖解析多层引用 => (quoted_author, quoted_content)
+    fresh = []
+    parsed = [parse_post_refs(topic_id, post_obj, cached, fresh) for post_obj in posts_list]
+
+    # 整个 topic 的引用都解析完再建索引, 只索引被引用到的词
+    quote_index = QuoteIndex(posts_list, [ref for refs in parsed for ref in refs])
+
+    edges = []
+    for post_obj, refs in zip(posts_list, parsed):
+        edges.extend(post_edges(post_obj["post_number"], refs, quote_index))
+
+    # 4) 组装 nodes
+    nodes = [tree_node(p) for p in posts_list]
+    return tree_result(topic_id, topic_title, posts_list, nodes, edges, posts_hasher(posts_list), fresh, tree_format)
+
+def update_tree(topic_id, topic_title, rows, state, old_tree_json, cached=None, tree_format='json'):
+    """
+    增量建树: state 是上次的 (posts_num, tree_hash) (STORAGE.load_tree_states), old_tree_json 是上次的 tree_json.
+    前 posts_num 个帖子的指纹没变时, 只解析新帖子, 在原来的 nodes / edges 后面追加;
+    上次匹配失败 (->0) 的引用可能引的是新帖子里的内容, 这些帖子也重新匹配一次, 结果和整棵重建完全一样.
+    没有新帖子返回 None; 之前的帖子被编辑 / 删除 (指纹对不上), 或者没有上次的记录, 整棵重建.
+    """
+    if state is None:
+        return build_tree(topic_id, topic_title, rows, cached, tree_format)
+    old_n, old_hash = state
+    if len(rows) < old_n:
+        logging.info(f"[topic_id={topic_id}] 帖子比上次少 ({len(rows)} < {old_n}), 整棵重建.")
+        return build_tree(topic_id, topic_title, rows, cached, tree_format)
+
+    posts_list = tree_posts(rows)
+    hasher = posts_hasher(posts_list[:old_n])
+    if hash_value(hasher) != old_hash:
+        logging.info(f"[topic_id={topic_id}] 之前的帖子有改动, 整棵重建.")
+        return build_tree(topic_id, topic_title, rows, cached, tree_format)
+    if len(posts_list) == old_n:
+        logging.debug(f"[topic_id={topic_id}] 没有新帖子, 跳过.")
+        return None
+    tree = open_tree(old_tree_json) if old_tree_json else None
+    if tree is None or tree.num_nodes != old_n:
+        return build_tree(topic_id, topic_title, rows, cached, tree_format)
+
+    logging.info(f"[topic_id={topic_id}] 增量建树: 已有{old_n}帖, 新增{len(posts_list) - old_n}帖.")
+    edges_by_post = {}
+    for f, t in tree.edges():
+        edges_by_post.setdefault(f, []).append({"from": f, "to": t})
+    lost = [n for n, edges in edges_by_post.items() if any(e["to"] == 0 for e in edges)]
+    todo = lost + [p["post_number"] for p in posts_list[old_n:]]
+    fresh = []
+    parsed = {n: parse_post_refs(topic_id, posts_list[n-1], cached, fresh) for n in todo}
+    quote_index = QuoteIndex(posts_list, [ref for refs in parsed.values() for ref in refs])
+    for n in todo:
+        edges_by_post[n] = post_edges(n, parsed[n], quote_index)
+
+    # edges 和整棵重建时一样按帖子顺序排
+    edges = [e for n in sorted(edges_by_post) for e in edges_by_post[n]]
+    nodes = tree.nodes() + [tree_node(p) for p in posts_list[old_n:]]
+    return tree_result(topic_id, topic_title, posts_list, nodes, edges, posts_hasher(posts_list[old_n:], hasher),
+                       fresh, tree_format)
+
+def insert_post_tree(topic_id, incremental=False, tree_format='json'):
     """
     调用 build_tree_for_topic(topic_id) 构建多层解析结果 => 插表 post_trees
+    incremental: 只处理上次建树之后的新帖子 (见 update_tree)
+    tree_format: tree_json 的编码 (见 tree_codec.py)
     """
-    result = build_tree_for_topic(topic_id)
+    if incremental:
+        logging.info(f"开始增量构建树状结构: topic_id={topic_id}")
+        topic_title, rows = STORAGE.load_topic_posts(topic_id)
+        state = STORAGE.load_tree_states([topic_id]).get(topic_id)
+        old_tree_json = STORAGE.load_post_tree(topic_id) if state and len(rows) > state[0] else None
+        keys, cached = cache_lookup(rows)
+        result = update_tree(topic_id, topic_title, rows, state, old_tree_json, cached, tree_format)
+        if result is None:
+            logging.info(f"[topic_id={topic_id}] 没有新帖子, tree_json 不变.")
+            return
+        cache_store(keys, result["parsed"])
+    else:
+        result = build_tree_for_topic(topic_id, tree_format)
     topic_title = result["topic_title"]
     posts_num = result["posts_num"]
     posts_get = result["posts_get"]
     tree_json_str = result["tree_json"]
 
-    conn = mysql.connector.connect(**DB_CONFIG)
-    cur = conn.cursor()
-    sql = """
-    INSERT INTO post_trees (topic_id, topic_title, posts_num, posts_get, tree_json)
-    VALUES (%s, %s, %s, %s, %s)
-    ON DUPLICATE KEY UPDATE
-      topic_title = VALUES(topic_title),
-      posts_num = VALUES(posts_num),
-      posts_get = VALUES(posts_get),
-      tree_json = VALUES(tree_json)
-    """
-    cur.execute(sql, (topic_id, topic_title, posts_num, posts_get, tree_json_str))
-    conn.commit()
-    cur.close()
-    conn.close()
+    STORAGE.save_post_trees([(topic_id, topic_title, posts_num, posts_get, tree_json_str)],
+                            [(topic_id, posts_num, result["tree_hash"])])
     logging.info(f"[topic_id={topic_id}] 已成功生成并插入 tree_json.")
 
-def main():
-    test_topic_id = 463183
-    insert_post_tree(test_topic_id)
+def build_tree_row(item):
+    """
+    进程池的任务: (topic_id, topic_title, posts, state, old_tree_json, cached, tree_format)
+    -> (post_trees 的一行, post_tree_state 的一行, 新解析的长帖子)，增量模式下没有新帖子返回 None
+    """
+    topic_id, topic_title, rows, state, old_tree_json, cached, tree_format = item
+    result = update_tree(topic_id, topic_title, rows, state, old_tree_json, cached, tree_format)
+    if result is None:
+        return None
+    return ((topic_id, topic_title, result["posts_num"], result["posts_get"], result["tree_json"]),
+            (topic_id, result["posts_num"], result["tree_hash"]),
+            result["parsed"])
+
+class TreeBuilder:
+    """
+    进程池建树 + post_trees 攒批写入, build_all_trees 和 01_crawler.py --build-trees 共用:
+        builder = TreeBuilder(storage, workers, batch_size, tree_format)
+        builder.submit(topic_id, topic_title, rows, state, old_tree_json)   # 参数同 update_tree
+        builder.topic_done(topic_id, topic_title, posts, complete)          # 爬虫抓完一个 topic 时
+        builder.close()                                                      # 等剩下的树建完写完
+    同时在路上的 topic 最多 workers*4 个, 再 submit 就等最早的一个建完, 调用方跟着慢下来.
+    开了 PARSE_CACHE 时, 主进程按 topic 查缓存交给子进程, 子进程新解析的长帖子交回主进程写缓存.
+    submit / topic_done / close 要在同一个线程里调用.
+    """
+
+    def __init__(self, storage, workers=None, batch_size=200, tree_format='json'):
+        self.storage = storage
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.tree_format = tree_format
+        self.executor = None
+        if self.workers > 1:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            # fork 方式下子进程在第一次 submit 时一起 fork 出来; 先 fork 好,
+            # 爬虫里在起其它线程之前创建 TreeBuilder, 子进程就不会继承别的线程持有的锁
+            self.executor.submit(os.getpid).result()
+        self.built = 0
+        self.skipped = 0
+        self.start_time = time.time()
+        self._in_flight = deque()
+        self._batch = []
+        self._batch_states = []
+
+    def submit(self, topic_id, topic_title, rows, state=None, old_tree_json=None):
+        keys, cached = cache_lookup(rows)
+        item = (topic_id, topic_title, rows, state, old_tree_json, cached, self.tree_format)
+        if self.executor is None:
+            self._collect(keys, build_tree_row(item))
+            return
+        self._in_flight.append((keys, self.executor.submit(build_tree_row, item)))
+        if len(self._in_flight) >= self.workers * 4:
+            keys, future = self._in_flight.popleft()
+            self._collect(keys, future.result())
+        # 已经建好的顺手收掉, 不用等到 workers*4 个
+        while self._in_flight and self._in_flight[0][1].done():
+            keys, future = self._in_flight.popleft()
+            self._collect(keys, future.result())
+
+    def topic_done(self, topic_id, topic_title, posts, complete):
+        """
+        01_crawler.py 的 "topic 抓完" 事件 (progress 已经落库之后):
+        posts 是这次抓到的帖子 (storage.tree_post 的格式), complete 表示从第 1 帖抓起、posts 就是整个 topic,
+        直接用它们建树, 不再回数据库读. 续抓 / 增量抓取只抓了后面的楼层, 这时才从库里读出整个 topic,
+        按上次的 post_tree_state 增量更新.
+        """
+        if complete:
+            self.submit(topic_id, topic_title or "", sort_topic_posts(posts))
+            return
+        stored_title, rows = self.storage.load_topic_posts(topic_id)
+        state = self.storage.load_tree_states([topic_id]).get(topic_id)
+        old_tree_json = self.storage.load_post_tree(topic_id) if state and len(rows) > state[0] else None
+        self.submit(topic_id, topic_title or stored_title or "", rows, state, old_tree_json)
+
+    def _collect(self, keys, result):
+        if result is None:
+            self.skipped += 1
+            return
+        row, state, parsed = result
+        cache_store(keys, parsed)
+        self._batch.append(row)
+        self._batch_states.append(state)
+        self.built += 1
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._batch:
+            self.storage.save_post_trees(self._batch, self._batch_states)
+            logging.info(f"已写入 {self.built} 棵树, 用时 {time.time() - self.start_time:.1f} 秒")
+            self._batch.clear()
+            self._batch_states.clear()
+
+    def close(self, wait=True):
+        """wait=False 时 (出错退出) 不再等还没建完的树"""
+        try:
+            while wait and self._in_flight:
+                keys, future = self._in_flight.popleft()
+                self._collect(keys, future.result())
+            if wait:
+                self.flush()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(cancel_futures=True)
+                self.executor = None
+        return self.built
+
+def build_all_trees(topic_ids=None, workers=None, batch_size=200, incremental=False, tree_format='json'):
+    """
+    批量模式: STORAGE.iter_topic_posts 用一条按 topic_id 排序的流式查询读出所有 (或 topic_ids 里的) 帖子,
+    每个 topic 交给 TreeBuilder 的进程池建树, post_trees 攒够 batch_size 行写一次.
+    建树跟不上时读也跟着停, 不会把整个库读进内存.
+    incremental: 先一次读出所有 topic 的 post_tree_state, 帖子数没变且指纹一致的跳过,
+                 有新帖子的才去读上次的 tree_json 追加 (见 update_tree).
+    返回建好 (或更新) 的 topic 数.
+    """
+    builder = TreeBuilder(STORAGE, workers, batch_size, tree_format)
+    states = STORAGE.load_tree_states(topic_ids) if incremental else {}
+    ok = False
+    try:
+        for topic_id, topic_title, rows in STORAGE.iter_topic_posts(topic_ids):
+            state = states.get(topic_id)
+            old_tree_json = STORAGE.load_post_tree(topic_id) if state and len(rows) > state[0] else None
+            builder.submit(topic_id, topic_title, rows, state, old_tree_json)
+        ok = True
+    finally:
+        built = builder.close(wait=ok)
+
+    logging.info(f"批量建树完成: {built} 个 topic, 没有新帖子跳过 {builder.skipped} 个, "
+                 f"用时 {time.time() - builder.start_time:.1f} 秒")
+    return built
+
+def main(argv=None):
+    global STORAGE, PARSE_CACHE
+    parser = argparse.ArgumentParser(description="从 posts 表构建引用树，写入 post_trees")
+    parser.add_argument('--topic-id', type=int, default=463183, help="只建这一个 topic 的树")
+    parser.add_argument('--all', action='store_true',
+                        help="批量模式: 一次扫描给库里所有 topic 建树")
+    parser.add_argument('--topic-ids', type=int, nargs='+', metavar='ID',
+                        help="批量模式: 只给这些 topic 建树")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="批量模式建树的进程数，1 表示在主进程里建")
+    parser.add_argument('--batch-size', type=int, default=200,
+                        help="批量模式 post_trees 攒够多少行写一次")
+    parser.add_argument('--incremental', action='store_true',
+                        help="只处理上次建树之后新增的帖子，之前的帖子有改动的 topic 才整棵重建")
+    parser.add_argument('--tree-format', choices=TREE_FORMATS, default='json',
+                        help="tree_json 的编码: json 和原来一样; columnar 按列存, 大 topic 小得多; "
+                             "columnar-zlib 再压缩一次 (见 tree_codec.py)")
+    parser.add_argument('--parse-cache', metavar='PATH',
+                        help="引用解析结果的缓存文件 (SQLite)，内容没变的长帖子不再解析")
+    parser.add_argument('--parse-cache-mb', type=int, default=256,
+                        help="解析缓存的大小上限，超过后淘汰最久没用的")
+    parser.add_argument('--parse-cache-min-chars', type=int, default=1024,
+                        help="只缓存不短于这么多字符的帖子，短帖子重新解析比查缓存快")
+    parser.add_argument('--storage', choices=STORAGE_BACKENDS, default='mysql')
+    parser.add_argument('--storage-path', metavar='PATH',
+                        help="sqlite 的数据库文件 / parquet 的目录 (与 01_crawler.py 相同)")
+    args = parser.parse_args(argv)
+
+    STORAGE = open_storage(args.storage, args.storage_path, DB_POOL)
+    STORAGE.ensure_schema()
+    PARSE_CACHE = (ParseCache(args.parse_cache, args.parse_cache_mb * 1024 * 1024, args.parse_cache_min_chars)
+                   if args.parse_cache else None)
+    try:
+        if args.all or args.topic_ids:
+            build_all_trees(args.topic_ids, args.workers, args.batch_size, args.incremental, args.tree_format)
+        else:
+            insert_post_tree(args.topic_id, args.incremental, args.tree_format)
+    finally:
+        if PARSE_CACHE is not None:
+            PARSE_CACHE.close()
+            PARSE_CACHE = None
+    STORAGE.close()
 
 if __name__=="__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,196 @@
+import argparse
+import importlib
+import json
+import logging
+import os
+import shutil
+import sys
+
+try:
+    import mysql.connector  # --storage sqlite / parquet 时不需要
+except ImportError:
+    mysql = None
+
+import fake_aops_server
+from db_pool import ConnectionPool
+from storage import POST_TREES_DDL
+
+
+# ============ 爬虫端到端压测 ============
+# 起一个本地 fake_aops_server，连一个专门的本地测试库，整条 main() 流水线跑一遍，
+# 输出 topics/s、posts/s、请求延迟 p50/p99、BulkWriter 每批写库耗时。
+# 调 worker 数、限速、批大小之后跑一次对比数字，不用再去线上试。
+#
+#   python bench_crawler.py --topics 500 --latency-ms 80 -- --engine async --concurrency 50
+#
+# "--" 后面的参数原样传给 01_crawler.py 的 main()。
+# --storage sqlite / parquet 时不需要 MySQL，结果写到 --storage-path (默认在当前目录)。
+# 注意: 每次运行都会清空测试库里的表 / 删掉 --storage-path，不要指向正式库。
+
+BENCH_TABLES_DDL = [
+    """
+    CREATE TABLE topics (
+        topic_id BIGINT PRIMARY KEY,
+        topic_title TEXT,
+        category_id BIGINT,
+        category_name VARCHAR(255)
+    )
+    """,
+    """
+    CREATE TABLE posts (
+        post_id BIGINT PRIMARY KEY,
+        topic_id BIGINT,
+        author VARCHAR(255),
+        post_canonical MEDIUMTEXT,
+        post_time DATETIME,
+        admin BOOLEAN, attachment BOOLEAN, avatar VARCHAR(255),
+        deletable BOOLEAN, deleted BOOLEAN, editable BOOLEAN,
+        is_forum_admin BOOLEAN, is_nothanked BOOLEAN, is_thanked BOOLEAN,
+        last_edit_reason TEXT, last_edit_time BIGINT, last_editor_username VARCHAR(255),
+        nothanks_received INT, num_edits INT, num_posts INT, post_format VARCHAR(32),
+        post_number INT, post_rendered MEDIUMTEXT, poster_id BIGINT,
+        reported BOOLEAN, show_from_end BOOLEAN, show_from_start BOOLEAN,
+        thankers TEXT, thanks_received INT,
+        KEY idx_topic (topic_id)
+    )
+    """,
+    """
+    CREATE TABLE progress (
+        topic_id BIGINT PRIMARY KEY
+    )
+    """,
+    POST_TREES_DDL,
+]
+
+BENCH_TABLES = ['topics', 'posts', 'progress', 'post_trees',
+                'topic_state', 'category_state', 'topic_checkpoints', 'topic_leases',
+                'post_hashes', 'post_tree_state']
+
+
+def reset_bench_database(db_config):
+    """建测试库，删掉上次留下的表再重建 (状态表交给 crawler 的 ensure_state_tables 建)"""
+    server_config = {k: v for k, v in db_config.items() if k != 'database'}
+    conn = mysql.connector.connect(**server_config)
+    cur = conn.cursor()
+    cur.execute(f"CREATE DATABASE IF NOT EXISTS `{db_config['database']}` DEFAULT CHARACTER SET utf8mb4")
+    cur.execute(f"USE `{db_config['database']}`")
+    for table in BENCH_TABLES:
+        cur.execute(f"DROP TABLE IF EXISTS {table}")
+    for ddl in BENCH_TABLES_DDL:
+        cur.execute(ddl)
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(run_stats, forum, server_options):
+    elapsed = run_stats['elapsed']
+    writer_stats = run_stats['writer']
+    limiter = run_stats['limiter']
+    latencies = list(limiter.latencies)
+    flushes = writer_stats['flush_seconds']
+    return {
+        'elapsed_seconds': round(elapsed, 3),
+        'topics': writer_stats['done'],
+        'posts': writer_stats['posts'],
+        'unchanged_posts': writer_stats['unchanged_posts'],
+        'trees': run_stats.get('trees', 0),
+        'expected_topics': len(forum.topics),
+        'expected_posts': forum.total_posts,
+        'topics_per_second': round(writer_stats['done'] / elapsed, 2) if elapsed else 0.0,
+        'posts_per_second': round(writer_stats['posts'] / elapsed, 2) if elapsed else 0.0,
+        'requests': limiter.requests,
+        'failed_requests': limiter.failures,
+        'final_rate': round(limiter.rate, 2),
+        'latency_p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'latency_p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'db_flushes': len(flushes),
+        'db_flush_total_seconds': round(sum(flushes), 3),
+        'db_flush_p50_ms': round(percentile(flushes, 50) * 1000, 1),
+        'db_flush_p99_ms': round(percentile(flushes, 99) * 1000, 1),
+        'peak_pending_mb': round(writer_stats['peak_pending_bytes'] / 1024 / 1024, 2),
+        'server': server_options,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="用本地假 ajax.php 压测 01_crawler.py")
+    fake_aops_server.add_forum_arguments(parser)
+    parser.add_argument('--db-host', default='localhost')
+    parser.add_argument('--db-port', type=int, default=3306)
+    parser.add_argument('--db-user', default='root')
+    parser.add_argument('--db-password', default=os.environ.get('BENCH_DB_PASSWORD', ''))
+    parser.add_argument('--db-name', default='aops_bench', help="测试库名，每次运行会清空")
+    parser.add_argument('--storage', choices=['mysql', 'sqlite', 'parquet'], default='mysql')
+    parser.add_argument('--storage-path', help="sqlite 文件 / parquet 目录，每次运行会先删掉")
+    parser.add_argument('--output', help="结果 JSON 另存一份到这个文件")
+    parser.add_argument('crawler_args', nargs=argparse.REMAINDER,
+                        help="-- 之后的参数传给 01_crawler.py")
+    args = parser.parse_args(argv)
+    if args.crawler_args and args.crawler_args[0] == '--':
+        args.crawler_args = args.crawler_args[1:]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    db_config = {
+        'host': args.db_host,
+        'port': args.db_port,
+        'user': args.db_user,
+        'password': args.db_password,
+        'database': args.db_name,
+    }
+    storage_args = ['--storage', args.storage]
+    if args.storage == 'mysql':
+        reset_bench_database(db_config)
+    else:
+        path = args.storage_path or ('aops_bench.sqlite3' if args.storage == 'sqlite' else 'aops_bench_parquet')
+        for leftover in (path, path + '-wal', path + '-shm'):
+            if os.path.isdir(leftover):
+                shutil.rmtree(leftover)
+            elif os.path.exists(leftover):
+                os.remove(leftover)
+        storage_args += ['--storage-path', path]
+
+    # 模块名以数字开头，只能用 importlib 导入；日志先按 crawler 的配置写文件，不然会打到 stderr
+    crawler = importlib.import_module('01_crawler')
+    crawler.setup_logging()
+
+    forum, server_options = fake_aops_server.forum_from_args(args)
+    server, ajax_url = fake_aops_server.start_server(forum, **server_options)
+    logging.info(f"假 ajax.php: {ajax_url}, {len(forum.topics)} 个topic, {forum.total_posts} 条帖子")
+
+    # 再把地址和连接池换成本地的
+    crawler.AJAX_URL = ajax_url
+    crawler.DB_CONFIG = db_config
+    crawler.DB_POOL = ConnectionPool(db_config, size=2)
+
+    # 默认限速对线上是保守的，压测时放开，想测限速器本身可以在 -- 后面覆盖
+    crawler_args = ['--categories', str(forum.category_id), '--rate', '50', '--max-rate', '1000'] + storage_args
+    try:
+        run_stats = crawler.main(crawler_args + args.crawler_args)
+    finally:
+        server.shutdown()
+        crawler.DB_POOL.close_all()
+
+    result = summarize(run_stats, forum, server_options)
+    result['crawler_args'] = crawler_args + args.crawler_args
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    return result
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,10 @@
+# ============ 数据库配置(请根据实际情况修改) ============
+# 爬虫、建树和统计 / 查询脚本都从这里导入，只改这一处
+
+DB_CONFIG = {
+    'host': '147.8.219.19',   # 云端 MySQL 主机/IP
+    'port': 3306,          # 默认 MySQL 端口
+    'database': 'my_crawler_db',
+    'user': 'crawler_gexinlin',
+    'password': 'QAZwsx520'
+}
@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from queue import LifoQueue, Empty
+
+try:
+    import mysql.connector  # --storage sqlite / parquet 时用不到，没装也能跑
+except ImportError:
+    mysql = None
+
+
+# ============ 两个脚本共用的 MySQL 连接池 ============
+
+class ConnectionPool:
+    """
+    有上限的 MySQL 连接池。01_crawler.py 和 02_topic_tree.py 共用。
+
+    - 最多同时存在 size 个连接，用满了 connection() 会阻塞等别人归还
+    - 借出时做健康检查：闲置超过 ping_interval 秒的连接先 ping 一下，
+      断了就 reconnect，重连失败则丢弃并新建
+    - with 块里抛异常时先 rollback，连接已断开的不放回池子
+    连接是懒创建的，构造 ConnectionPool 本身不会连数据库。
+    """
+
+    def __init__(self, db_config, size=5, ping_interval=30, checkout_timeout=None):
+        self.db_config = db_config
+        self.size = size
+        self.ping_interval = ping_interval
+        self.checkout_timeout = checkout_timeout
+        self._idle = LifoQueue()       # (conn, 上次归还时间)，后进先出让热连接优先被复用
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _new_connection(self):
+        if mysql is None:
+            raise RuntimeError("MySQL 存储需要先安装 mysql-connector-python")
+        conn = mysql.connector.connect(**self.db_config)
+        logging.debug(f"ConnectionPool 新建连接, 当前共 {self._created} 个")
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def _reserve_and_connect(self):
+        """占一个名额再建连接，失败就把名额还回去"""
+        try:
+            return self._new_connection()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _checkout(self):
+        deadline = None
+        if self.checkout_timeout is not None:
+            deadline = time.monotonic() + self.checkout_timeout
+
+        while True:
+            # 1) 有空闲的就直接拿
+            try:
+                conn, returned_at = self._idle.get_nowait()
+                break
+            except Empty:
+                pass
+
+            # 2) 没有空闲但还没到上限 => 新建
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                return self._reserve_and_connect()
+
+            # 3) 到上限了 => 等别人归还（短超时轮询，坏连接被丢弃后也能腾出名额）
+            try:
+                conn, returned_at = self._idle.get(timeout=0.5)
+                break
+            except Empty:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"ConnectionPool: {self.checkout_timeout}s 内没有可用连接")
+
+        # 健康检查（is_connected/ping 本身就是一次往返，所以只对闲置久的连接做）
+        if time.monotonic() - returned_at >= self.ping_interval:
+            try:
+                conn.ping(reconnect=True, attempts=3, delay=1)
+            except Exception as e:
+                logging.warning(f"ConnectionPool 连接失效，重新建立: {e}")
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                return self._reserve_and_connect()
+        return conn
+
+    def _release(self, conn, broken=False):
+        if broken:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            if not conn.is_connected():
+                self._discard(conn)
+                return
+        self._idle.put((conn, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        """
+        借一个连接:
+            with pool.connection() as conn:
+                ...
+        """
+        conn = self._checkout()
+        try:
+            yield conn
+        except Exception:
+            self._release(conn, broken=True)
+            raise
+        else:
+            self._release(conn)
+
+    def close_all(self):
+        """关掉所有空闲连接（借出去的不管）"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except Empty:
+                break
+            self._discard(conn)
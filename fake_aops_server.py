@@ -0,0 +1,197 @@
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+# ============ 本地 AoPS ajax.php 替身 ============
+# 给 bench_crawler.py 用：不碰线上站点就能测爬虫吞吐。
+# 支持 fetch_topics / fetch_posts_for_topic 两个接口，返回结构和线上一致（字段齐全），
+# 延迟、错误率、每个 topic 的帖子数分布都可以配置，同一个 seed 生成的数据完全相同。
+
+TOPICS_PER_PAGE = 30
+
+
+class FakeForum:
+    """
+    按 seed 确定性地生成一个板块: topic 列表和每个 topic 的帖子。
+    帖子内容在请求时按 (topic_id, post_number) 现算，不占内存。
+    """
+
+    def __init__(self, category_id=463183, num_topics=1000, posts_median=15, posts_sigma=1.2,
+                 max_posts=5000, max_page_size=50, quote_rate=0.2, seed=42):
+        self.category_id = category_id
+        self.max_page_size = max_page_size
+        self.quote_rate = quote_rate
+        self.seed = seed
+        rng = random.Random(seed)
+
+        # 帖子数服从对数正态分布：大部分 topic 很短，少数巨帖几千楼
+        self.topics = []
+        now = int(time.time())
+        for i in range(num_topics):
+            num_posts = min(max_posts, max(1, int(rng.lognormvariate(0, posts_sigma) * posts_median)))
+            self.topics.append({
+                'topic_id': 1_000_000 + i,
+                'topic_title': f"Synthetic topic #{i}",
+                'category_id': category_id,
+                'category_name': 'Benchmark',
+                'num_posts': num_posts,
+                'last_post_time': now - i * 600,
+            })
+        # 线上列表按 last_post_time 倒序
+        self.topics.sort(key=lambda t: t['last_post_time'], reverse=True)
+        self.topics_by_id = {t['topic_id']: t for t in self.topics}
+
+    @property
+    def total_posts(self):
+        return sum(t['num_posts'] for t in self.topics)
+
+    def fetch_topics(self, fetch_before):
+        page = [t for t in self.topics if t['last_post_time'] <= fetch_before][:TOPICS_PER_PAGE]
+        return {'topics': page}
+
+    def _post(self, topic, post_number):
+        topic_id = topic['topic_id']
+        rng = random.Random(zlib.crc32(f"{self.seed}:{topic_id}:{post_number}".encode()))
+        author = f"user{rng.randint(1, 50)}"
+        body = ' '.join(f"word{rng.randint(1, 5000)}" for _ in range(rng.randint(5, 120)))
+        if post_number > 1 and rng.random() < self.quote_rate:
+            quoted_number = rng.randint(1, post_number - 1)
+            quoted = random.Random(zlib.crc32(f"{self.seed}:{topic_id}:{quoted_number}".encode()))
+            quoted_author = f"user{quoted.randint(1, 50)}"
+            quoted_text = ' '.join(f"word{quoted.randint(1, 5000)}" for _ in range(quoted.randint(5, 120)))
+            body = f"[quote={quoted_author}]{quoted_text}[/quote]\n{body}"
+        post_time = topic['last_post_time'] - (topic['num_posts'] - post_number) * 60
+        return {
+            'post_id': topic_id * 10_000 + post_number,
+            'topic_id': topic_id,
+            'post_number': post_number,
+            'username': author,
+            'poster_id': int(author[4:]),
+            'post_time': post_time,
+            'post_canonical': body,
+            'post_rendered': f"<p>{body}</p>",
+            'post_format': 'bbcode',
+            'admin': False, 'attachment': False, 'avatar': '', 'deletable': False,
+            'deleted': False, 'editable': False, 'is_forum_admin': False,
+            'is_nothanked': False, 'is_thanked': False,
+            'last_edit_reason': '', 'last_edit_time': 0, 'last_editor_username': '',
+            'nothanks_received': 0, 'num_edits': 0, 'num_posts': rng.randint(1, 3000),
+            'reported': False, 'show_from_end': False, 'show_from_start': False,
+            'thankers': None, 'thanks_received': rng.randint(0, 5),
+        }
+
+    def fetch_posts(self, topic_id, start_post_num, num_to_fetch):
+        topic = self.topics_by_id.get(topic_id)
+        if topic is None:
+            return {'posts': []}
+        num_to_fetch = min(num_to_fetch, self.max_page_size)
+        end = min(topic['num_posts'], start_post_num + num_to_fetch - 1)
+        return {'posts': [self._post(topic, n) for n in range(max(1, start_post_num), end + 1)]}
+
+
+def make_handler(forum, latency_ms=50, latency_jitter_ms=20, error_rate=0.0, throttle_rate=0.0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # 头和 body 分两次写，不关 Nagle 的话 keep-alive 下每个请求会白等 ~40ms 的延迟 ACK
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, payload, extra_headers=None):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for k, v in (extra_headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+            time.sleep(max(0.0, random.gauss(latency_ms, latency_jitter_ms)) / 1000)
+
+            roll = random.random()
+            if roll < throttle_rate:
+                return self._reply(429, {'error_code': 'throttled'}, {'Retry-After': '1'})
+            if roll < throttle_rate + error_rate:
+                return self._reply(500, {'error_code': 'internal'})
+
+            action = form.get('a')
+            if action == 'fetch_topics':
+                content = forum.fetch_topics(int(form.get('fetch_before') or time.time()))
+            elif action == 'fetch_posts_for_topic':
+                content = forum.fetch_posts(int(form['topic_id']),
+                                            int(form.get('start_post_num') or 1),
+                                            int(form.get('num_to_fetch') or 20))
+            else:
+                return self._reply(400, {'error_code': f'unknown action {action}'})
+            self._reply(200, {'response': content, 'error_code': None})
+
+    return Handler
+
+
+def start_server(forum, host='127.0.0.1', port=0, **handler_options):
+    """
+    在后台线程里启动替身服务器，返回 (server, ajax_url)。port=0 表示随机端口。
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(forum, **handler_options))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="fake-aops", daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/m/community/ajax.php"
+
+
+def add_forum_arguments(parser):
+    parser.add_argument('--topics', type=int, default=1000, help="topic 数量")
+    parser.add_argument('--posts-median', type=float, default=15, help="每个 topic 帖子数的中位数")
+    parser.add_argument('--posts-sigma', type=float, default=1.2, help="帖子数对数正态分布的 sigma，越大巨帖越多")
+    parser.add_argument('--max-posts', type=int, default=5000, help="单个 topic 帖子数上限")
+    parser.add_argument('--max-page-size', type=int, default=50, help="num_to_fetch 超过这个值会被截断")
+    parser.add_argument('--latency-ms', type=float, default=50, help="每个请求的平均延迟")
+    parser.add_argument('--latency-jitter-ms', type=float, default=20, help="延迟的标准差")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="返回 500 的概率")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument('--seed', type=int, default=42)
+
+
+def forum_from_args(args):
+    forum = FakeForum(num_topics=args.topics, posts_median=args.posts_median,
+                      posts_sigma=args.posts_sigma, max_posts=args.max_posts,
+                      max_page_size=args.max_page_size, seed=args.seed)
+    handler_options = {
+        'latency_ms': args.latency_ms,
+        'latency_jitter_ms': args.latency_jitter_ms,
+        'error_rate': args.error_rate,
+        'throttle_rate': args.throttle_rate,
+    }
+    return forum, handler_options
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 AoPS ajax.php 替身服务器")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    add_forum_arguments(parser)
+    args = parser.parse_args()
+
+    forum, handler_options = forum_from_args(args)
+    server, url = start_server(forum, args.host, args.port, **handler_options)
+    print(f"{len(forum.topics)} 个topic, {forum.total_posts} 条帖子, 地址 {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# ============ 运行时指标 ============
+# 爬虫各阶段往同一个 Metrics 里记数，三种方式查看:
+#   - MetricsServer:   http://127.0.0.1:<port>/metrics 返回 JSON 快照，
+#                      /metrics?format=prometheus 返回 Prometheus 文本格式
+#   - SnapshotWriter:  每隔 interval 秒往文件追加一行 JSON (带这段时间内的每秒速率)
+#   - main() 结束时的返回值 / 日志里的最终快照
+# 指标名约定: *_total 计数器, *_seconds 直方图或累计时长, 其它为瞬时值 (gauge)。
+
+# 请求延迟 / 写库耗时的桶上界 (秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # 最后一个是 +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """按桶线性插值估算分位数，和 Prometheus 的 histogram_quantile 一样"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for upper, n in zip(self.buckets + (self.max,), self.counts):
+            if seen + n >= rank and n:
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+            lower = upper
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else 0.0,
+            'p50': round(self.quantile(0.5), 6),
+            'p90': round(self.quantile(0.9), 6),
+            'p99': round(self.quantile(0.99), 6),
+            'max': round(self.max, 6),
+            'buckets': {str(b): c for b, c in zip(self.buckets + ('+Inf',), self.counts)},
+        }
+
+
+class Metrics:
+    """
+    线程安全的指标登记处，线程引擎和 asyncio 引擎都可以直接调用 (每次只持锁一瞬间)。
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._values = {}
+        self._gauges = {}
+
+    def inc(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def set(self, name, value):
+        with self._lock:
+            self._values[name] = value
+
+    def add(self, name, delta):
+        """加减一个瞬时值，比如正在忙的 worker 数"""
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + delta
+
+    def gauge(self, name, func):
+        """登记一个取快照时才去读的瞬时值，比如 topic_queue.qsize"""
+        with self._lock:
+            self._gauges[name] = func
+
+    @contextmanager
+    def timer(self, name):
+        """with metrics.timer('xxx_seconds'): ... 把耗时累加进计数器 xxx_seconds"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.inc(name, time.monotonic() - start)
+
+    def snapshot(self):
+        uptime = time.monotonic() - self.started
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: h.snapshot() for k, h in self._histograms.items()}
+            values = dict(self._values)
+            gauges = dict(self._gauges)
+        for name, func in gauges.items():
+            try:
+                values[name] = func()
+            except Exception as e:
+                values[name] = None
+                logging.debug(f"读取指标 {name} 失败: {e}")
+        return {
+            'time': int(time.time()),
+            'uptime_seconds': round(uptime, 3),
+            'counters': {k: round(v, 6) if isinstance(v, float) else v for k, v in counters.items()},
+            'rates_per_second': {k: round(v / uptime, 3) for k, v in counters.items() if uptime > 0},
+            'gauges': values,
+            'histograms': histograms,
+        }
+
+    def prometheus(self):
+        """Prometheus 文本格式 (指标名里的 . 换成 _ ，前缀 aops_)"""
+        snap = self.snapshot()
+        lines = []
+
+        def metric_name(name):
+            return 'aops_' + name.replace('.', '_').replace('-', '_')
+
+        for name, value in snap['counters'].items():
+            lines.append(f"# TYPE {metric_name(name)} counter")
+            lines.append(f"{metric_name(name)} {value}")
+        for name, value in snap['gauges'].items():
+            if value is not None:
+                lines.append(f"# TYPE {metric_name(name)} gauge")
+                lines.append(f"{metric_name(name)} {value}")
+        for name, h in snap['histograms'].items():
+            lines.append(f"# TYPE {metric_name(name)} histogram")
+            cumulative = 0
+            for upper, count in h['buckets'].items():
+                cumulative += count
+                lines.append(f'{metric_name(name)}_bucket{{le="{upper}"}} {cumulative}')
+            lines.append(f"{metric_name(name)}_sum {h['sum']}")
+            lines.append(f"{metric_name(name)}_count {h['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """在后台线程里起一个只读的 HTTP 端点，默认只监听本机"""
+
+    def __init__(self, metrics, port, host='127.0.0.1'):
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if not self.path.startswith('/metrics'):
+                    self.send_error(404)
+                    return
+                if 'format=prometheus' in self.path:
+                    body = metrics.prometheus().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4'
+                else:
+                    body = json.dumps(metrics.snapshot(), ensure_ascii=False).encode('utf-8')
+                    content_type = 'application/json'
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://{host}:{self._server.server_address[1]}/metrics"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-http",
+                                        daemon=True)
+
+    def start(self):
+        self._thread.start()
+        logging.info(f"指标端点: {self.url}")
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class SnapshotWriter:
+    """
+    每 interval 秒往 path 追加一行 JSON 快照，多一个 interval_rates: 这段时间内各计数器的每秒增量，
+    比从开始算的平均速率更能看出当前卡在哪。
+    """
+
+    def __init__(self, metrics, path, interval=10.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._previous = None
+        self._thread = threading.Thread(target=self._run, name="metrics-snapshot", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def write(self):
+        snap = self.metrics.snapshot()
+        if self._previous is not None:
+            elapsed = snap['uptime_seconds'] - self._previous['uptime_seconds']
+            before = self._previous['counters']
+            snap['interval_rates'] = {
+                k: round((v - before.get(k, 0)) / elapsed, 3)
+                for k, v in snap['counters'].items() if elapsed > 0
+            }
+        self._previous = snap
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(snap, ensure_ascii=False) + '\n')
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:
+                logging.error(f"写指标快照失败: {e}")
+
+    def close(self):
+        """停掉定时线程，再写最后一次"""
+        self._stop.set()
+        self._thread.join()
+        self.write()
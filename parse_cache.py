@@ -0,0 +1,144 @@
+import json
+import logging
+import sqlite3
+import time
+import zlib
+
+
+# ============ 引用解析结果的持久缓存 ============
+# 02_topic_tree.py 全库重建时，内容没变的长帖子不用再解析 quote 标签。
+#
+# 单文件 SQLite，表 parse_cache:
+#   post_id       主键
+#   content_hash  帖子正文 (post_canonical) 的 64 位指纹，和缓存里的不一样就当没命中 (帖子被编辑过)
+#   spans         JSON，02_topic_tree.quote_spans 的结果:
+#                   [[[quoted_author, [[start, end], ...]], ...], [[start, end], ...]]
+#                 引用内容和去掉标签后的正文都只存在原文里的位置，不存文字本身：
+#                 建树时原文本来就在内存里，按位置切出来拼上就是 refs / cleaned_text，
+#                 一条记录通常只有几十字节，解码也比存整段文字快
+#   size          spans 的字节数，用来算缓存总大小
+#   last_used     最近一次命中 / 写入的运行编号 (启动时间)，超过 max_bytes 时从最久没用的开始删
+#
+# 不用爬虫 post_hashes 里的整行哈希: 那个还包括 thanks_received / num_posts 这类计数，
+# 正文没变、只是多了个感谢也会让缓存失效。指纹只看正文: UTF-8 字节数 (高 32 位) + CRC32 (低 32 位)。
+# 缓存键本来就带 post_id，只用区分同一帖子编辑前后的版本，不需要密码学哈希；
+# CRC32 每 KB 不到 1 微秒，blake2b 要好几倍，2k 字的帖子算 blake2b 就快赶上重新解析了。
+# 解析本身很快 (平均每帖几微秒)，短帖子查缓存并不比重新解析省，所以只缓存 min_chars 以上的帖子。
+# 只在主进程里读写；建树的子进程拿到命中的结果，把新解析的交回主进程写入。
+
+CACHE_DDL = """
+    CREATE TABLE IF NOT EXISTS parse_cache (
+        post_id INTEGER PRIMARY KEY,
+        content_hash INTEGER NOT NULL,
+        spans TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        last_used INTEGER NOT NULL
+    )
+"""
+
+CACHE_UPSERT_SQL = """
+    INSERT INTO parse_cache(post_id, content_hash, spans, size, last_used) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(post_id) DO UPDATE SET
+      content_hash = excluded.content_hash,
+      spans = excluded.spans,
+      size = excluded.size,
+      last_used = excluded.last_used
+"""
+
+# 一次 IN (...) 查多少个 post_id (SQLite 默认最多 999 个参数)
+LOOKUP_CHUNK = 900
+
+
+def text_hash(text):
+    """帖子正文的指纹 (64 位以内的非负整数)，缓存键"""
+    raw = text.encode('utf-8')
+    return len(raw) << 32 | zlib.crc32(raw)
+
+
+class ParseCache:
+    """
+    用法 (都在主进程里):
+        keys = cache.keys(rows)          # {post_id: content_hash}，只有值得缓存的帖子
+        hits = cache.get_many(keys)      # {post_id: spans}
+        ... 没命中的交给 quote_spans 解析 ...
+        cache.put_many([(post_id, content_hash, spans), ...])
+        cache.close()                    # 淘汰超出 max_bytes 的部分并提交
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, min_chars=1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.min_chars = min_chars
+        self._conn = sqlite3.connect(path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(CACHE_DDL)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_parse_cache_used ON parse_cache(last_used)")
+        self._run = int(time.time())
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM parse_cache").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    def keys(self, rows):
+        """rows 是 STORAGE.load_topic_posts / iter_topic_posts 返回的帖子，挑出够长的帖子算出缓存键"""
+        keys = {}
+        for r in rows:
+            text = r["post_canonical"] or ""
+            if len(text) >= self.min_chars:
+                keys[r["post_id"]] = text_hash(text)
+        return keys
+
+    def get_many(self, keys):
+        found = {}
+        post_ids = list(keys)
+        for i in range(0, len(post_ids), LOOKUP_CHUNK):
+            chunk = post_ids[i:i + LOOKUP_CHUNK]
+            for post_id, content_hash, spans in self._conn.execute(
+                    f"SELECT post_id, content_hash, spans FROM parse_cache "
+                    f"WHERE post_id IN ({', '.join('?' * len(chunk))})", chunk):
+                if content_hash == keys[post_id]:
+                    found[post_id] = json.loads(spans)
+        if found:
+            self._conn.executemany("UPDATE parse_cache SET last_used = ? WHERE post_id = ?",
+                                   [(self._run, post_id) for post_id in found])
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, entries):
+        rows = []
+        for post_id, content_hash, spans in entries:
+            spans_json = json.dumps(spans, ensure_ascii=False, separators=(',', ':'))
+            size = len(spans_json.encode('utf-8'))
+            rows.append((post_id, content_hash, spans_json, size, self._run))
+            self._bytes += size
+        if rows:
+            # 覆盖旧记录时多算了旧的大小，evict 前会按表里的实际值重新统计
+            self._conn.executemany(CACHE_UPSERT_SQL, rows)
+            self._conn.commit()
+        if self._bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """超过 max_bytes 时，从最久没用的开始删，删到 90% 以下"""
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM parse_cache").fetchone()[0]
+        if self._bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        removed = 0
+        doomed = []
+        for post_id, size in self._conn.execute("SELECT post_id, size FROM parse_cache ORDER BY last_used, post_id"):
+            if self._bytes - removed <= target:
+                break
+            doomed.append((post_id,))
+            removed += size
+        self._conn.executemany("DELETE FROM parse_cache WHERE post_id = ?", doomed)
+        self._conn.commit()
+        self._bytes -= removed
+        logging.info(f"解析缓存超过 {self.max_bytes} 字节，淘汰 {len(doomed)} 条 ({removed} 字节)")
+
+    def close(self):
+        self.evict()
+        self._conn.commit()
+        self._conn.close()
+        logging.info(f"解析缓存: 命中 {self.hits}, 未命中 {self.misses}, 大小 {self._bytes} 字节")
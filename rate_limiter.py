@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+
+# ============ 自适应限速 ============
+
+class AdaptiveRateLimiter:
+    """
+    所有 ajax.php 请求共用的令牌桶限速器，线程和协程都能用。
+
+    - acquire() / acquire_async(): 请求前拿一个令牌，桶空了就等
+    - record(): 请求结束后回报耗时和状态码，用来调整速率 (AIMD):
+        * 成功且平均延迟低于 target_latency、错误率低于 error_threshold => rate 加 increase
+        * 429 / 5xx / 网络异常，或平均延迟超过 target_latency => rate 乘 decrease
+          (cooldown 秒内最多降一次，避免并发的一波错误把速率一下打到底)
+    - backoff(): 重试前该睡多久，指数退避 + 抖动；有 Retry-After 时取两者较大值
+    """
+
+    def __init__(self, rate=2.0, min_rate=0.2, max_rate=20.0, burst=None,
+                 target_latency=2.0, error_threshold=0.1,
+                 increase=0.05, decrease=0.5, cooldown=5.0,
+                 backoff_base=1.0, backoff_cap=60.0):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.target_latency = target_latency
+        self.error_threshold = error_threshold
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        self.latency_ewma = 0.0
+        self.error_ewma = 0.0
+        # 最近的请求耗时样本和计数，给 bench_crawler.py 算 p50/p99
+        self.latencies = deque(maxlen=100000)
+        self.requests = 0
+        self.failures = 0
+        self._tokens = self.burst
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    # ---------- 令牌桶 ----------
+
+    def _reserve(self):
+        """预订一个令牌，返回需要等待的秒数（令牌可以透支，等待时间按透支量算）"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    # ---------- 反馈调速 ----------
+
+    def record(self, latency, status=None, error=False):
+        """
+        回报一次请求的结果。status 为 HTTP 状态码，error=True 表示网络层异常/超时。
+        """
+        failed = error or status == 429 or (status is not None and status >= 500)
+        with self._lock:
+            self.latencies.append(latency)
+            self.requests += 1
+            self.failures += 1 if failed else 0
+            self.latency_ewma = 0.8 * self.latency_ewma + 0.2 * latency
+            self.error_ewma = 0.9 * self.error_ewma + 0.1 * (1.0 if failed else 0.0)
+
+            if failed or self.latency_ewma > self.target_latency:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self._last_decrease = now
+                    old_rate = self.rate
+                    self.rate = max(self.min_rate, self.rate * self.decrease)
+                    logging.warning(
+                        f"限速下调 {old_rate:.2f} -> {self.rate:.2f} req/s "
+                        f"(status={status}, error={error}, 平均延迟={self.latency_ewma:.2f}s)")
+            elif self.error_ewma < self.error_threshold:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+            self.burst = max(1.0, self.rate)
+
+    def backoff(self, attempt, retry_after=None):
+        """第 attempt 次 (从 1 开始) 重试前的等待秒数"""
+        delay = min(self.backoff_cap, self.backoff_base * (2 ** (attempt - 1)))
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
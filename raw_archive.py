@@ -0,0 +1,195 @@
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import zstandard  # 可选，装了就能用 --archive-codec zstd
+except ImportError:
+    zstandard = None
+
+
+# ============ ajax.php 原始响应归档 ============
+# 目录结构:
+#   segment_000001.jsonl.gz   每条记录单独压成一个 gzip member (zstd 则是一个 frame)，
+#   segment_000002.jsonl.gz   多个 member 首尾相连仍是合法的 .gz 文件，可以直接 zcat
+#   ...
+#   index.jsonl               每条记录一行: kind / key / page / segment / offset / length
+# 记录格式:
+#   {"kind": "topics"|"posts"|"done", "key": category_id 或 topic_id, "page": fetch_before 或 start_post_num,
+#    "fetched_at": unix 时间, "body": 原始响应文本 (done 记录里是 last_post_time/last_post_number)}
+# 有了 index 可以按 (kind, key, page) 直接 seek 到某一条解压，不用扫整个段。
+
+CODECS = {
+    'gzip': '.jsonl.gz',
+    'zstd': '.jsonl.zst',
+}
+
+
+def _compress(codec, raw):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(raw)
+    return gzip.compress(raw, compresslevel=6)
+
+
+def _decompress(codec, blob):
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return gzip.decompress(blob)
+
+
+class RawArchive:
+    """
+    只追加的原始响应归档，线程安全。段文件写满 segment_bytes 就换下一个。
+    """
+
+    def __init__(self, directory, codec='gzip', segment_bytes=256 * 1024 * 1024):
+        if codec == 'zstd' and zstandard is None:
+            raise RuntimeError("zstd 归档需要先安装 zstandard: pip install zstandard")
+        self.directory = directory
+        self.codec = codec
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._index = open(os.path.join(directory, 'index.jsonl'), 'a', encoding='utf-8')
+        # 每次运行都开一个新段，不往上次可能没写完整的段后面追加
+        existing = sorted(f for f in os.listdir(directory) if f.startswith('segment_'))
+        self._segment_no = int(existing[-1].split('_')[1].split('.')[0]) if existing else 0
+        self._open_next_segment()
+
+    def _segment_name(self, number):
+        return f"segment_{number:06d}{CODECS[self.codec]}"
+
+    def _open_next_segment(self):
+        self._segment_no += 1
+        path = os.path.join(self.directory, self._segment_name(self._segment_no))
+        self._segment = open(path, 'ab')
+
+    def append(self, kind, key, page, body):
+        record = {
+            'kind': kind,
+            'key': key,
+            'page': page,
+            'fetched_at': int(time.time()),
+            'body': body,
+        }
+        blob = _compress(self.codec, (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+        with self._lock:
+            if self._segment.tell() >= self.segment_bytes:
+                self._segment.close()
+                self._open_next_segment()
+            offset = self._segment.tell()
+            self._segment.write(blob)
+            self._segment.flush()
+            self._index.write(json.dumps({
+                'kind': kind, 'key': key, 'page': page,
+                'segment': self._segment_name(self._segment_no),
+                'offset': offset, 'length': len(blob),
+            }) + '\n')
+            self._index.flush()
+
+    def close(self):
+        with self._lock:
+            self._segment.close()
+            self._index.close()
+
+
+class ArchiveReader:
+    """
+    读归档: iter_records() 按写入顺序顺序扫描；lookup() 借助 index 按需取单条。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._index = None
+
+    def _codec_of(self, segment_name):
+        return 'zstd' if segment_name.endswith(CODECS['zstd']) else 'gzip'
+
+    def _load_index(self):
+        if self._index is None:
+            self._index = {}
+            with open(os.path.join(self.directory, 'index.jsonl'), encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    # 同一页抓过多次时保留最后一次
+                    self._index[(entry['kind'], entry['key'], entry['page'])] = entry
+        return self._index
+
+    def lookup(self, kind, key, page):
+        """取某一条记录，没有返回 None"""
+        entry = self._load_index().get((kind, key, page))
+        if entry is None:
+            return None
+        with open(os.path.join(self.directory, entry['segment']), 'rb') as f:
+            f.seek(entry['offset'])
+            blob = f.read(entry['length'])
+        return json.loads(_decompress(self._codec_of(entry['segment']), blob))
+
+    def pages(self, kind, key):
+        """某个 topic / 板块归档过的所有 page"""
+        return sorted(p for (k, kk, p) in self._load_index() if k == kind and kk == key)
+
+    def iter_records(self):
+        """按段号、段内顺序依次产出所有记录，用于离线重放"""
+        segments = sorted(f for f in os.listdir(self.directory) if f.startswith('segment_'))
+        for name in segments:
+            path = os.path.join(self.directory, name)
+            if self._codec_of(name) == 'zstd':
+                if zstandard is None:
+                    raise RuntimeError("读取 zstd 归档需要先安装 zstandard: pip install zstandard")
+                try:
+                    with open(path, 'rb') as raw:
+                        for line in _iter_lines(_zstd_chunks(raw)):
+                            if line.strip():
+                                yield json.loads(line)
+                except (EOFError, zstandard.ZstdError) as e:
+                    # 同 gzip: 段尾半个 frame 解出来的半行不要，之前的记录照常重放
+                    logging.warning(f"归档段 {name} 末尾不完整，已跳过: {e}")
+            else:
+                try:
+                    with gzip.open(path, 'rt', encoding='utf-8') as f:
+                        for line in f:
+                            if line.strip():
+                                yield json.loads(line)
+                except (EOFError, gzip.BadGzipFile) as e:
+                    # 进程在写某条记录时被杀，段尾会留下半条，之前的记录不受影响
+                    logging.warning(f"归档段 {name} 末尾不完整，已跳过: {e}")
+            logging.info(f"归档段 {name} 重放完毕")
+
+
+def _zstd_chunks(raw, chunk_size=1 << 20):
+    """
+    逐个 frame 解压 (每条记录一个 frame)，解出一段就交出去一段。
+    段尾坏掉的 frame 在它自己那里才抛 ZstdError，前面已经解出来的记录都能先产出
+    """
+    dctx = zstandard.ZstdDecompressor()
+    obj = dctx.decompressobj()
+    while True:
+        data = raw.read(chunk_size)
+        if not data:
+            break
+        while data:
+            out = obj.decompress(data)
+            if out:
+                yield out
+            if not obj.eof:
+                break
+            data, obj = obj.unused_data, dctx.decompressobj()
+
+
+def _iter_lines(chunks):
+    """逐行产出；每条记录都以换行结尾，结束时还剩没有换行的尾巴说明段被截断了，抛 EOFError"""
+    pending = b''
+    for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            yield line.decode('utf-8')
+    if pending:
+        raise EOFError(f"最后一行不完整 ({len(pending)} 字节)")
@@ -0,0 +1,1091 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from topic_leases import LEASES_DDL, LEASE_UPSERT_SQL, LEASE_DONE_SQL, LEASE_FAILED_SQL, lease_params
+
+try:
+    import pyarrow  # 可选，只有 --storage parquet 需要
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# ============ 存储后端 ============
+# 01_crawler.py 和 02_topic_tree.py 对 topics / posts / progress / post_trees 以及增量状态表
+# 的所有读写都经过这里，三种实现接口相同:
+#   MySQLStorage   原来的远程 MySQL (走 ConnectionPool)，--lease 多进程模式只支持它
+#   SQLiteStorage  本地单文件，WAL 模式 + 每批一个事务，笔记本 / CI 上不需要数据库服务
+#   ParquetSink    只追加的列式文件，每批写一个 part 文件，分析脚本可以直接读
+#
+# 写接口:
+#   write_batch(topics, posts, leases, checkpoints, done, failed=())
+#       topics:      接口返回的 topic dict 列表
+#       posts:       build_post_params() 生成的参数字典列表
+#       leases:      要写进 topic_leases 的 topic (仅 MySQL)
+#       checkpoints: [(topic_id, start_post_num), ...]
+#       done:        [(topic_id, last_post_time, last_post_number), ...]
+#       failed:      [topic_id, ...] 重试用完没抓完的: 断点不删、不写 progress，租约置为 'failed' (仅 MySQL)
+#     一批在一个事务里提交；抛异常表示整批都没写进去，调用方可以原样重试。
+#     返回因内容没变而跳过的帖子数: 每条帖子的内容哈希存在 post_hashes 里，
+#     重新抓到的帖子先整批查一次哈希，只有新帖子和内容变了的才真正写 posts。
+#   save_post_trees(rows, states)
+#       rows:   [(topic_id, topic_title, posts_num, posts_get, tree_json), ...]
+#       states: [(topic_id, posts_num, tree_hash), ...]  写进 post_tree_state，和 rows 同一个事务
+# 读接口见 MySQLStorage 各方法的说明。
+
+POST_COLUMNS = [
+    'post_id', 'topic_id', 'author', 'post_canonical', 'post_time',
+    'admin', 'attachment', 'avatar', 'deletable', 'deleted', 'editable',
+    'is_forum_admin', 'is_nothanked', 'is_thanked', 'last_edit_reason',
+    'last_edit_time', 'last_editor_username', 'nothanks_received',
+    'num_edits', 'num_posts', 'post_format', 'post_number',
+    'post_rendered', 'poster_id', 'reported', 'show_from_end', 'show_from_start',
+    'thankers', 'thanks_received',
+]
+
+TOPIC_COLUMNS = ['topic_id', 'topic_title', 'category_id', 'category_name']
+
+POST_TREE_COLUMNS = ['topic_id', 'topic_title', 'posts_num', 'posts_get', 'tree_json']
+
+
+def build_topic_params(t):
+    return (
+        t['topic_id'], t['topic_title'],
+        t.get('category_id'), t.get('category_name')
+    )
+
+
+# 发帖人自己的资料 (总发帖数、头像)，作者在别处发一帖就全变，和这条帖子的内容无关
+AUTHOR_PROFILE_COLUMNS = {'num_posts', 'avatar'}
+HASHED_POST_COLUMNS = [c for c in POST_COLUMNS if c not in AUTHOR_PROFILE_COLUMNS]
+
+
+def post_content_hash(params):
+    """
+    一条帖子的 64 位哈希 (有符号，直接存 BIGINT)，覆盖 HASHED_POST_COLUMNS:
+    正文、编辑 (last_edit_time / num_edits)、感谢数、删除状态这些帖子本身的变化都会重写整行；
+    不含 AUTHOR_PROFILE_COLUMNS，所以 posts 里的 num_posts / avatar 是这条帖子最后一次被写入时的值。
+    """
+    raw = repr(tuple(params[c] for c in HASHED_POST_COLUMNS)).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), 'big', signed=True)
+
+
+def split_changed_posts(posts, load_hashes):
+    """
+    load_hashes(post_ids) -> {post_id: content_hash}，各后端自己实现 (整批一次查询)。
+    返回 (要写的帖子, [(post_id, content_hash), ...], 跳过的条数)。
+    同一批里重复的 post_id (断点续抓时重叠的页) 只保留最后一次。
+    """
+    latest = {p['post_id']: p for p in posts}
+    known = load_hashes(list(latest)) if latest else {}
+    changed, hashes = [], []
+    for post_id, params in latest.items():
+        content_hash = post_content_hash(params)
+        if known.get(post_id) != content_hash:
+            changed.append(params)
+            hashes.append((post_id, content_hash))
+    return changed, hashes, len(posts) - len(changed)
+
+
+def tree_post(params):
+    """
+    build_post_params() 的一行 => load_topic_posts / iter_topic_posts 返回的帖子格式，
+    01_crawler.py --build-trees 直接用内存里的帖子建树时用
+    """
+    return {
+        "post_id": params['post_id'],
+        "author": params['author'],
+        "post_time": params['post_time'],
+        "post_canonical": params['post_canonical'],
+    }
+
+
+def sort_topic_posts(posts):
+    """一个 topic 的帖子按 post_time 排序，时间相同的按 post_id，和 load_topic_posts 的顺序一致"""
+    return sorted(posts, key=lambda r: (r['post_time'] or datetime.datetime.min, r['post_id']))
+
+
+def group_topic_posts(rows):
+    """
+    iter_topic_posts 用: 把按 topic_id 排好序的 (topic_id, topic_title, post) 流
+    切成一个个 (topic_id, topic_title, posts)，同一时间只在内存里攒一个 topic。
+    """
+    current, title, posts = None, "", []
+    for topic_id, topic_title, post in rows:
+        if topic_id != current:
+            if posts:
+                yield current, title, sort_topic_posts(posts)
+            current, title, posts = topic_id, topic_title or "", []
+        posts.append(post)
+    if posts:
+        yield current, title, sort_topic_posts(posts)
+
+
+# ---------------- MySQL ----------------
+
+# MySQL upsert 写法
+TOPICS_UPSERT_SQL = """
+    INSERT INTO topics(topic_id, topic_title, category_id, category_name)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+      topic_title = VALUES(topic_title),
+      category_id = VALUES(category_id),
+      category_name = VALUES(category_name)
+"""
+
+POSTS_UPSERT_SQL = """
+    INSERT INTO posts(
+        post_id, topic_id, author, post_canonical, post_time,
+        admin, attachment, avatar, deletable, deleted, editable,
+        is_forum_admin, is_nothanked, is_thanked, last_edit_reason,
+        last_edit_time, last_editor_username, nothanks_received,
+        num_edits, num_posts,  post_format, post_number,
+        post_rendered, poster_id, reported, show_from_end, show_from_start,
+        thankers, thanks_received
+    )
+    VALUES (
+        %(post_id)s, %(topic_id)s, %(author)s, %(post_canonical)s, %(post_time)s,
+        %(admin)s, %(attachment)s, %(avatar)s, %(deletable)s, %(deleted)s, %(editable)s,
+        %(is_forum_admin)s, %(is_nothanked)s, %(is_thanked)s, %(last_edit_reason)s,
+        %(last_edit_time)s, %(last_editor_username)s, %(nothanks_received)s,
+        %(num_edits)s, %(num_posts)s,  %(post_format)s, %(post_number)s,
+        %(post_rendered)s, %(poster_id)s, %(reported)s, %(show_from_end)s, %(show_from_start)s,
+        %(thankers)s, %(thanks_received)s
+    )
+    ON DUPLICATE KEY UPDATE
+        topic_id = VALUES(topic_id),
+        author = VALUES(author),
+        post_canonical = VALUES(post_canonical),
+        post_time = VALUES(post_time),
+        admin = VALUES(admin),
+        attachment = VALUES(attachment),
+        avatar = VALUES(avatar),
+        deletable = VALUES(deletable),
+        deleted = VALUES(deleted),
+        editable = VALUES(editable),
+        is_forum_admin = VALUES(is_forum_admin),
+        is_nothanked = VALUES(is_nothanked),
+        is_thanked = VALUES(is_thanked),
+        last_edit_reason = VALUES(last_edit_reason),
+        last_edit_time = VALUES(last_edit_time),
+        last_editor_username = VALUES(last_editor_username),
+        nothanks_received = VALUES(nothanks_received),
+        num_edits = VALUES(num_edits),
+        num_posts = VALUES(num_posts),
+
+        post_format = VALUES(post_format),
+        post_number = VALUES(post_number),
+        post_rendered = VALUES(post_rendered),
+        poster_id = VALUES(poster_id),
+        reported = VALUES(reported),
+        show_from_end = VALUES(show_from_end),
+        show_from_start = VALUES(show_from_start),
+        thankers = VALUES(thankers),
+        thanks_received = VALUES(thanks_received)
+"""
+
+# ============ 增量抓取状态 ============
+# topic_state:       每个 topic 上次抓完时 listing 里的 last_post_time，以及已抓到的最大 post_number
+# category_state:    每个板块上次完整跑完时见到的最新 last_post_time (high-water mark)
+# topic_checkpoints: 还没抓完的 topic 下一页的 start_post_num，和该页帖子在同一个事务里提交
+# topic_leases:      多进程 / 多机器共享的 topic 队列 (见 topic_leases.py，--lease 时使用)
+# post_hashes:       每条帖子上次写入时的内容哈希，内容没变的帖子重新抓到时不再重写 (见 split_changed_posts)
+# post_tree_state:   02_topic_tree.py 增量建树用: 每个 topic 已写进 tree_json 的帖子数和这些帖子的指纹
+
+# post_trees 是 02_topic_tree.py / --build-trees 的输出表。topics / posts / progress 是原来就有的表，
+# post_trees 以前要手工建，这里和状态表一起建 (tree_json 大 topic 能到几 MB，用 LONGTEXT)
+POST_TREES_DDL = """
+    CREATE TABLE IF NOT EXISTS post_trees (
+        topic_id BIGINT PRIMARY KEY,
+        topic_title TEXT,
+        posts_num INT,
+        posts_get INT,
+        tree_json LONGTEXT
+    )
+"""
+
+STATE_TABLES_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS topic_state (
+        topic_id BIGINT PRIMARY KEY,
+        last_post_time BIGINT NOT NULL DEFAULT 0,
+        last_post_number INT NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS category_state (
+        category_id BIGINT PRIMARY KEY,
+        high_water_mark BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS topic_checkpoints (
+        topic_id BIGINT PRIMARY KEY,
+        start_post_num INT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS post_hashes (
+        post_id BIGINT PRIMARY KEY,
+        content_hash BIGINT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS post_tree_state (
+        topic_id BIGINT PRIMARY KEY,
+        posts_num INT NOT NULL,
+        tree_hash BIGINT NOT NULL
+    )
+    """,
+    LEASES_DDL,
+    POST_TREES_DDL,
+]
+
+TOPIC_STATE_UPSERT_SQL = """
+    INSERT INTO topic_state(topic_id, last_post_time, last_post_number)
+    VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+      last_post_time = VALUES(last_post_time),
+      last_post_number = GREATEST(last_post_number, VALUES(last_post_number))
+"""
+
+CHECKPOINT_UPSERT_SQL = """
+    INSERT INTO topic_checkpoints(topic_id, start_post_num)
+    VALUES (%s, %s)
+    ON DUPLICATE KEY UPDATE
+      start_post_num = VALUES(start_post_num)
+"""
+
+POST_HASH_UPSERT_SQL = """
+    INSERT INTO post_hashes(post_id, content_hash)
+    VALUES (%s, %s)
+    ON DUPLICATE KEY UPDATE
+      content_hash = VALUES(content_hash)
+"""
+
+# 一次 IN (...) 查多少个 post_id 的哈希
+HASH_LOOKUP_CHUNK = 1000
+
+POST_TREE_UPSERT_SQL = """
+    INSERT INTO post_trees (topic_id, topic_title, posts_num, posts_get, tree_json)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+      topic_title = VALUES(topic_title),
+      posts_num = VALUES(posts_num),
+      posts_get = VALUES(posts_get),
+      tree_json = VALUES(tree_json)
+"""
+
+TREE_STATE_UPSERT_SQL = """
+    INSERT INTO post_tree_state(topic_id, posts_num, tree_hash)
+    VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+      posts_num = VALUES(posts_num),
+      tree_hash = VALUES(tree_hash)
+"""
+
+
+class MySQLStorage:
+    """
+    远程 MySQL。topics / posts / progress / post_trees 四张表假定已经建好，
+    增量状态表和租约表由 ensure_schema() 自动建。
+    """
+
+    name = 'mysql'
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def ensure_schema(self):
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            for ddl in STATE_TABLES_DDL:
+                cur.execute(ddl)
+            conn.commit()
+            cur.close()
+
+    def load_done_topic_ids(self):
+        """progress 表里已经处理完的 topic_id 集合"""
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT topic_id FROM progress")
+            rows = cur.fetchall()
+            cur.close()
+        return {r[0] for r in rows}
+
+    def load_topic_state(self):
+        """
+        读取 topic_state => {topic_id: (last_post_time, last_post_number)}。
+        第一次用增量模式时 topic_state 是空的，先用 posts 表里已有的最大 post_number 补一份，
+        last_post_time 记 0，这样这些 topic 下次会从已知的最后一楼之后接着抓一次。
+        """
+        state = {}
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT COUNT(*) FROM topic_state")
+            if cur.fetchone()[0] == 0:
+                logging.info("topic_state 为空，从 posts 表回填已完成 topic 的最大 post_number ...")
+                cur.execute("""
+                    INSERT IGNORE INTO topic_state(topic_id, last_post_time, last_post_number)
+                    SELECT p.topic_id, 0, MAX(p.post_number)
+                    FROM posts p JOIN progress g ON g.topic_id = p.topic_id
+                    GROUP BY p.topic_id
+                """)
+                conn.commit()
+            cur.execute("SELECT topic_id, last_post_time, last_post_number FROM topic_state")
+            for topic_id, last_post_time, last_post_number in cur.fetchall():
+                state[topic_id] = (last_post_time, last_post_number)
+            cur.close()
+        return state
+
+    def load_checkpoints(self):
+        """topic_checkpoints => {topic_id: start_post_num}"""
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT topic_id, start_post_num FROM topic_checkpoints")
+            checkpoints = dict(cur.fetchall())
+            cur.close()
+        return checkpoints
+
+    def load_high_water_mark(self, category_id):
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT high_water_mark FROM category_state WHERE category_id = %s", (category_id,))
+            row = cur.fetchone()
+            cur.close()
+        return row[0] if row else 0
+
+    def save_high_water_mark(self, category_id, high_water_mark):
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO category_state(category_id, high_water_mark) VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE high_water_mark = GREATEST(high_water_mark, VALUES(high_water_mark))
+            """, (category_id, high_water_mark))
+            conn.commit()
+            cur.close()
+
+    def write_batch(self, topics, posts, leases, checkpoints, done, failed=()):
+        """
+        executemany 一次写入 (mysql.connector 会把 INSERT ... VALUES 改写成多行 VALUES)，
+        一个事务提交；批量失败（通常是某一行数据有问题）时退回逐行写入，坏行记日志跳过。
+        """
+        # 每次提交都从池子里借连接，顺带做健康检查 / 断线重连
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            posts, hashes, skipped = split_changed_posts(posts, lambda ids: self._load_hashes(cur, ids))
+            try:
+                if topics:
+                    cur.executemany(TOPICS_UPSERT_SQL, [build_topic_params(t) for t in topics])
+                if leases:
+                    cur.executemany(LEASE_UPSERT_SQL, [lease_params(t) for t in leases])
+                if posts:
+                    cur.executemany(POSTS_UPSERT_SQL, posts)
+                    cur.executemany(POST_HASH_UPSERT_SQL, hashes)
+                if checkpoints:
+                    cur.executemany(CHECKPOINT_UPSERT_SQL, checkpoints)
+                if done:
+                    cur.executemany("INSERT IGNORE INTO progress(topic_id) VALUES(%s)",
+                                    [(d[0],) for d in done])
+                    cur.executemany(TOPIC_STATE_UPSERT_SQL, done)
+                    cur.executemany("DELETE FROM topic_checkpoints WHERE topic_id = %s",
+                                    [(d[0],) for d in done])
+                    cur.executemany(LEASE_DONE_SQL, [(d[0],) for d in done])
+                if failed:
+                    cur.executemany(LEASE_FAILED_SQL, [(topic_id,) for topic_id in failed])
+                conn.commit()
+            except Exception as e:
+                logging.error(f"批量写入失败，改为逐行写入: {e}")
+                conn.rollback()
+                self._write_rows(conn, topics, posts, hashes, leases, checkpoints, done, failed)
+            finally:
+                cur.close()
+        return skipped
+
+    def _load_hashes(self, cur, post_ids):
+        known = {}
+        for i in range(0, len(post_ids), HASH_LOOKUP_CHUNK):
+            chunk = post_ids[i:i + HASH_LOOKUP_CHUNK]
+            cur.execute(f"SELECT post_id, content_hash FROM post_hashes "
+                        f"WHERE post_id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+            known.update(cur.fetchall())
+        return known
+
+    def _write_rows(self, conn, topics, posts, hashes, leases, checkpoints, done, failed):
+        cur = conn.cursor()
+        for t in topics:
+            try:
+                cur.execute(TOPICS_UPSERT_SQL, build_topic_params(t))
+            except Exception as e:
+                logging.error(f"[topic_id={t.get('topic_id')}] 插入topic失败: {e}")
+        if leases:
+            cur.executemany(LEASE_UPSERT_SQL, [lease_params(t) for t in leases])
+        for params, post_hash in zip(posts, hashes):
+            try:
+                cur.execute(POSTS_UPSERT_SQL, params)
+                cur.execute(POST_HASH_UPSERT_SQL, post_hash)
+            except Exception as e:
+                logging.error(f"[topic_id={params['topic_id']}] 插入帖子 {params['post_id']} 失败: {e}")
+        if checkpoints:
+            cur.executemany(CHECKPOINT_UPSERT_SQL, checkpoints)
+        # 原逻辑是 "ON CONFLICT DO NOTHING", 用 MySQL 可用 INSERT IGNORE or ON DUP KEY
+        for topic_id, last_post_time, last_post_number in done:
+            try:
+                cur.execute("INSERT IGNORE INTO progress(topic_id) VALUES(%s)", (topic_id,))
+                cur.execute(TOPIC_STATE_UPSERT_SQL, (topic_id, last_post_time, last_post_number))
+                cur.execute("DELETE FROM topic_checkpoints WHERE topic_id = %s", (topic_id,))
+                cur.execute(LEASE_DONE_SQL, (topic_id,))
+            except Exception as e:
+                logging.error(f"[topic_id={topic_id}] 插入进度表失败: {e}")
+        if failed:
+            cur.executemany(LEASE_FAILED_SQL, [(topic_id,) for topic_id in failed])
+        conn.commit()
+        cur.close()
+
+    def load_topic_posts(self, topic_id):
+        """
+        02_topic_tree.py 用: 返回 (topic_title, posts)，
+        posts 按 post_time 排序，每条含 post_id / author / post_time(datetime) / post_canonical
+        """
+        with self.pool.connection() as conn:
+            cur = conn.cursor(dictionary=True)
+            cur.execute("SELECT topic_title FROM topics WHERE topic_id = %s", (topic_id,))
+            row_topic = cur.fetchone()
+            cur.execute("""
+                SELECT post_id, author, post_time, post_canonical
+                FROM posts
+                WHERE topic_id = %s
+                ORDER BY post_time ASC, post_id ASC
+            """, (topic_id,))
+            rows = cur.fetchall()
+            cur.close()
+        return (row_topic["topic_title"] if row_topic else ""), rows
+
+    def iter_topic_posts(self, topic_ids=None):
+        """
+        02_topic_tree.py 批量模式用: 一条流式查询读出所有 (或 topic_ids 里的) 帖子，
+        按 topic 逐个 yield (topic_id, topic_title, posts)，posts 和 load_topic_posts 返回的一样。
+        游标不缓冲，客户端内存里只有当前这一个 topic；按 (topic_id, post_id) 排序正好走 idx_topic，
+        不用服务器端 filesort，topic 内再按 post_time 排。
+        读的时候这条连接一直占着，写 post_trees 用池里的另一条。
+        """
+        sql = """
+            SELECT p.topic_id, t.topic_title, p.post_id, p.author, p.post_time, p.post_canonical
+            FROM posts p
+            LEFT JOIN topics t ON t.topic_id = p.topic_id
+        """
+        params = ()
+        if topic_ids:
+            sql += f" WHERE p.topic_id IN ({', '.join(['%s'] * len(topic_ids))})"
+            params = tuple(topic_ids)
+        sql += " ORDER BY p.topic_id, p.post_id"
+        with self.pool.connection() as conn:
+            cur = conn.cursor(dictionary=True, buffered=False)
+            cur.execute(sql, params)
+            try:
+                yield from group_topic_posts(
+                    (r.pop('topic_id'), r.pop('topic_title'), r) for r in cur
+                )
+            finally:
+                cur.close()
+
+    def load_tree_states(self, topic_ids=None):
+        """
+        02_topic_tree.py 增量建树用: {topic_id: (posts_num, tree_hash)}，
+        即上次写进 tree_json 的帖子数和这些帖子的指纹。没有记录的 topic 只能整棵重建。
+        """
+        sql = "SELECT topic_id, posts_num, tree_hash FROM post_tree_state"
+        params = ()
+        if topic_ids:
+            sql += f" WHERE topic_id IN ({', '.join(['%s'] * len(topic_ids))})"
+            params = tuple(topic_ids)
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            states = {topic_id: (posts_num, tree_hash) for topic_id, posts_num, tree_hash in cur.fetchall()}
+            cur.close()
+        return states
+
+    def load_post_tree(self, topic_id):
+        """已写入的 tree_json，没有返回 None"""
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT tree_json FROM post_trees WHERE topic_id = %s", (topic_id,))
+            row = cur.fetchone()
+            cur.close()
+        return row[0] if row else None
+
+    def iter_post_trees(self, topic_ids=None):
+        """
+        tree_stats.py 用: 按 topic_id 顺序逐个 yield (topic_id, tree_json)，游标不缓冲，
+        客户端内存里只有当前这一行
+        """
+        sql = "SELECT topic_id, tree_json FROM post_trees"
+        params = ()
+        if topic_ids:
+            sql += f" WHERE topic_id IN ({', '.join(['%s'] * len(topic_ids))})"
+            params = tuple(topic_ids)
+        sql += " ORDER BY topic_id"
+        with self.pool.connection() as conn:
+            cur = conn.cursor(buffered=False)
+            cur.execute(sql, params)
+            try:
+                yield from cur
+            finally:
+                cur.close()
+
+    def save_post_trees(self, rows, states=()):
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.executemany(POST_TREE_UPSERT_SQL, rows)
+            if states:
+                cur.executemany(TREE_STATE_UPSERT_SQL, states)
+            conn.commit()
+            cur.close()
+
+    def close(self):
+        self.pool.close_all()
+
+
+# ---------------- SQLite ----------------
+
+SQLITE_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS topics (
+        topic_id INTEGER PRIMARY KEY,
+        topic_title TEXT,
+        category_id INTEGER,
+        category_name TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS posts (
+        post_id INTEGER PRIMARY KEY,
+        topic_id INTEGER,
+        author TEXT,
+        post_canonical TEXT,
+        post_time TEXT,
+        admin INTEGER, attachment INTEGER, avatar TEXT,
+        deletable INTEGER, deleted INTEGER, editable INTEGER,
+        is_forum_admin INTEGER, is_nothanked INTEGER, is_thanked INTEGER,
+        last_edit_reason TEXT, last_edit_time INTEGER, last_editor_username TEXT,
+        nothanks_received INTEGER, num_edits INTEGER, num_posts INTEGER, post_format TEXT,
+        post_number INTEGER, post_rendered TEXT, poster_id INTEGER,
+        reported INTEGER, show_from_end INTEGER, show_from_start INTEGER,
+        thankers TEXT, thanks_received INTEGER
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_posts_topic ON posts(topic_id, post_time)",
+    "CREATE TABLE IF NOT EXISTS progress (topic_id INTEGER PRIMARY KEY)",
+    """
+    CREATE TABLE IF NOT EXISTS post_trees (
+        topic_id INTEGER PRIMARY KEY,
+        topic_title TEXT,
+        posts_num INTEGER,
+        posts_get INTEGER,
+        tree_json TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS topic_state (
+        topic_id INTEGER PRIMARY KEY,
+        last_post_time INTEGER NOT NULL DEFAULT 0,
+        last_post_number INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS category_state (
+        category_id INTEGER PRIMARY KEY,
+        high_water_mark INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS topic_checkpoints (
+        topic_id INTEGER PRIMARY KEY,
+        start_post_num INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS post_hashes (
+        post_id INTEGER PRIMARY KEY,
+        content_hash INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS post_tree_state (
+        topic_id INTEGER PRIMARY KEY,
+        posts_num INTEGER NOT NULL,
+        tree_hash INTEGER NOT NULL
+    )
+    """,
+]
+
+
+def _sqlite_upsert(table, columns, key):
+    updates = ', '.join(f"{c} = excluded.{c}" for c in columns if c != key)
+    return (f"INSERT INTO {table}({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT({key}) DO UPDATE SET {updates}")
+
+
+SQLITE_TOPICS_UPSERT_SQL = _sqlite_upsert('topics', TOPIC_COLUMNS, 'topic_id')
+SQLITE_POSTS_UPSERT_SQL = _sqlite_upsert('posts', POST_COLUMNS, 'post_id')
+SQLITE_POST_TREE_UPSERT_SQL = _sqlite_upsert('post_trees', POST_TREE_COLUMNS, 'topic_id')
+SQLITE_CHECKPOINT_UPSERT_SQL = _sqlite_upsert('topic_checkpoints', ['topic_id', 'start_post_num'], 'topic_id')
+SQLITE_POST_HASH_UPSERT_SQL = _sqlite_upsert('post_hashes', ['post_id', 'content_hash'], 'post_id')
+SQLITE_TREE_STATE_UPSERT_SQL = _sqlite_upsert('post_tree_state', ['topic_id', 'posts_num', 'tree_hash'], 'topic_id')
+SQLITE_TOPIC_STATE_UPSERT_SQL = """
+    INSERT INTO topic_state(topic_id, last_post_time, last_post_number) VALUES (?, ?, ?)
+    ON CONFLICT(topic_id) DO UPDATE SET
+      last_post_time = excluded.last_post_time,
+      last_post_number = MAX(last_post_number, excluded.last_post_number)
+"""
+
+
+# 一行数据本身有问题 (类型绑不上、违反约束) 时 sqlite3 抛的异常，逐行写入时记日志跳过
+SQLITE_ROW_ERRORS = (sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError,
+                     sqlite3.DataError)
+
+
+def _sqlite_post_row(params):
+    """post_time 存成 'YYYY-MM-DD HH:MM:SS' 文本，读的时候再转回 datetime"""
+    row = [params[c] for c in POST_COLUMNS]
+    post_time = params['post_time']
+    if isinstance(post_time, datetime.datetime):
+        row[POST_COLUMNS.index('post_time')] = post_time.strftime("%Y-%m-%d %H:%M:%S")
+    return row
+
+
+def _sqlite_tree_post(post_id, author, post_time, post_canonical):
+    """load_topic_posts / iter_topic_posts 的一行，post_time 从文本转回 datetime"""
+    return {
+        "post_id": post_id,
+        "author": author,
+        "post_time": datetime.datetime.fromisoformat(post_time) if post_time else None,
+        "post_canonical": post_canonical,
+    }
+
+
+class SQLiteStorage:
+    """
+    本地 SQLite 文件。WAL 模式下 BulkWriter 线程写、其它线程读互不阻塞；
+    每个线程用自己的连接，每批 write_batch 一个事务。
+    所有表 (包括 topics / posts / progress / post_trees) 第一次用时自动建。
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL 下 NORMAL 只在断电时可能丢最后几个事务，不会损坏库
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def ensure_schema(self):
+        conn = self._conn()
+        with conn:
+            for ddl in SQLITE_DDL:
+                conn.execute(ddl)
+
+    def load_done_topic_ids(self):
+        return {r[0] for r in self._conn().execute("SELECT topic_id FROM progress")}
+
+    def load_topic_state(self):
+        conn = self._conn()
+        if conn.execute("SELECT COUNT(*) FROM topic_state").fetchone()[0] == 0:
+            with conn:
+                conn.execute("""
+                    INSERT OR IGNORE INTO topic_state(topic_id, last_post_time, last_post_number)
+                    SELECT p.topic_id, 0, MAX(p.post_number)
+                    FROM posts p JOIN progress g ON g.topic_id = p.topic_id
+                    GROUP BY p.topic_id
+                """)
+        rows = conn.execute("SELECT topic_id, last_post_time, last_post_number FROM topic_state")
+        return {topic_id: (t, n) for topic_id, t, n in rows}
+
+    def load_checkpoints(self):
+        return dict(self._conn().execute("SELECT topic_id, start_post_num FROM topic_checkpoints"))
+
+    def load_high_water_mark(self, category_id):
+        row = self._conn().execute(
+            "SELECT high_water_mark FROM category_state WHERE category_id = ?", (category_id,)).fetchone()
+        return row[0] if row else 0
+
+    def save_high_water_mark(self, category_id, high_water_mark):
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+                INSERT INTO category_state(category_id, high_water_mark) VALUES (?, ?)
+                ON CONFLICT(category_id) DO UPDATE SET
+                  high_water_mark = MAX(high_water_mark, excluded.high_water_mark)
+            """, (category_id, high_water_mark))
+
+    def write_batch(self, topics, posts, leases, checkpoints, done, failed=()):
+        """
+        同 MySQLStorage.write_batch: executemany 一个事务提交，某一行数据有问题导致整批失败时
+        回滚，退回逐行写入，坏行记日志跳过。库被锁 / 磁盘错误这类 OperationalError 照常抛出，
+        BulkWriter 整批重试。
+        """
+        conn = self._conn()
+        posts, hashes, skipped = split_changed_posts(posts, lambda ids: self._load_hashes(conn, ids))
+        try:
+            # with conn: 正常结束 commit，抛异常 rollback
+            with conn:
+                if topics:
+                    conn.executemany(SQLITE_TOPICS_UPSERT_SQL, [build_topic_params(t) for t in topics])
+                if posts:
+                    conn.executemany(SQLITE_POSTS_UPSERT_SQL, [_sqlite_post_row(p) for p in posts])
+                    conn.executemany(SQLITE_POST_HASH_UPSERT_SQL, hashes)
+                if checkpoints:
+                    conn.executemany(SQLITE_CHECKPOINT_UPSERT_SQL, checkpoints)
+                if done:
+                    conn.executemany("INSERT OR IGNORE INTO progress(topic_id) VALUES (?)",
+                                     [(d[0],) for d in done])
+                    conn.executemany(SQLITE_TOPIC_STATE_UPSERT_SQL, done)
+                    conn.executemany("DELETE FROM topic_checkpoints WHERE topic_id = ?",
+                                     [(d[0],) for d in done])
+        except SQLITE_ROW_ERRORS as e:
+            logging.error(f"批量写入失败，改为逐行写入: {e}")
+            self._write_rows(conn, topics, posts, hashes, checkpoints, done)
+        return skipped
+
+    def _write_rows(self, conn, topics, posts, hashes, checkpoints, done):
+        # SQLite 里单条语句失败只撤销这一条，不影响同一事务里已经写进去的行
+        with conn:
+            for t in topics:
+                try:
+                    conn.execute(SQLITE_TOPICS_UPSERT_SQL, build_topic_params(t))
+                except SQLITE_ROW_ERRORS as e:
+                    logging.error(f"[topic_id={t.get('topic_id')}] 插入topic失败: {e}")
+            for params, post_hash in zip(posts, hashes):
+                try:
+                    conn.execute(SQLITE_POSTS_UPSERT_SQL, _sqlite_post_row(params))
+                    conn.execute(SQLITE_POST_HASH_UPSERT_SQL, post_hash)
+                except SQLITE_ROW_ERRORS as e:
+                    logging.error(f"[topic_id={params['topic_id']}] 插入帖子 {params['post_id']} 失败: {e}")
+            if checkpoints:
+                conn.executemany(SQLITE_CHECKPOINT_UPSERT_SQL, checkpoints)
+            for topic_id, last_post_time, last_post_number in done:
+                try:
+                    conn.execute("INSERT OR IGNORE INTO progress(topic_id) VALUES (?)", (topic_id,))
+                    conn.execute(SQLITE_TOPIC_STATE_UPSERT_SQL, (topic_id, last_post_time, last_post_number))
+                    conn.execute("DELETE FROM topic_checkpoints WHERE topic_id = ?", (topic_id,))
+                except SQLITE_ROW_ERRORS as e:
+                    logging.error(f"[topic_id={topic_id}] 插入进度表失败: {e}")
+
+    def _load_hashes(self, conn, post_ids):
+        known = {}
+        # SQLite 默认最多 999 个绑定参数
+        for i in range(0, len(post_ids), 900):
+            chunk = post_ids[i:i + 900]
+            known.update(conn.execute(f"SELECT post_id, content_hash FROM post_hashes "
+                                      f"WHERE post_id IN ({', '.join('?' * len(chunk))})", chunk))
+        return known
+
+    def load_topic_posts(self, topic_id):
+        conn = self._conn()
+        row_topic = conn.execute("SELECT topic_title FROM topics WHERE topic_id = ?", (topic_id,)).fetchone()
+        rows = []
+        for row in conn.execute("""
+            SELECT post_id, author, post_time, post_canonical
+            FROM posts
+            WHERE topic_id = ?
+            ORDER BY post_time ASC, post_id ASC
+        """, (topic_id,)):
+            rows.append(_sqlite_tree_post(*row))
+        return (row_topic[0] if row_topic else ""), rows
+
+    def iter_topic_posts(self, topic_ids=None):
+        """见 MySQLStorage.iter_topic_posts；sqlite3 的游标本来就是边取边读"""
+        sql = """
+            SELECT p.topic_id, t.topic_title, p.post_id, p.author, p.post_time, p.post_canonical
+            FROM posts p
+            LEFT JOIN topics t ON t.topic_id = p.topic_id
+        """
+        params = ()
+        if topic_ids:
+            sql += f" WHERE p.topic_id IN ({', '.join(['?'] * len(topic_ids))})"
+            params = tuple(topic_ids)
+        sql += " ORDER BY p.topic_id, p.post_id"
+        # 单独开一条只读连接，边读边写 post_trees 时不和写事务共用游标
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            yield from group_topic_posts(
+                (row[0], row[1], _sqlite_tree_post(*row[2:])) for row in conn.execute(sql, params)
+            )
+        finally:
+            conn.close()
+
+    def load_tree_states(self, topic_ids=None):
+        sql = "SELECT topic_id, posts_num, tree_hash FROM post_tree_state"
+        params = ()
+        if topic_ids:
+            sql += f" WHERE topic_id IN ({', '.join(['?'] * len(topic_ids))})"
+            params = tuple(topic_ids)
+        return {topic_id: (posts_num, tree_hash)
+                for topic_id, posts_num, tree_hash in self._conn().execute(sql, params)}
+
+    def load_post_tree(self, topic_id):
+        row = self._conn().execute("SELECT tree_json FROM post_trees WHERE topic_id = ?", (topic_id,)).fetchone()
+        return row[0] if row else None
+
+    def iter_post_trees(self, topic_ids=None):
+        """见 MySQLStorage.iter_post_trees"""
+        sql = "SELECT topic_id, tree_json FROM post_trees"
+        params = ()
+        if topic_ids:
+            sql += f" WHERE topic_id IN ({', '.join(['?'] * len(topic_ids))})"
+            params = tuple(topic_ids)
+        sql += " ORDER BY topic_id"
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            yield from conn.execute(sql, params)
+        finally:
+            conn.close()
+
+    def save_post_trees(self, rows, states=()):
+        conn = self._conn()
+        with conn:
+            conn.executemany(SQLITE_POST_TREE_UPSERT_SQL, rows)
+            conn.executemany(SQLITE_TREE_STATE_UPSERT_SQL, states)
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+# ---------------- Parquet ----------------
+
+if pyarrow is not None:
+    PARQUET_SCHEMAS = {
+        'topics': pyarrow.schema([
+            ('topic_id', pyarrow.int64()), ('topic_title', pyarrow.string()),
+            ('category_id', pyarrow.int64()), ('category_name', pyarrow.string()),
+        ]),
+        'posts': pyarrow.schema([
+            ('post_id', pyarrow.int64()), ('topic_id', pyarrow.int64()),
+            ('author', pyarrow.string()), ('post_canonical', pyarrow.string()),
+            ('post_time', pyarrow.timestamp('s')),
+            ('admin', pyarrow.bool_()), ('attachment', pyarrow.bool_()), ('avatar', pyarrow.string()),
+            ('deletable', pyarrow.bool_()), ('deleted', pyarrow.bool_()), ('editable', pyarrow.bool_()),
+            ('is_forum_admin', pyarrow.bool_()), ('is_nothanked', pyarrow.bool_()),
+            ('is_thanked', pyarrow.bool_()), ('last_edit_reason', pyarrow.string()),
+            ('last_edit_time', pyarrow.int64()), ('last_editor_username', pyarrow.string()),
+            ('nothanks_received', pyarrow.int64()), ('num_edits', pyarrow.int64()),
+            ('num_posts', pyarrow.int64()), ('post_format', pyarrow.string()),
+            ('post_number', pyarrow.int64()), ('post_rendered', pyarrow.string()),
+            ('poster_id', pyarrow.int64()), ('reported', pyarrow.bool_()),
+            ('show_from_end', pyarrow.bool_()), ('show_from_start', pyarrow.bool_()),
+            ('thankers', pyarrow.string()), ('thanks_received', pyarrow.int64()),
+            ('content_hash', pyarrow.int64()),
+        ]),
+        'progress': pyarrow.schema([
+            ('topic_id', pyarrow.int64()), ('last_post_time', pyarrow.int64()),
+            ('last_post_number', pyarrow.int64()), ('done_at', pyarrow.int64()),
+        ]),
+        'post_trees': pyarrow.schema([
+            ('topic_id', pyarrow.int64()), ('topic_title', pyarrow.string()),
+            ('posts_num', pyarrow.int64()), ('posts_get', pyarrow.int64()),
+            ('tree_json', pyarrow.string()),
+        ]),
+    }
+
+
+class ParquetSink:
+    """
+    只追加的 Parquet 目录:
+        <dir>/topics/part-*.parquet
+        <dir>/posts/part-*.parquet
+        <dir>/progress/part-*.parquet     每完成一个 topic 一行 (含 last_post_time / last_post_number)
+        <dir>/post_trees/part-*.parquet
+        <dir>/state.json                  断点、high-water mark 和增量建树的 tree_state (每次整体改写)
+    每次 write_batch 每张表写一个 part 文件。posts 多一列 content_hash，内容没变的帖子不再追加；
+    变了的会有多行，读的时候按 post_id 取最后一次。
+    pyarrow.dataset / pandas / duckdb 都可以直接把整个目录当一张表读。
+    """
+
+    name = 'parquet'
+
+    def __init__(self, directory):
+        if pyarrow is None:
+            raise RuntimeError("parquet 存储需要先安装 pyarrow: pip install pyarrow")
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._seq = 0
+        # 文件名带上启动时间，多次运行写同一个目录不会撞名
+        self._run_id = time.strftime("%Y%m%d_%H%M%S")
+        self._state = {'checkpoints': {}, 'high_water_marks': {}, 'tree_state': {}}
+        # {post_id: content_hash}，第一次 write_batch 时从 posts 读一遍，之后随追加更新，不再每批扫目录
+        self._hashes = None
+
+    def _table_dir(self, table):
+        return os.path.join(self.directory, table)
+
+    def _state_path(self):
+        return os.path.join(self.directory, 'state.json')
+
+    def ensure_schema(self):
+        for table in PARQUET_SCHEMAS:
+            os.makedirs(self._table_dir(table), exist_ok=True)
+        if os.path.exists(self._state_path()):
+            with open(self._state_path(), encoding='utf-8') as f:
+                self._state.update(json.load(f))
+
+    def _save_state(self):
+        tmp = self._state_path() + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._state, f)
+        os.replace(tmp, self._state_path())
+
+    def _append(self, table, rows):
+        if not rows:
+            return
+        self._seq += 1
+        path = os.path.join(self._table_dir(table), f"part-{self._run_id}-{self._seq:06d}.parquet")
+        # 先写临时文件再改名，读的人不会看到写了一半的文件
+        pyarrow.parquet.write_table(pyarrow.Table.from_pylist(rows, schema=PARQUET_SCHEMAS[table]),
+                                    path + '.tmp', compression='zstd')
+        os.replace(path + '.tmp', path)
+
+    def _read(self, table, columns=None, filters=None):
+        if not any(f.endswith('.parquet') for f in os.listdir(self._table_dir(table))):
+            return []
+        return pyarrow.parquet.read_table(self._table_dir(table), columns=columns,
+                                          filters=filters).to_pylist()
+
+    def load_done_topic_ids(self):
+        return {r['topic_id'] for r in self._read('progress', ['topic_id'])}
+
+    def load_topic_state(self):
+        state = {}
+        for r in self._read('progress'):
+            known_time, known_number = state.get(r['topic_id'], (0, 0))
+            state[r['topic_id']] = (max(known_time, r['last_post_time']),
+                                    max(known_number, r['last_post_number']))
+        return state
+
+    def load_checkpoints(self):
+        return {int(k): v for k, v in self._state['checkpoints'].items()}
+
+    def load_high_water_mark(self, category_id):
+        return self._state['high_water_marks'].get(str(category_id), 0)
+
+    def save_high_water_mark(self, category_id, high_water_mark):
+        with self._lock:
+            marks = self._state['high_water_marks']
+            marks[str(category_id)] = max(marks.get(str(category_id), 0), high_water_mark)
+            self._save_state()
+
+    def write_batch(self, topics, posts, leases, checkpoints, done, failed=()):
+        with self._lock:
+            posts, hashes, skipped = split_changed_posts(posts, self._load_hashes)
+            self._append('topics', [dict(zip(TOPIC_COLUMNS, build_topic_params(t))) for t in topics])
+            self._append('posts', [{**p, 'content_hash': h} for p, (_, h) in zip(posts, hashes)])
+            if hashes:
+                self._hashes.update(hashes)
+            now = int(time.time())
+            self._append('progress', [{'topic_id': topic_id, 'last_post_time': last_post_time,
+                                       'last_post_number': last_post_number, 'done_at': now}
+                                      for topic_id, last_post_time, last_post_number in done])
+            if checkpoints or done:
+                saved = self._state['checkpoints']
+                saved.update({str(topic_id): start for topic_id, start in checkpoints})
+                for d in done:
+                    saved.pop(str(d[0]), None)
+                self._save_state()
+        return skipped
+
+    def _load_hashes(self, post_ids):
+        """
+        part 文件没有按 post_id 排序，每批按 post_id 过滤也要把整个目录扫一遍 (总共 O(N²))，
+        所以只在第一次调用时读 post_id / content_hash 两列建内存索引 (同一帖子多行时后写的覆盖先写的)
+        """
+        if self._hashes is None:
+            self._hashes = {r['post_id']: r['content_hash']
+                            for r in self._read('posts', ['post_id', 'content_hash'])}
+        return {post_id: self._hashes[post_id] for post_id in post_ids if post_id in self._hashes}
+
+    def load_topic_posts(self, topic_id):
+        topics = self._read('topics', ['topic_title'], [('topic_id', '=', topic_id)])
+        latest = {}
+        for r in self._read('posts', ['post_id', 'author', 'post_time', 'post_canonical'],
+                            [('topic_id', '=', topic_id)]):
+            latest[r['post_id']] = r
+        return (topics[-1]['topic_title'] if topics else ""), sort_topic_posts(latest.values())
+
+    def iter_topic_posts(self, topic_ids=None):
+        """见 MySQLStorage.iter_topic_posts；part 文件没有按 topic 排序，只能整列读进来再分组"""
+        filters = [('topic_id', 'in', list(topic_ids))] if topic_ids else None
+        titles = {r['topic_id']: r['topic_title']
+                  for r in self._read('topics', ['topic_id', 'topic_title'], filters)}
+        latest = {}
+        for r in self._read('posts', ['topic_id', 'post_id', 'author', 'post_time', 'post_canonical'],
+                            filters):
+            latest[r['post_id']] = r
+        rows = sorted(latest.values(), key=lambda r: r['topic_id'])
+        yield from group_topic_posts((r['topic_id'], titles.get(r['topic_id']), r) for r in rows)
+
+    def load_tree_states(self, topic_ids=None):
+        saved = self._state['tree_state']
+        if topic_ids:
+            saved = {str(t): saved[str(t)] for t in topic_ids if str(t) in saved}
+        return {int(k): tuple(v) for k, v in saved.items()}
+
+    def load_post_tree(self, topic_id):
+        trees = self._read('post_trees', ['tree_json'], [('topic_id', '=', topic_id)])
+        return trees[-1]['tree_json'] if trees else None
+
+    def iter_post_trees(self, topic_ids=None):
+        """见 MySQLStorage.iter_post_trees；同一个 topic 追加过多次的以最后一次为准"""
+        filters = [('topic_id', 'in', list(topic_ids))] if topic_ids else None
+        latest = {r['topic_id']: r['tree_json'] for r in self._read('post_trees', ['topic_id', 'tree_json'], filters)}
+        for topic_id in sorted(latest):
+            yield topic_id, latest[topic_id]
+
+    def save_post_trees(self, rows, states=()):
+        with self._lock:
+            self._append('post_trees', [dict(zip(POST_TREE_COLUMNS, r)) for r in rows])
+            if states:
+                self._state['tree_state'].update(
+                    {str(topic_id): [posts_num, tree_hash] for topic_id, posts_num, tree_hash in states})
+                self._save_state()
+
+    def close(self):
+        pass
+
+
+STORAGE_BACKENDS = ['mysql', 'sqlite', 'parquet']
+
+
+def open_storage(kind, path=None, pool=None):
+    """
+    按命令行参数建存储后端: mysql 用传进来的连接池；sqlite 的 path 是数据库文件，parquet 的 path 是目录
+    """
+    if kind == 'mysql':
+        return MySQLStorage(pool)
+    if kind == 'sqlite':
+        return SQLiteStorage(path or 'aops.sqlite3')
+    if kind == 'parquet':
+        return ParquetSink(path or 'aops_parquet')
+    raise ValueError(f"未知的存储后端: {kind}")
@@ -0,0 +1,59 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import SQLiteStorage
+
+
+@pytest.fixture
+def crawler():
+    # 模块名以数字开头，只能用 importlib 导入；导入时只建连接池对象，不连数据库
+    return importlib.import_module('01_crawler')
+
+
+@pytest.fixture
+def topic_tree():
+    # 同上; 模块级的 logging.basicConfig 在 pytest 下不生效 (根 logger 已经有 handler)，不会写日志文件
+    return importlib.import_module('02_topic_tree')
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'aops.sqlite3'))
+    storage.ensure_schema()
+    yield storage
+    storage.close()
+
+
+@pytest.fixture
+def run_crawler(crawler, monkeypatch, tmp_path):
+    """
+    起一个 fake_aops_server，用 SQLite 跑 01_crawler.main(argv)。
+    main() 会改模块里的全局变量，这里都先登记给 monkeypatch，测试结束后还原；不写日志文件
+    """
+    import fake_aops_server
+
+    for name in ('STORAGE', 'METRICS', 'RATE_LIMITER', 'PAGE_SIZER', 'ARCHIVE', 'TREE_BUILDER', 'AJAX_URL'):
+        monkeypatch.setattr(crawler, name, getattr(crawler, name))
+    monkeypatch.setattr(crawler, 'setup_logging', lambda: None)
+    monkeypatch.setattr(crawler.AdaptiveRateLimiter, 'backoff', lambda self, attempt, retry_after=None: 0)
+    servers = []
+
+    def run(forum, *argv, storage_path=None):
+        if not servers:
+            server, ajax_url = fake_aops_server.start_server(forum, latency_ms=0, latency_jitter_ms=0)
+            servers.append(server)
+            crawler.AJAX_URL = ajax_url
+        path = storage_path or str(tmp_path / 'crawl.sqlite3')
+        return crawler.main(['--categories', str(forum.category_id), '--storage', 'sqlite',
+                             '--storage-path', path, '--rate', '1000', '--max-rate', '1000',
+                             '--flush-interval', '0.05', *argv])
+
+    yield run
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+
+
+class RecordingStorage:
+    """记下每次 write_batch 收到的东西；fail_times 次之前抛异常，gate 没放行时阻塞"""
+
+    def __init__(self, fail_times=0, gate=None):
+        self.batches = []
+        self.fail_times = fail_times
+        self.gate = gate
+
+    def write_batch(self, topics, posts, leases, checkpoints, done, failed=()):
+        if self.gate is not None:
+            self.gate.wait()
+        if self.fail_times:
+            self.fail_times -= 1
+            raise RuntimeError("database unavailable")
+        self.batches.append({'topics': list(topics), 'posts': [p['post_id'] for p in posts],
+                             'checkpoints': list(checkpoints), 'done': [d[0] for d in done],
+                             'failed': list(failed)})
+        return 0
+
+
+def post(post_id, topic_id=1, size=10):
+    return {'post_id': post_id, 'topic_id': topic_id, 'post_canonical': 'x' * size}
+
+
+@pytest.fixture
+def storage(crawler, monkeypatch):
+    def install(**kwargs):
+        recording = RecordingStorage(**kwargs)
+        monkeypatch.setattr(crawler, 'STORAGE', recording)
+        return recording
+    return install
+
+
+def test_flushes_every_batch_size_rows(crawler, storage):
+    recording = storage()
+    writer = crawler.BulkWriter(batch_size=3, flush_interval=60).start()
+    for i in range(7):
+        writer.add_posts([post(i)])
+    writer.close()
+    assert [b['posts'] for b in recording.batches] == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_progress_is_never_committed_before_its_posts(crawler, storage):
+    recording = storage()
+    writer = crawler.BulkWriter(batch_size=4, flush_interval=60).start()
+    expected = {}
+    for topic_id in range(1, 6):
+        rows = [post(topic_id * 100 + n, topic_id) for n in range(topic_id)]
+        expected[topic_id] = {r['post_id'] for r in rows}
+        writer.add_posts(rows, (topic_id, topic_id + 1))
+        writer.mark_done(topic_id, 1_700_000_000, topic_id)
+    writer.close()
+
+    written = set()
+    for batch in recording.batches:
+        written.update(batch['posts'])
+        for topic_id in batch['done']:
+            assert expected[topic_id] <= written
+    assert sorted(t for b in recording.batches for t in b['done']) == [1, 2, 3, 4, 5]
+
+
+def test_failed_batch_is_retried_and_events_fire_after_commit(crawler, storage):
+    recording = storage(fail_times=1)
+    events = []
+    writer = crawler.BulkWriter(batch_size=2, flush_interval=0.05,
+                                on_done=lambda *event: events.append((event, len(recording.batches))))
+    writer.start()
+    writer.add_posts([post(1), post(2)], (1, 3))
+    writer.mark_done(1, 1_700_000_000, 2, event=(1, 'title'))
+    writer.close()
+
+    assert [p for b in recording.batches for p in b['posts']] == [1, 2]
+    assert [t for b in recording.batches for t in b['done']] == [1]
+    # 事件只在 progress 提交成功之后发一次
+    assert events == [((1, 'title'), len(recording.batches))]
+    assert writer.stats['posts'] == 2 and writer.stats['done'] == 1
+
+
+
+
+def test_add_posts_blocks_while_over_memory_budget(crawler, storage):
+    gate = threading.Event()
+    recording = storage(gate=gate)
+    budget = crawler.estimate_bytes([post(0, size=1000)]) * 2
+    writer = crawler.BulkWriter(batch_size=1, flush_interval=60, max_pending_bytes=budget).start()
+
+    writer.add_posts([post(1, size=1000)])
+    writer.add_posts([post(2, size=1000)])
+    third = threading.Thread(target=writer.add_posts, args=([post(3, size=1000)],))
+    third.start()
+    time.sleep(0.2)
+    # 前两批还卡在 write_batch 里没提交，第三批超出预算，只能等
+    assert third.is_alive()
+    assert writer.stats['peak_pending_bytes'] <= budget
+
+    gate.set()
+    third.join(5)
+    assert not third.is_alive()
+    writer.close()
+    assert [p for b in recording.batches for p in b['posts']] == [1, 2, 3]
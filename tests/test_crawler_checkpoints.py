@@ -0,0 +1,123 @@
+import json
+
+import fake_aops_server
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.text = json.dumps(payload)
+        self.status_code = 200
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def serve_posts(forum, fail_from=None):
+    """代替 post_ajax: start_post_num >= fail_from 的页面当作重试用完，返回 None"""
+    requested = []
+
+    def post_ajax(session, headers, data, log_prefix):
+        start = int(data['start_post_num'])
+        requested.append(start)
+        if fail_from is not None and start >= fail_from:
+            return None
+        return FakeResponse({'response': forum.fetch_posts(data['topic_id'], start, int(data['num_to_fetch']))})
+
+    return post_ajax, requested
+
+
+def make_topic(num_posts):
+    forum = fake_aops_server.FakeForum(num_topics=1, max_page_size=10, quote_rate=0)
+    topic = dict(forum.topics[0], num_posts=num_posts)
+    forum.topics_by_id[topic['topic_id']] = topic
+    return forum, topic
+
+
+def crawl(crawler, topic, writer):
+    crawler.fetch_posts_for_topic(dict(topic), None, {}, writer)
+    writer.close()
+
+
+def test_failed_topic_keeps_checkpoint_and_resumes(crawler, sqlite_storage, monkeypatch):
+    monkeypatch.setattr(crawler, 'STORAGE', sqlite_storage)
+    monkeypatch.setattr(crawler, 'PAGE_SIZER', crawler.PageSizer())
+    forum, topic = make_topic(35)
+    topic_id = topic['topic_id']
+
+    # 第一次: 翻了两页之后重试用完
+    post_ajax, _ = serve_posts(forum, fail_from=21)
+    monkeypatch.setattr(crawler, 'post_ajax', post_ajax)
+    crawl(crawler, topic, crawler.BulkWriter(flush_interval=0.05).start())
+
+    assert sqlite_storage.load_done_topic_ids() == set()
+    assert sqlite_storage.load_topic_state() == {}
+    checkpoints = sqlite_storage.load_checkpoints()
+    assert checkpoints == {topic_id: 21}
+
+    # 第二次运行: lister 从断点续抓，只请求剩下的页
+    lister = crawler.TopicLister(forum.category_id, sqlite_storage.load_done_topic_ids(),
+                                 checkpoints=checkpoints)
+    resumed = lister.select([topic])
+    assert [t['resume_post_num'] for t in resumed] == [21]
+
+    post_ajax, requested = serve_posts(forum)
+    monkeypatch.setattr(crawler, 'post_ajax', post_ajax)
+    crawl(crawler, resumed[0], crawler.BulkWriter(flush_interval=0.05).start())
+
+    assert requested[0] == 21
+    assert sqlite_storage.load_done_topic_ids() == {topic_id}
+    assert sqlite_storage.load_checkpoints() == {}
+    assert sqlite_storage.load_topic_state()[topic_id][1] == 35
+    title, posts = sqlite_storage.load_topic_posts(topic_id)
+    assert len(posts) == 35
+
+
+def test_worker_exception_marks_topic_failed(crawler, sqlite_storage, monkeypatch):
+    monkeypatch.setattr(crawler, 'STORAGE', sqlite_storage)
+    failed = []
+    writer = crawler.BulkWriter(flush_interval=0.05)
+    monkeypatch.setattr(writer, 'mark_failed', lambda topic_id, last_post_time=None: failed.append(topic_id))
+
+    def broken(topic, session, headers, writer):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(crawler, 'fetch_posts_for_topic', broken)
+    queue = crawler.Queue()
+    queue.put({'topic_id': 42})
+    queue.put(None)
+    crawler.fetch_posts_worker(queue, None, {}, writer)
+
+    assert failed == [42]
+    assert sqlite_storage.load_done_topic_ids() == set()
+
+
+class FlakySession:
+    """前 failures 次请求返回 500，之后返回 200"""
+
+    def __init__(self, failures):
+        self.failures = failures
+
+    def post(self, url, headers, data, timeout):
+        response = FakeResponse({'response': {}})
+        if self.failures:
+            self.failures -= 1
+            response.status_code = 500
+            response.headers = {}
+        return response
+
+
+def test_only_failures_followed_by_another_attempt_count_as_retries(crawler, monkeypatch):
+    from metrics import Metrics
+    from rate_limiter import AdaptiveRateLimiter
+
+    monkeypatch.setattr(crawler, 'MAX_RETRIES', 3)
+    monkeypatch.setattr(crawler, 'METRICS', Metrics())
+    monkeypatch.setattr(crawler, 'RATE_LIMITER', AdaptiveRateLimiter(rate=1000, max_rate=1000))
+    monkeypatch.setattr(AdaptiveRateLimiter, 'backoff', lambda self, attempt, retry_after=None: 0)
+
+    assert crawler.post_ajax(FlakySession(2), {}, {'a': 'fetch_topics'}, "") is not None
+    assert crawler.post_ajax(FlakySession(5), {}, {'a': 'fetch_topics'}, "") is None
+    counters = crawler.METRICS._counters
+    assert counters['requests_total'] == 6
+    assert counters['request_retries_total'] == 4
+    assert counters['requests_given_up_total'] == 1
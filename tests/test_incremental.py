@@ -0,0 +1,94 @@
+import fake_aops_server
+import pytest
+
+from storage import SQLiteStorage
+
+
+def failing_forum(num_topics, fail_topic_ids):
+    """fail_topic_ids 里的 topic 抓帖子时连接直接断掉 (请求异常)，清空集合后恢复正常"""
+    forum = fake_aops_server.FakeForum(num_topics=num_topics, posts_median=3, posts_sigma=0.3, quote_rate=0)
+    fetch_posts = forum.fetch_posts
+
+    def flaky(topic_id, start_post_num, num_to_fetch):
+        if topic_id in fail_topic_ids:
+            raise ConnectionResetError("forced failure")
+        return fetch_posts(topic_id, start_post_num, num_to_fetch)
+
+    forum.fetch_posts = flaky
+    return forum
+
+
+@pytest.mark.parametrize('options', [[], ['--list-windows', '3'], ['--engine', 'async']])
+def test_topic_that_failed_is_crawled_by_the_next_incremental_run(crawler, run_crawler, monkeypatch, tmp_path,
+                                                                   options):
+    monkeypatch.setattr(crawler, 'MAX_RETRIES', 1)
+    path = str(tmp_path / 'crawl.sqlite3')
+    fail = set()
+    forum = failing_forum(40, fail)
+    # 列表第二页上比较旧的 topic
+    victim = forum.topics[35]
+    fail.add(victim['topic_id'])
+
+    run_crawler(forum, '--incremental', *options, storage_path=path)
+    storage = SQLiteStorage(path)
+    assert victim['topic_id'] not in storage.load_done_topic_ids()
+    assert len(storage.load_done_topic_ids()) == 39
+    # mark 停在没抓完的 topic 之前
+    assert storage.load_high_water_mark(forum.category_id) == victim['last_post_time'] - 1
+
+    fail.clear()
+    run_crawler(forum, '--incremental', *options, storage_path=path)
+    assert victim['topic_id'] in storage.load_done_topic_ids()
+    assert storage.load_high_water_mark(forum.category_id) == forum.topics[0]['last_post_time']
+
+    # 全部抓完之后再跑一次只翻第一页，不再请求帖子
+    stats = run_crawler(forum, '--incremental', *options, storage_path=path)
+    assert stats['writer']['posts'] == 0
+    storage.close()
+
+
+def list_windows(crawler, forum, lister, oldest, count):
+    """按顺序翻完 lister 的每个时间窗口 (不发请求，直接问 FakeForum)，返回选中的 topic_id"""
+    windows = lister.windows(oldest, forum.topics[0]['last_post_time'] + 1, count)
+    selected = []
+    for window in windows:
+        while True:
+            topics = forum.fetch_topics(int(window.data['fetch_before']))['topics']
+            if not topics:
+                window.finished = True
+                break
+            selected.extend(t['topic_id'] for t in window.select(topics))
+            if not window.advance(topics):
+                break
+    lister.finished = all(w.finished for w in windows)
+    return selected
+
+
+def test_listing_windows_cover_every_topic_once(crawler):
+    forum = fake_aops_server.FakeForum(num_topics=200)
+    lister = crawler.TopicLister(forum.category_id, set())
+    # 二分查找给的最旧时间只精确到 precision，往新估了也不能漏
+    oldest = forum.topics[-1]['last_post_time'] + 3000
+    selected = list_windows(crawler, forum, lister, oldest, 8)
+    assert sorted(selected) == sorted(t['topic_id'] for t in forum.topics)
+    assert lister.finished
+    assert lister.new_high_water_mark == forum.topics[0]['last_post_time']
+
+
+def test_incremental_listing_windows_stop_at_high_water_mark(crawler):
+    forum = fake_aops_server.FakeForum(num_topics=200)
+    mark = forum.topics[50]['last_post_time']
+    old = forum.topics[50:]
+    topic_state = {t['topic_id']: (t['last_post_time'], t['num_posts']) for t in old}
+    lister = crawler.TopicLister(forum.category_id, set(topic_state), topic_state, mark, incremental=True)
+    selected = list_windows(crawler, forum, lister, mark, 4)
+    assert sorted(selected) == sorted(t['topic_id'] for t in forum.topics[:50])
+    # 最旧的窗口翻到 mark 所在的那一页就停，不会一直翻到板块最早的 topic
+    assert not lister.seen_ids & {t['topic_id'] for t in forum.topics[90:]}
+
+
+@pytest.mark.parametrize('role', ['lister', 'worker'])
+def test_role_without_lease_is_rejected(run_crawler, role):
+    # 没有租约表时 lister 的进程内队列没人消费，会卡死
+    with pytest.raises(SystemExit, match='--lease'):
+        run_crawler(fake_aops_server.FakeForum(num_topics=1), '--role', role)
@@ -0,0 +1,25 @@
+from parse_cache import ParseCache
+
+from test_storage import post_row
+
+LONG_TEXT = "[quote=bob]" + "quoted words " * 100 + "[/quote]\n" + "reply " * 200
+
+
+def test_counter_change_keeps_cached_spans(sqlite_storage, tmp_path):
+    sqlite_storage.write_batch([], [post_row(1, post_canonical=LONG_TEXT)], [], [], [])
+    cache = ParseCache(str(tmp_path / 'parse_cache.sqlite3'), min_chars=100)
+    keys = cache.keys(sqlite_storage.load_topic_posts(7)[1])
+    cache.put_many([(1, keys[1], [[["bob", [[11, 1311]]]], [[1320, 2520]]])])
+
+    # 只是感谢数变了: 爬虫会重写这一行 (post_hashes 变了)，缓存照样命中
+    assert sqlite_storage.write_batch([], [post_row(1, post_canonical=LONG_TEXT, thanks_received=3)],
+                                      [], [], []) == 0
+    rows = sqlite_storage.load_topic_posts(7)[1]
+    assert cache.get_many(cache.keys(rows)) == {1: [[["bob", [[11, 1311]]]], [[1320, 2520]]]}
+
+    # 正文改了就不命中
+    sqlite_storage.write_batch([], [post_row(1, post_canonical=LONG_TEXT + "edited")], [], [], [])
+    rows = sqlite_storage.load_topic_posts(7)[1]
+    assert cache.get_many(cache.keys(rows)) == {}
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
@@ -0,0 +1,65 @@
+import fake_aops_server
+
+
+def make_forum(num_posts, max_page_size):
+    forum = fake_aops_server.FakeForum(num_topics=1, max_page_size=max_page_size, quote_rate=0)
+    topic = forum.topics[0]
+    topic['num_posts'] = num_posts
+    return forum, topic['topic_id']
+
+
+def crawl(crawler, forum, topic_id, sizer, num_posts=None):
+    """和 fetch_posts_for_topic 一样地翻页，返回每次请求的 (start_post_num, num_to_fetch) 和抓到的帖子数"""
+    pager = crawler.PostPager(topic_id, num_posts=num_posts, sizer=sizer)
+    requests, fetched = [], 0
+    while True:
+        start, n = int(pager.data['start_post_num']), int(pager.data['num_to_fetch'])
+        requests.append((start, n))
+        posts = forum.fetch_posts(topic_id, start, n)['posts']
+        if not posts:
+            break
+        fetched += len(pager.new_posts(posts))
+        if not pager.advance(posts):
+            break
+    return requests, fetched
+
+
+def test_truncated_pages_shrink_page_size_once_confirmed(crawler):
+    forum, topic_id = make_forum(120, max_page_size=50)
+    sizer = crawler.PageSizer(100)
+    requests, fetched = crawl(crawler, forum, topic_id, sizer, num_posts=120)
+    assert fetched == 120
+    assert requests == [(1, 100), (51, 100), (101, 50)]
+    assert sizer.size == 50
+
+
+def test_stale_listing_count_does_not_shrink_page_size(crawler):
+    # 列表说 50 帖，实际删剩 45: 最后一页少给了，但不是服务器截断
+    forum, topic_id = make_forum(45, max_page_size=100)
+    sizer = crawler.PageSizer(100)
+    requests, fetched = crawl(crawler, forum, topic_id, sizer, num_posts=50)
+    assert fetched == 45
+    assert requests == [(1, 100), (46, 100)]
+    assert sizer.size == 100
+
+
+def test_last_short_page_ends_topic_without_listing_count(crawler):
+    forum, topic_id = make_forum(70, max_page_size=50)
+    sizer = crawler.PageSizer(50)
+    sizer.observe(50)
+    requests, fetched = crawl(crawler, forum, topic_id, sizer)
+    assert fetched == 70
+    assert requests == [(1, 50), (51, 50)]
+
+
+def test_page_size_grows_back_when_server_returns_more(crawler):
+    sizer = crawler.PageSizer(100, probe_interval=3)
+    sizer.limit(30)
+    assert [sizer.next_size() for _ in range(3)] == [30, 30, 100]
+
+    # 服务器的上限其实是 80
+    forum, topic_id = make_forum(400, max_page_size=80)
+    requests, fetched = crawl(crawler, forum, topic_id, sizer, num_posts=400)
+    assert fetched == 400
+    assert sizer.size == 80
+    assert requests[-1][1] == 80
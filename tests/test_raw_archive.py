@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+from raw_archive import ArchiveReader, RawArchive
+
+
+def write_archive(directory, codec, bodies):
+    archive = RawArchive(str(directory), codec=codec)
+    for page, body in enumerate(bodies, 1):
+        archive.append('posts', 7, page, body)
+    archive.close()
+    segment, = [f for f in os.listdir(directory) if f.startswith('segment_')]
+    return os.path.join(directory, segment)
+
+
+@pytest.mark.parametrize('codec', ['gzip', 'zstd'])
+@pytest.mark.parametrize('cut', [50, 100_000])
+def test_truncated_segment_replays_up_to_the_last_complete_record(tmp_path, codec, cut):
+    if codec == 'zstd':
+        pytest.importorskip('zstandard')
+    # 最后一条记录比 zstd 的一个 block 大，截掉一部分后还能解出半行
+    segment = write_archive(tmp_path, codec, ['a' * 100, 'b' * 100, os.urandom(200_000).hex()])
+    with open(segment, 'rb') as f:
+        data = f.read()
+    with open(segment, 'wb') as f:
+        f.write(data[:-cut])
+
+    assert [r['page'] for r in ArchiveReader(str(tmp_path)).iter_records()] == [1, 2]
+
+
+def test_garbage_after_last_zstd_frame_is_skipped(tmp_path):
+    pytest.importorskip('zstandard')
+    segment = write_archive(tmp_path, 'zstd', ['a' * 100, 'b' * 100])
+    with open(segment, 'ab') as f:
+        f.write(b'\x28\xb5\x2f\xfd' + b'\xff' * 20)
+
+    records = list(ArchiveReader(str(tmp_path)).iter_records())
+    assert [r['body'] for r in records] == ['a' * 100, 'b' * 100]
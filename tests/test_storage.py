@@ -0,0 +1,79 @@
+import datetime
+
+import pytest
+
+
+def post_row(post_id, topic_id=7, **overrides):
+    row = {
+        'post_id': post_id, 'topic_id': topic_id, 'author': 'alice', 'post_canonical': f"post {post_id}",
+        'post_time': datetime.datetime(2024, 1, 1, 0, 0, post_id % 60),
+        'admin': False, 'attachment': False, 'avatar': '', 'deletable': False, 'deleted': False,
+        'editable': False, 'is_forum_admin': False, 'is_nothanked': False, 'is_thanked': False,
+        'last_edit_reason': '', 'last_edit_time': 0, 'last_editor_username': '',
+        'nothanks_received': 0, 'num_edits': 0, 'num_posts': 1, 'post_format': 'bbcode',
+        'post_number': post_id, 'post_rendered': '', 'poster_id': 1, 'reported': False,
+        'show_from_end': False, 'show_from_start': False, 'thankers': None, 'thanks_received': 0,
+    }
+    row.update(overrides)
+    return row
+
+
+def test_sqlite_bad_row_is_skipped(sqlite_storage):
+    topics = [{'topic_id': 7, 'topic_title': 't', 'category_id': 1, 'category_name': 'c'}]
+    # 接口改了格式，某个字段变成对象: 这一行绑不上参数
+    posts = [post_row(1), post_row(2, thankers={'unexpected': 'object'}), post_row(3)]
+    sqlite_storage.write_batch(topics, posts, [], [(7, 4)], [(7, 1_700_000_000, 3)])
+
+    title, stored = sqlite_storage.load_topic_posts(7)
+    assert title == 't'
+    assert [p['post_id'] for p in stored] == [1, 3]
+    assert sqlite_storage.load_done_topic_ids() == {7}
+    assert sqlite_storage.load_checkpoints() == {}
+    # 坏行没有写哈希，下次还会重试；好行不再重写
+    assert sqlite_storage.write_batch([], [post_row(1), post_row(3)], [], [], []) == 2
+
+
+def test_bulk_writer_does_not_retry_a_bad_sqlite_batch_forever(crawler, sqlite_storage, monkeypatch):
+    monkeypatch.setattr(crawler, 'STORAGE', sqlite_storage)
+    writer = crawler.BulkWriter(batch_size=10, flush_interval=0.05).start()
+    writer.add_posts([post_row(1), post_row(2, avatar=['bad']), post_row(3)], (7, 4))
+    writer.mark_done(7, 1_700_000_000, 3)
+    writer.close()
+
+    assert not writer._failing
+    assert writer.stats['done'] == 1
+    assert [p['post_id'] for p in sqlite_storage.load_topic_posts(7)[1]] == [1, 3]
+
+
+def test_author_profile_changes_do_not_rewrite_posts(sqlite_storage):
+    sqlite_storage.write_batch([], [post_row(1), post_row(2), post_row(3)], [], [], [])
+    # 作者在别处发了帖、换了头像: 帖子本身没变
+    assert sqlite_storage.write_batch([], [post_row(1, num_posts=2, avatar='new.png')], [], [], []) == 1
+    # 编辑、被感谢都算帖子变了
+    assert sqlite_storage.write_batch([], [post_row(2, last_edit_time=5, num_edits=1),
+                                           post_row(3, thanks_received=1)], [], [], []) == 0
+
+
+def test_parquet_scans_post_hashes_once_per_run(tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    from storage import ParquetSink
+
+    sink = ParquetSink(str(tmp_path))
+    sink.ensure_schema()
+    sink.write_batch([], [post_row(1), post_row(2)], [], [], [])
+    scans = []
+    read = sink._read
+    monkeypatch.setattr(sink, '_read', lambda table, *args: (scans.append(table), read(table, *args))[1])
+    assert sink.write_batch([], [post_row(1), post_row(2, thanks_received=1), post_row(3)], [], [], []) == 1
+    for thanks in range(2, 5):
+        assert sink.write_batch([], [post_row(2, thanks_received=thanks), post_row(3)], [], [], []) == 1
+    assert scans == []
+
+    # 新的一次运行从目录里读出已有的哈希，只扫一次
+    sink = ParquetSink(str(tmp_path))
+    sink.ensure_schema()
+    read = sink._read
+    monkeypatch.setattr(sink, '_read', lambda table, *args: (scans.append(table), read(table, *args))[1])
+    assert sink.write_batch([], [post_row(1), post_row(2, thanks_received=4), post_row(3)], [], [], []) == 3
+    assert sink.write_batch([], [post_row(4)], [], [], []) == 0
+    assert scans == ['posts']
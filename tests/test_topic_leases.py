@@ -0,0 +1,173 @@
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from topic_leases import (CLAIM_SQL, CLAIMED_SQL, HEARTBEAT_SQL, LEASE_DONE_SQL, LEASE_FAILED_SQL,
+                          LEASE_UPSERT_SQL, LeaseQueue)
+
+
+class FakeLeaseTable:
+    """内存里的 topic_leases，按 topic_leases.py 里各条 SQL 的语义执行 (这里没有 MySQL)"""
+
+    def __init__(self):
+        self.rows = {}
+        self.checkpoints = {}
+
+    def execute(self, sql, params):
+        now = int(time.time())
+        if sql == LEASE_UPSERT_SQL:
+            topic_id, category_id, last_post_time, resume_post_num = params
+            row = self.rows.get(topic_id)
+            if row is None:
+                self.rows[topic_id] = {'category_id': category_id, 'last_post_time': last_post_time,
+                                       'resume_post_num': resume_post_num, 'status': 'pending',
+                                       'owner': None, 'lease_expires': 0}
+            else:
+                keep = row['status'] == 'done' and last_post_time <= row['last_post_time']
+                if not keep:
+                    row['resume_post_num'] = resume_post_num
+                    row['status'] = 'pending'
+                row['last_post_time'] = max(row['last_post_time'], last_post_time)
+            return []
+        if sql == CLAIM_SQL:
+            owner, lease_seconds, limit = params
+            free = [r for r in self.rows.values()
+                    if r['status'] == 'pending' and (r['owner'] is None or r['lease_expires'] < now)]
+            for r in sorted(free, key=lambda r: -r['last_post_time'])[:limit]:
+                r['owner'], r['lease_expires'] = owner, now + lease_seconds
+            return []
+        if sql == CLAIMED_SQL:
+            return [(topic_id, r['category_id'], r['last_post_time'],
+                     max(r['resume_post_num'], self.checkpoints.get(topic_id, 1)))
+                    for topic_id, r in self.rows.items()
+                    if r['owner'] == params[0] and r['status'] == 'pending']
+        if sql == HEARTBEAT_SQL:
+            lease_seconds, owner = params
+            for r in self.rows.values():
+                if r['owner'] == owner and r['status'] == 'pending':
+                    r['lease_expires'] = now + lease_seconds
+            return []
+        if sql in (LEASE_DONE_SQL, LEASE_FAILED_SQL):
+            row = self.rows[params[0]]
+            if sql == LEASE_DONE_SQL or row['status'] == 'pending':
+                row.update(status='done' if sql == LEASE_DONE_SQL else 'failed', owner=None, lease_expires=0)
+            return []
+        if "COUNT(*) FROM topic_leases WHERE status = 'pending'" in sql:
+            return [(sum(r['status'] == 'pending' for r in self.rows.values()),)]
+        raise AssertionError(f"unexpected SQL: {sql}")
+
+
+class FakeCursor:
+    def __init__(self, table):
+        self.table = table
+        self.result = []
+
+    def execute(self, sql, params=()):
+        self.result = self.table.execute(sql, params)
+
+    def fetchall(self):
+        return self.result
+
+    def fetchone(self):
+        return self.result[0]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, table):
+        self.table = table
+
+    def cursor(self):
+        return FakeCursor(self.table)
+
+    def commit(self):
+        pass
+
+
+class FakePool:
+    def __init__(self, table):
+        self.table = table
+
+    @contextmanager
+    def connection(self):
+        yield FakeConnection(self.table)
+
+
+class IdleWriter:
+    def add_leases(self, topics):
+        raise AssertionError("not used")
+
+    def idle(self):
+        return True
+
+
+@pytest.fixture
+def leases():
+    table = FakeLeaseTable()
+    queue = LeaseQueue(FakePool(table), IdleWriter(), lease_seconds=300, poll_interval=0, idle_exit=0)
+    yield table, queue
+    queue.close()
+
+
+def test_reopened_lease_is_handed_out_again(leases):
+    table, queue = leases
+    table.execute(LEASE_UPSERT_SQL, (1, 9, 100, 1))
+
+    topic, finished = queue._try_get()
+    assert topic['topic_id'] == 1 and not finished
+    # 还在抓: 再认领也不会重复发
+    assert queue._try_get() == (None, False)
+
+    # 抓完之后有了新回复，lister 把它重新打开，被同一个进程认领
+    table.execute(LEASE_DONE_SQL, (1,))
+    queue.release([1])
+    table.execute(LEASE_UPSERT_SQL, (1, 9, 200, 5))
+    table.checkpoints[1] = 7
+    topic, finished = queue._try_get()
+    assert topic == {'topic_id': 1, 'category_id': 9, 'last_post_time': 200, 'resume_post_num': 7}
+
+    table.execute(LEASE_DONE_SQL, (1,))
+    queue.release([1])
+    queue.put(None)
+    assert queue._try_get() == (None, False)    # 开始计 idle_exit
+    assert queue._try_get() == (None, True)
+    assert queue._handed == set()
+
+
+def test_bumped_lease_is_not_handed_out_while_in_flight(leases):
+    table, queue = leases
+    table.execute(LEASE_UPSERT_SQL, (1, 9, 100, 1))
+    assert queue._try_get()[0]['last_post_time'] == 100
+
+    # 还在抓的时候 lister 看到了新回复: 租约仍是 pending、仍归本进程，last_post_time 变了
+    table.execute(LEASE_UPSERT_SQL, (1, 9, 200, 1))
+    assert queue._try_get() == (None, False)
+
+    # done 还没落库之前也不发
+    table.execute(LEASE_DONE_SQL, (1,))
+    table.execute(LEASE_UPSERT_SQL, (1, 9, 300, 1))
+    assert queue._try_get() == (None, False)
+
+    queue.release([1])
+    topic, finished = queue._try_get()
+    assert topic['last_post_time'] == 300 and not finished
+
+
+def test_failed_lease_does_not_block_idle_exit(leases):
+    table, queue = leases
+    table.execute(LEASE_UPSERT_SQL, (1, 9, 100, 1))
+    table.execute(LEASE_UPSERT_SQL, (2, 9, 50, 1))
+    assert {queue._try_get()[0]['topic_id'] for _ in range(2)} == {1, 2}
+
+    table.execute(LEASE_DONE_SQL, (1,))
+    table.execute(LEASE_FAILED_SQL, (2,))
+    queue.put(None)
+    assert queue._try_get() == (None, False)
+    assert queue._try_get() == (None, True)
+
+    # 下次 lister 再放进来时从 failed 变回 pending
+    table.execute(LEASE_UPSERT_SQL, (2, 9, 50, 1))
+    assert table.rows[2]['status'] == 'pending'
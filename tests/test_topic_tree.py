@@ -0,0 +1,108 @@
+import datetime
+import json
+import random
+
+import pytest
+
+import fake_aops_server
+from tree_codec import TREE_FORMATS
+
+
+def reference_match(quoted_author, quoted_content, posts_list):
+    """原来的逐帖扫描: 第一个作者相同、正文包含引用内容的帖子; 空引用算找不到"""
+    for p in posts_list:
+        if p["author"] == quoted_author and quoted_content and quoted_content in p["post_canonical"]:
+            return p["post_number"]
+    return 0
+
+
+def fixture_topic(num_posts, seed):
+    """fake_aops_server 生成的一个 topic (作者少、引用多)，外加手写的边界情况"""
+    forum = fake_aops_server.FakeForum(num_topics=1, quote_rate=0.6, seed=seed)
+    topic = dict(forum.topics[0], num_posts=num_posts)
+    posts = [forum._post(topic, n) for n in range(1, num_posts + 1)]
+    posts_list = [{"post_number": p["post_number"], "author": f"user{p['poster_id'] % 5}",
+                   "post_canonical": p["post_canonical"]} for p in posts]
+    posts_list += [
+        {"post_number": num_posts + 1, "author": "user1", "post_canonical": "short"},
+        {"post_number": num_posts + 2, "author": "user1", "post_canonical": "a b c a b c"},
+        {"post_number": num_posts + 3, "author": "user2", "post_canonical": ""},
+    ]
+    return posts_list
+
+
+def fixture_refs(topic_tree, posts_list, seed):
+    rng = random.Random(seed)
+    refs = []
+    for p in posts_list:
+        refs.extend(topic_tree.spans_to_refs(p["post_canonical"], topic_tree.quote_spans(p["post_canonical"])[0]))
+    for _ in range(300):
+        p = rng.choice(posts_list)
+        text = p["post_canonical"]
+        # 任意位置切一段: 首尾可能是半个词，也可能跨过 "\n" 或两个词
+        start = rng.randrange(len(text) + 1)
+        content = text[start:start + rng.choice([1, 3, 10, 40, 200])]
+        author = p["author"] if rng.random() < 0.8 else rng.choice(["user0", "user3", "nobody"])
+        refs.append((author, content))
+    # 跨两个帖子的内容 (拼接时的分隔符不能让它匹配上)、分隔符本身、空引用、不存在的词
+    refs += [("user1", "short\x00a b"), ("user1", "\x00"), ("user1", ""), ("user2", ""),
+             ("user1", "b c a"), ("user1", "word1 word2 no-such-word word3")]
+    return refs
+
+
+def test_quote_index_matches_reference_scan(topic_tree):
+    for seed in range(5):
+        posts_list = fixture_topic(120, seed)
+        refs = fixture_refs(topic_tree, posts_list, seed)
+        expected = [reference_match(a, c, posts_list) for a, c in refs]
+        assert any(expected) and not all(expected)
+
+        # 事先知道全部引用 (建树时) 和完全不知道 (只走拼接串) 两种索引
+        for index in (topic_tree.QuoteIndex(posts_list, refs), topic_tree.QuoteIndex(posts_list)):
+            assert [index.match(a, c) for a, c in refs] == expected
+        assert [topic_tree.match_quoted_post(1, a, c, posts_list) for a, c in refs[:50]] == expected[:50]
+
+
+def topic_rows(num_posts, seed):
+    """STORAGE.load_topic_posts 格式的帖子"""
+    forum = fake_aops_server.FakeForum(num_topics=1, quote_rate=0.6, seed=seed)
+    topic = dict(forum.topics[0], num_posts=num_posts)
+    rows = []
+    for n in range(1, num_posts + 1):
+        p = forum._post(topic, n)
+        rows.append({"post_id": p["post_id"], "author": f"user{p['poster_id'] % 5}",
+                     "post_time": datetime.datetime.fromtimestamp(p["post_time"]),
+                     "post_canonical": p["post_canonical"]})
+    return rows
+
+
+def incremental(topic_tree, old_rows, rows, tree_format):
+    old = topic_tree.build_tree(1, "t", old_rows, tree_format=tree_format)
+    return topic_tree.update_tree(1, "t", rows, (old["posts_num"], old["tree_hash"]), old["tree_json"],
+                                  tree_format=tree_format)
+
+
+@pytest.mark.parametrize('tree_format', TREE_FORMATS)
+def test_update_tree_equals_full_rebuild(topic_tree, tree_format):
+    for seed in range(3):
+        rows = topic_rows(150, seed)
+        # 第 40 帖引用的内容直到后面的新帖子里才出现: 上次是 ->0，这次要连上
+        rows[39] = dict(rows[39], post_canonical=f"[quote=user1]later words here[/quote]\nreply")
+        rows[120] = dict(rows[120], author="user1", post_canonical="some later words here too")
+        for old_n in (1, 60, 149):
+            full = topic_tree.build_tree(1, "t", rows, tree_format=tree_format)
+            updated = incremental(topic_tree, rows[:old_n], rows, tree_format)
+            assert updated["tree_json"] == full["tree_json"]
+            assert (updated["posts_num"], updated["tree_hash"]) == (full["posts_num"], full["tree_hash"])
+        assert {"from": 40, "to": 121} in json.loads(topic_tree.build_tree(1, "t", rows)["tree_json"])["edges"]
+
+
+def test_update_tree_rebuilds_when_earlier_posts_change(topic_tree):
+    rows = topic_rows(80, 0)
+    edited = list(rows)
+    edited[10] = dict(rows[10], post_canonical="edited")
+    assert incremental(topic_tree, rows[:50], edited, 'json') == topic_tree.build_tree(1, "t", edited)
+    # 删帖
+    assert incremental(topic_tree, rows[:50], rows[:40], 'json') == topic_tree.build_tree(1, "t", rows[:40])
+    # 没有新帖子
+    assert incremental(topic_tree, rows, rows, 'json') is None
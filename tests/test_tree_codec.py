@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from tree_codec import TREE_FORMATS, encode_tree, open_tree
+
+
+def sample_tree(num_nodes=300):
+    nodes = []
+    for n in range(1, num_nodes + 1):
+        # 空 post_time、比第一帖还早的时间 (负偏移)、非 ASCII 作者名
+        post_time = "" if n % 17 == 0 else f"2024-03-{1 + n % 28:02d} {n % 24:02d}:{n % 60:02d}:{(7 * n) % 60:02d}"
+        nodes.append({"post_number": n, "post_id": 9_000_000_000 + n * 13,
+                      "author": ["alice", "bob", "数学爱好者", "émile"][n % 4], "post_time": post_time})
+    edges = [{"from": n, "to": (n * 7) % (n - 1) + 1 if n % 5 else 0} for n in range(2, num_nodes + 1)]
+    edges += [{"from": 9, "to": 3}, {"from": 9, "to": 4}]
+    return nodes, edges
+
+
+@pytest.mark.parametrize('tree_format', TREE_FORMATS)
+def test_round_trip(tree_format):
+    nodes, edges = sample_tree()
+    tree = open_tree(encode_tree(nodes, edges, tree_format))
+    assert tree.format == tree_format
+    assert tree.num_nodes == len(nodes)
+    assert tree.to_dict() == {"nodes": nodes, "edges": edges}
+    assert [tree.node(n) for n in (1, 17, 300)] == [nodes[0], nodes[16], nodes[299]]
+    assert tree.timestamps() == open_tree(encode_tree(nodes, edges, 'json')).timestamps()
+    with pytest.raises(IndexError):
+        tree.node(301)
+
+
+@pytest.mark.parametrize('tree_format', TREE_FORMATS)
+def test_round_trip_of_degenerate_trees(tree_format):
+    for nodes, edges in ([], []), ([{"post_number": 1, "post_id": 5, "author": "a", "post_time": ""}], []):
+        tree = open_tree(encode_tree(nodes, edges, tree_format))
+        assert tree.to_dict() == {"nodes": nodes, "edges": edges}
+        assert tree.timestamps() == [None] * len(nodes)
+
+
+def test_compact_formats_are_smaller_and_still_json():
+    nodes, edges = sample_tree()
+    sizes = {f: len(encode_tree(nodes, edges, f)) for f in TREE_FORMATS}
+    assert sizes['columnar-zlib'] < sizes['columnar'] < sizes['json']
+    assert json.loads(encode_tree(nodes, edges, 'columnar'))["format"] == 'columnar'
+    with pytest.raises(ValueError):
+        encode_tree(nodes, edges, 'xml')
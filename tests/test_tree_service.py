@@ -0,0 +1,46 @@
+import json
+import threading
+from urllib.request import urlopen
+
+from tree_codec import encode_tree
+from tree_service import TreeServer, TreeService
+
+
+def save_trees(storage, count):
+    rows = []
+    for topic_id in range(1, count + 1):
+        nodes = [{"post_number": n, "post_id": topic_id * 100 + n, "author": f"user{n}",
+                  "post_time": f"2024-01-01 00:00:0{n}"} for n in (1, 2, 3)]
+        edges = [{"from": 2, "to": 1}, {"from": 3, "to": 2}]
+        rows.append((topic_id, f"topic {topic_id}", 3, 3, encode_tree(nodes, edges, 'columnar')))
+    storage.save_post_trees(rows)
+
+
+def test_concurrent_requests_do_not_leak_sqlite_connections(sqlite_storage):
+    save_trees(sqlite_storage, 60)
+    opened_before = len(sqlite_storage._connections)
+    service = TreeService(sqlite_storage, readers=2)
+    server = TreeServer(service, 0).start()
+    results = {}
+
+    def fetch(topic_id):
+        with urlopen(f"{server.url}topics/{topic_id}/posts/3/ancestors") as response:
+            results[topic_id] = json.loads(response.read())
+
+    try:
+        # 每个请求都是缓存没命中，ThreadingHTTPServer 给每个请求开一个新线程
+        for _ in range(3):
+            threads = [threading.Thread(target=fetch, args=(topic_id,)) for topic_id in range(1, 61)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            service.invalidate()
+    finally:
+        server.close()
+        service.close()
+
+    assert len(results) == 60
+    assert [n["post_number"] for n in results[42]] == [2, 1]
+    assert len(sqlite_storage._connections) - opened_before <= 2
+    assert service.stats()['misses'] == 180
@@ -0,0 +1,107 @@
+import datetime
+import math
+import random
+import statistics
+from collections import Counter
+
+import pytest
+
+from tree_codec import TREE_FORMATS, encode_tree
+from tree_stats import HISTOGRAM_LIMIT, TOPIC_COLUMNS, CorpusSummary, iter_batches, topic_metrics
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def random_tree(rng, num_nodes):
+    start = datetime.datetime(2024, 1, 1) + datetime.timedelta(seconds=rng.randrange(10 ** 7))
+    nodes = []
+    for n in range(1, num_nodes + 1):
+        t = start + datetime.timedelta(seconds=rng.randrange(10 ** 5))
+        nodes.append({"post_number": n, "post_id": n, "author": "a",
+                      "post_time": "" if rng.random() < 0.1 else t.strftime("%Y-%m-%d %H:%M:%S")})
+    edges = []
+    for n in range(2, num_nodes + 1):
+        for _ in range(rng.choice([0, 1, 1, 1, 2, 3])):
+            # 引更早的帖子、引后面的帖子 (增量建树补上的)、lost
+            edges.append({"from": n, "to": rng.choice([n - 1, rng.randint(1, n - 1), rng.randint(1, num_nodes), 0])})
+    if num_nodes and rng.random() < 0.3:
+        # 越界的边统计时忽略
+        edges.append({"from": num_nodes + 1, "to": 1})
+        edges.append({"from": 1, "to": num_nodes + 5})
+    rng.shuffle(edges)
+    return nodes, edges
+
+
+def reference_metrics(nodes, edges):
+    """按 tree_stats.py 开头的约定逐个节点算一遍"""
+    n = len(nodes)
+    times = [(datetime.datetime.fromisoformat(p["post_time"]) - EPOCH).total_seconds() if p["post_time"] else None
+             for p in nodes]
+    valid = [(e["from"], e["to"]) for e in edges if 1 <= e["from"] <= n and 0 <= e["to"] <= n]
+    kept = [(f, t) for f, t in valid if t]
+    parent = {}
+    for f, t in kept:
+        if t < f and f not in parent:
+            parent[f] = t
+    depth = {}
+    for v in range(1, n + 1):
+        depth[v] = depth[parent[v]] + 1 if v in parent else 0
+    children = Counter(t for _, t in kept)
+    reply = [times[f - 1] - times[t - 1] for f, t in kept if times[f - 1] is not None and times[t - 1] is not None]
+    timed = [t for t in times if t is not None]
+    lost = len(valid) - len(kept)
+    parents = [c for c in children.values() if c]
+    row = {
+        'posts': n, 'edges': len(kept), 'lost_edges': lost,
+        'lost_share': lost / len(valid) if valid else math.nan,
+        'max_depth': max(depth.values(), default=0),
+        'mean_depth': sum(depth.values()) / n if n else math.nan,
+        'max_children': max(children.values(), default=0),
+        'mean_children': sum(parents) / len(parents) if parents else math.nan,
+        'reply_seconds_median': statistics.median(reply) if reply else math.nan,
+        'reply_seconds_mean': sum(reply) / len(reply) if reply else math.nan,
+        'first_post_time': min(timed) if timed else math.nan,
+        'duration_seconds': max(timed) - min(timed) if timed else math.nan,
+    }
+    return row, list(depth.values()), [children.get(v, 0) for v in range(1, n + 1)], reply
+
+
+@pytest.mark.parametrize('tree_format', TREE_FORMATS)
+def test_topic_metrics_match_reference(tree_format):
+    rng = random.Random(7)
+    trees = {}
+    for topic_id in range(1, 41):
+        trees[topic_id] = random_tree(rng, rng.choice([0, 1, 2, rng.randint(3, 80)]))
+    # 一条 n -> n-1 的长链 (指针倍增的深度)
+    trees[41] = ([{"post_number": i, "post_id": i, "author": "a", "post_time": ""} for i in range(1, 3001)],
+                 [{"from": i, "to": i - 1} for i in range(2, 3001)])
+    stored = [(topic_id, encode_tree(nodes, edges, tree_format)) for topic_id, (nodes, edges) in trees.items()]
+
+    summary = CorpusSummary()
+    rows = {}
+    for batch in iter_batches(stored, 7):
+        columns = topic_metrics(batch, summary)
+        for i, topic_id in enumerate(columns['topic_id'].tolist()):
+            rows[topic_id] = {name: columns[name][i].item() for name, _ in TOPIC_COLUMNS}
+
+    all_depths, all_children, all_reply = Counter(), Counter(), []
+    for topic_id, (nodes, edges) in trees.items():
+        expected, depths, children, reply = reference_metrics(nodes, edges)
+        for name, value in expected.items():
+            assert rows[topic_id][name] == pytest.approx(value, nan_ok=True), (topic_id, name)
+        all_depths.update(depths)
+        all_children.update(children)
+        all_reply.extend(reply)
+    assert rows[41]['max_depth'] == 2999
+
+    result = summary.result()
+    assert result['topics'] == len(trees)
+    assert result['posts'] == sum(len(nodes) for nodes, _ in trees.values())
+    assert result['edges'] == sum(r['edges'] for r in rows.values())
+    assert result['lost_edges'] == sum(r['lost_edges'] for r in rows.values())
+    assert result['depth']['max'] == max(all_depths)
+    assert result['depth']['histogram'] == [all_depths[k] for k in range(HISTOGRAM_LIMIT)]
+    assert result['depth']['over_limit'] == sum(c for k, c in all_depths.items() if k >= HISTOGRAM_LIMIT)
+    assert result['children']['histogram'] == [all_children[k] for k in range(max(all_children) + 1)]
+    assert result['reply_seconds']['count'] == len(all_reply)
+    assert result['reply_seconds']['mean'] == pytest.approx(statistics.fmean(all_reply), abs=0.1)
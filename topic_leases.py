@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+
+# ============ 基于 MySQL 租约表的分布式 topic 队列 ============
+# 多个爬虫进程（同一台或多台机器）连同一个库，用 topic_leases 表代替进程内的 Queue:
+#   - lister 把需要抓的 topic 写进表 (status='pending')
+#   - worker 用一条 UPDATE ... LIMIT 原子地认领一批 (owner + lease_expires)
+#   - 心跳线程定期给自己持有的租约续期；进程挂了租约过期，别的进程会重新认领，
+#     并从 topic_checkpoints 的断点继续，不丢也基本不重复
+#   - topic 抓完时 BulkWriter 在写 progress 的同一个事务里把它置为 'done'；
+#     重试用完没抓完的置为 'failed'，这次运行不再认领，下次 lister 再放进来时
+#     重新变成 'pending'，从 topic_checkpoints 的断点继续
+# 时间一律用数据库的 UNIX_TIMESTAMP()，避免多台机器时钟不一致。
+
+LEASES_DDL = """
+    CREATE TABLE IF NOT EXISTS topic_leases (
+        topic_id BIGINT PRIMARY KEY,
+        category_id BIGINT,
+        last_post_time BIGINT NOT NULL DEFAULT 0,
+        resume_post_num INT NOT NULL DEFAULT 1,
+        status VARCHAR(16) NOT NULL DEFAULT 'pending',
+        owner VARCHAR(128) NULL,
+        lease_expires BIGINT NOT NULL DEFAULT 0,
+        KEY idx_status_expires (status, lease_expires)
+    )
+"""
+
+# 已经 done 的 topic 只有 last_post_time 变新了才重新打开，
+# 避免别的进程刚抓完、这边的 lister 又把它放回来
+LEASE_UPSERT_SQL = """
+    INSERT INTO topic_leases(topic_id, category_id, last_post_time, resume_post_num, status)
+    VALUES (%s, %s, %s, %s, 'pending')
+    ON DUPLICATE KEY UPDATE
+      resume_post_num = IF(status = 'done' AND VALUES(last_post_time) <= last_post_time,
+                           resume_post_num, VALUES(resume_post_num)),
+      status = IF(status = 'done' AND VALUES(last_post_time) <= last_post_time, 'done', 'pending'),
+      last_post_time = GREATEST(last_post_time, VALUES(last_post_time))
+"""
+
+LEASE_DONE_SQL = """
+    UPDATE topic_leases SET status = 'done', owner = NULL, lease_expires = 0
+    WHERE topic_id = %s
+"""
+
+LEASE_FAILED_SQL = """
+    UPDATE topic_leases SET status = 'failed', owner = NULL, lease_expires = 0
+    WHERE topic_id = %s AND status = 'pending'
+"""
+
+CLAIM_SQL = """
+    UPDATE topic_leases
+    SET owner = %s, lease_expires = UNIX_TIMESTAMP() + %s
+    WHERE status = 'pending' AND (owner IS NULL OR lease_expires < UNIX_TIMESTAMP())
+    ORDER BY last_post_time DESC
+    LIMIT %s
+"""
+
+CLAIMED_SQL = """
+    SELECT l.topic_id, l.category_id, l.last_post_time,
+           GREATEST(l.resume_post_num, COALESCE(c.start_post_num, 1))
+    FROM topic_leases l
+    LEFT JOIN topic_checkpoints c ON c.topic_id = l.topic_id
+    WHERE l.owner = %s AND l.status = 'pending'
+"""
+
+HEARTBEAT_SQL = """
+    UPDATE topic_leases SET lease_expires = UNIX_TIMESTAMP() + %s
+    WHERE owner = %s AND status = 'pending'
+"""
+
+
+def lease_params(topic):
+    return (
+        topic['topic_id'], topic.get('category_id'),
+        int(topic.get('last_post_time') or 0), topic.get('resume_post_num', 1)
+    )
+
+
+class LeaseQueue:
+    """
+    和 queue.Queue 一样的 put/get/task_done 接口，fetch_posts_worker 不用改。
+
+    put(topic): 交给 writer 批量写进 topic_leases（不阻塞）
+    put(None):  本进程的 lister 结束了
+    get():      认领一个 topic；本进程 lister 结束、表里已没有 pending 的 topic
+                并且持续 idle_exit 秒后返回 None
+    """
+
+    def __init__(self, pool, writer, lease_seconds=300, claim_batch=10,
+                 poll_interval=5.0, idle_exit=60.0):
+        self.pool = pool
+        self.writer = writer
+        self.lease_seconds = lease_seconds
+        self.claim_batch = claim_batch
+        self.poll_interval = poll_interval
+        self.idle_exit = idle_exit
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._buffer = []
+        # 已经交给本进程 worker、done / failed 还没落库的 topic_id。
+        # 抓的过程中 lister 更新了 last_post_time 也不再发第二次，release() 之后才能再发
+        self._handed = set()
+        self._handed_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._listing_done = False
+        self._idle_since = None
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="lease-heartbeat",
+                                           daemon=True)
+        self._heartbeat.start()
+
+    # ---------- lister 端 ----------
+
+    def put(self, topic):
+        if topic is None:
+            self._listing_done = True
+            return
+        self.writer.add_leases([topic])
+
+    # ---------- worker 端 ----------
+
+    def _claim(self):
+        """认领一批 topic 放进本地缓冲，返回认领到的数量"""
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(CLAIM_SQL, (self.owner, self.lease_seconds, self.claim_batch))
+            conn.commit()
+            cur.execute(CLAIMED_SQL, (self.owner,))
+            rows = cur.fetchall()
+            cur.close()
+        # CLAIMED_SQL 返回的是本进程持有的所有 pending 租约，包括 worker 还在抓的，这些不能再发一次。
+        # 抓完 (或放弃) 并落库后又被重新打开、重新认领的，release() 已经把它从 _handed 去掉，照常发
+        claimed = 0
+        for topic_id, category_id, last_post_time, resume_post_num in rows:
+            with self._handed_lock:
+                if topic_id in self._handed:
+                    continue
+                self._handed.add(topic_id)
+            self._buffer.append({
+                'topic_id': topic_id,
+                'category_id': category_id,
+                'last_post_time': last_post_time,
+                'resume_post_num': resume_post_num,
+            })
+            claimed += 1
+        if claimed:
+            logging.info(f"[{self.owner}] 认领了 {claimed} 个topic")
+        return claimed
+
+    def release(self, topic_ids):
+        """BulkWriter 把这些 topic 的 done / failed 提交之后调用 (on_settled)"""
+        with self._handed_lock:
+            self._handed.difference_update(topic_ids)
+
+    def _pending_count(self):
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT COUNT(*) FROM topic_leases WHERE status = 'pending'")
+            count = cur.fetchone()[0]
+            cur.close()
+        return count
+
+    def _try_get(self):
+        """
+        不阻塞地取一个 topic。返回 (topic, finished)：
+        topic 为 None 且 finished 为 False 表示现在没有，过一会儿再来。
+        """
+        with self._lock:
+            if self._buffer:
+                return self._buffer.pop(0), False
+            try:
+                if self._claim():
+                    self._idle_since = None
+                    return self._buffer.pop(0), False
+                if self._listing_done and self.writer.idle() and self._pending_count() == 0:
+                    # 别的进程的 lister 可能还在跑，再等 idle_exit 秒确认
+                    if self._idle_since is None:
+                        self._idle_since = time.monotonic()
+                    elif time.monotonic() - self._idle_since >= self.idle_exit:
+                        return None, True
+                else:
+                    self._idle_since = None
+            except Exception as e:
+                logging.error(f"[{self.owner}] 认领 topic 失败: {e}")
+            return None, False
+
+    def get(self):
+        while True:
+            topic, finished = self._try_get()
+            if topic is not None or finished:
+                return topic
+            time.sleep(self.poll_interval)
+
+    def task_done(self):
+        pass
+
+    # ---------- 心跳 ----------
+
+    def _heartbeat_loop(self):
+        interval = max(1.0, self.lease_seconds / 3)
+        while not self._stop.wait(interval):
+            try:
+                with self.pool.connection() as conn:
+                    cur = conn.cursor()
+                    cur.execute(HEARTBEAT_SQL, (self.lease_seconds, self.owner))
+                    conn.commit()
+                    cur.close()
+            except Exception as e:
+                logging.error(f"[{self.owner}] 租约续期失败: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._heartbeat.join()
+
+
+class AsyncLeaseQueue:
+    """
+    LeaseQueue 给 asyncio 引擎用的包装：接口同 asyncio.Queue。
+    认领走 asyncio.to_thread，并用一个 asyncio.Lock 保证同一时间只有一个认领请求在飞，
+    几百个协程 worker 也只占一个线程。
+    """
+
+    def __init__(self, lease_queue):
+        self.lease_queue = lease_queue
+        self._lock = asyncio.Lock()
+
+    async def put(self, topic):
+        self.lease_queue.put(topic)
+
+    async def get(self):
+        while True:
+            async with self._lock:
+                topic, finished = await asyncio.to_thread(self.lease_queue._try_get)
+            if topic is not None or finished:
+                return topic
+            await asyncio.sleep(self.lease_queue.poll_interval)
+
+    def task_done(self):
+        pass
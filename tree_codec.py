@@ -0,0 +1,213 @@
+import base64
+import json
+import sys
+import zlib
+from array import array
+from datetime import datetime, timedelta
+
+# post_time 是爬虫按 UTC 转出来的不带时区的时间
+EPOCH = datetime(1970, 1, 1)
+
+
+# ============ post_trees.tree_json 的编码 ============
+# 默认格式 (json) 和原来一样，每个节点一个 dict、每条边一个 {"from", "to"}:
+#   {"nodes": [{"post_number", "post_id", "author", "post_time"}, ...], "edges": [{"from", "to"}, ...]}
+# 大 topic 里键名重复几千遍，tree_json 很大，json.dumps / json.loads 也慢。
+# 紧凑格式按列存 (--tree-format columnar)，仍然是合法 JSON，带 "format" 字段区分:
+#   {"format": "columnar", "n": N,
+#    "post_id":   [...],                   第 i 个是 post_number=i+1 的帖子 (post_number 就是 1..N，不存)
+#    "authors":   ["alice", "bob", ...],   作者字典
+#    "author":    [0, 1, 0, ...],          每个节点的作者在字典里的下标
+#    "time_base": "2020-01-01 08:00:00",   第一个非空的 post_time
+#    "post_time": [0, 35, null, ...],      相对 time_base 的秒数，原来是空串的存 null
+#    "edges":     "<base64>"}              [from, to, from, to, ...] 打包成小端 int32
+# columnar-zlib 是把上面的对象 (edges 换成普通整数列表，压缩率更高) zlib 压缩后 base64:
+#   {"format": "columnar-zlib", "data": "<base64>"}
+# 读的一方不用管是哪种格式，open_tree(tree_json) 返回的 TreeReader 按需解码:
+# 只要边时不会生成节点 dict，只看一个节点时也只生成这一个。
+
+TREE_FORMATS = ['json', 'columnar', 'columnar-zlib']
+
+
+def _pack_edges(edges):
+    return array('i', [v for e in edges for v in (e["from"], e["to"])])
+
+
+def _edges_to_bytes(flat):
+    if sys.byteorder != 'little':
+        flat = array('i', flat)
+        flat.byteswap()
+    return flat.tobytes()
+
+
+def _edges_from_bytes(raw):
+    flat = array('i')
+    flat.frombytes(raw)
+    if sys.byteorder != 'little':
+        flat.byteswap()
+    return flat
+
+
+def _columns(nodes, edges, pack_edges):
+    authors = {}
+    author_index = []
+    times = []
+    time_base = None
+    base = None
+    for node in nodes:
+        author_index.append(authors.setdefault(node["author"], len(authors)))
+        post_time = node["post_time"]
+        if not post_time:
+            times.append(None)
+            continue
+        t = datetime.fromisoformat(post_time)
+        if base is None:
+            time_base, base = post_time, t
+        times.append(int((t - base).total_seconds()))
+    flat = _pack_edges(edges)
+    return {
+        "format": "columnar",
+        "n": len(nodes),
+        "post_id": [node["post_id"] for node in nodes],
+        "authors": list(authors),
+        "author": author_index,
+        "time_base": time_base,
+        "post_time": times,
+        "edges": base64.b64encode(_edges_to_bytes(flat)).decode('ascii') if pack_edges else flat.tolist(),
+    }
+
+
+def encode_tree(nodes, edges, tree_format='json'):
+    """
+    nodes: [{"post_number", "post_id", "author", "post_time"}, ...] (post_number 依次是 1..N)
+    edges: [{"from", "to"}, ...]
+    返回写进 post_trees.tree_json 的字符串
+    """
+    if tree_format == 'json':
+        return json.dumps({"nodes": nodes, "edges": edges}, ensure_ascii=False)
+    if tree_format == 'columnar':
+        return json.dumps(_columns(nodes, edges, True), ensure_ascii=False, separators=(',', ':'))
+    if tree_format == 'columnar-zlib':
+        raw = json.dumps(_columns(nodes, edges, False), ensure_ascii=False, separators=(',', ':'))
+        data = base64.b64encode(zlib.compress(raw.encode('utf-8'), 6)).decode('ascii')
+        return json.dumps({"format": "columnar-zlib", "data": data}, separators=(',', ':'))
+    raise ValueError(f"未知的 tree_json 格式: {tree_format}")
+
+
+def open_tree(tree_json):
+    return TreeReader(tree_json)
+
+
+class TreeReader:
+    """
+    三种格式的 tree_json 统一的只读视图:
+        tree.num_nodes           节点数 (post_number 是 1..num_nodes)
+        tree.edges()             [(from, to), ...]
+        tree.edge_array()        [from, to, from, to, ...] (array('i'))
+        tree.node(post_number)   一个节点的 dict
+        tree.nodes()             所有节点的 dict
+        tree.post_ids() / tree.node_authors() / tree.post_times()
+                                 只要某一列时用，按 post_number 顺序
+        tree.timestamps()        post_time 换成 Unix 秒数 (空的是 None)，统计用
+        tree.to_dict()           原来的 {"nodes": [...], "edges": [{"from", "to"}, ...]}
+    """
+
+    def __init__(self, tree_json):
+        data = json.loads(tree_json)
+        self.format = data.get("format", "json")
+        if self.format == "columnar-zlib":
+            data = json.loads(zlib.decompress(base64.b64decode(data["data"])))
+        elif self.format not in TREE_FORMATS:
+            raise ValueError(f"未知的 tree_json 格式: {self.format}")
+        self._data = data
+        self._edge_array = None
+        self._time_base = None
+        if self.format == "json":
+            self.num_nodes = len(data["nodes"])
+        else:
+            self.num_nodes = data["n"]
+
+    def edge_array(self):
+        if self._edge_array is None:
+            edges = self._data["edges"]
+            if self.format == "json":
+                flat = _pack_edges(edges)
+            elif isinstance(edges, str):
+                flat = _edges_from_bytes(base64.b64decode(edges))
+            else:
+                flat = array('i', edges)
+            self._edge_array = flat
+        return self._edge_array
+
+    def edges(self):
+        flat = self.edge_array()
+        return list(zip(flat[0::2], flat[1::2]))
+
+    def node(self, post_number):
+        if not 1 <= post_number <= self.num_nodes:
+            raise IndexError(f"post_number 超出范围: {post_number}")
+        if self.format == "json":
+            return self._data["nodes"][post_number - 1]
+        return self._column_node(post_number - 1)
+
+    def nodes(self):
+        if self.format == "json":
+            return list(self._data["nodes"])
+        return [{"post_number": i + 1, "post_id": post_id, "author": author, "post_time": post_time}
+                for i, (post_id, author, post_time)
+                in enumerate(zip(self.post_ids(), self.node_authors(), self.post_times()))]
+
+    def post_ids(self):
+        if self.format == "json":
+            return [node["post_id"] for node in self._data["nodes"]]
+        return self._data["post_id"]
+
+    def node_authors(self):
+        if self.format == "json":
+            return [node["author"] for node in self._data["nodes"]]
+        authors = self._data["authors"]
+        return [authors[a] for a in self._data["author"]]
+
+    def post_times(self):
+        if self.format == "json":
+            return [node["post_time"] for node in self._data["nodes"]]
+        # 同一秒的帖子只格式化一次
+        formatted = {None: ""}
+        times = []
+        for offset in self._data["post_time"]:
+            s = formatted.get(offset)
+            if s is None:
+                s = formatted[offset] = self._format_time(offset)
+            times.append(s)
+        return times
+
+    def timestamps(self):
+        if self.format == "json":
+            return [int((datetime.fromisoformat(t) - EPOCH).total_seconds()) if t else None
+                    for t in self.post_times()]
+        if self._data["time_base"] is None:
+            return [None] * self.num_nodes
+        base = int((datetime.fromisoformat(self._data["time_base"]) - EPOCH).total_seconds())
+        return [None if offset is None else base + offset for offset in self._data["post_time"]]
+
+    def _format_time(self, offset):
+        if self._time_base is None:
+            self._time_base = datetime.fromisoformat(self._data["time_base"])
+        # post_time 只到秒，isoformat(' ') 和原来的 strftime("%Y-%m-%d %H:%M:%S") 一样，快不少
+        return (self._time_base + timedelta(seconds=offset)).isoformat(' ')
+
+    def _column_node(self, i):
+        data = self._data
+        offset = data["post_time"][i]
+        return {
+            "post_number": i + 1,
+            "post_id": data["post_id"][i],
+            "author": data["authors"][data["author"][i]],
+            "post_time": "" if offset is None else self._format_time(offset),
+        }
+
+    def to_dict(self):
+        return {
+            "nodes": self.nodes(),
+            "edges": [{"from": f, "to": t} for f, t in self.edges()],
+        }
@@ -0,0 +1,348 @@
+import argparse
+import json
+import logging
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from db_config import DB_CONFIG
+from db_pool import ConnectionPool
+from storage import STORAGE_BACKENDS, MySQLStorage, open_storage
+from tree_codec import open_tree
+
+
+# ============ post_trees 的本地查询服务 ============
+# 看板 / 分析脚本要某个 topic 的引用结构时不用每次查库再 json.loads 整个 tree_json:
+#   - TreeService: Python 接口，解码好的树放在按 tree_json 长度计的 LRU 里，
+#     邻接表第一次查祖先 / 后代时才建；作者 -> (topic_id, post_number) 的索引扫一遍 post_trees 建好
+#   - TreeServer:  可选的只读 HTTP 端点 (默认只监听本机)，返回 JSON:
+#       GET /topics/<topic_id>/tree
+#       GET /topics/<topic_id>/posts/<post_number>/ancestors     这帖直接或间接引用的帖子
+#       GET /topics/<topic_id>/posts/<post_number>/descendants   直接或间接引用了这帖的帖子
+#       GET /authors/<author>/posts
+#       GET /authors/<author>/edges?direction=out|in|both&limit=N
+#
+#   python tree_service.py --storage sqlite --storage-path aops.sqlite3 --port 8765 --author-index
+#
+# 树在库里被 02_topic_tree.py / 爬虫 --build-trees 更新之后，缓存里的旧树要 invalidate 掉
+# (或者重启服务)；作者索引同理，重新 build_author_index。
+
+# 缓存没命中时才读库，只在 TreeService 的 4 个读线程里读
+DB_POOL = ConnectionPool(DB_CONFIG, size=4)
+
+STORAGE = MySQLStorage(DB_POOL)
+
+
+class TopicTree:
+    """缓存里的一棵树: TreeReader 加上按需建的邻接表 (post_number 从 1 开始，0 是 lost)"""
+
+    def __init__(self, topic_id, tree_json):
+        self.topic_id = topic_id
+        self.reader = open_tree(tree_json)
+        self.size = len(tree_json)
+        self._out = None
+        self._in = None
+        self._lock = threading.Lock()
+
+    @property
+    def num_nodes(self):
+        return self.reader.num_nodes
+
+    def _adjacency(self):
+        with self._lock:
+            if self._out is None:
+                n = self.reader.num_nodes
+                out = [[] for _ in range(n + 1)]
+                into = [[] for _ in range(n + 1)]
+                flat = self.reader.edge_array()
+                for f, t in zip(flat[0::2], flat[1::2]):
+                    if 1 <= f <= n and 0 <= t <= n:
+                        out[f].append(t)
+                        if t:
+                            into[t].append(f)
+                self._out, self._in = out, into
+        return self._out, self._in
+
+    def _check(self, post_number):
+        if not 1 <= post_number <= self.reader.num_nodes:
+            raise KeyError(f"topic_id={self.topic_id} 没有第 {post_number} 帖")
+
+    def _walk(self, post_number, edges):
+        """从 post_number 出发按 edges 广度优先，返回节点 dict (多一个 distance: 隔了几条边)"""
+        self._check(post_number)
+        distance = {post_number: 0}
+        order = []
+        queue = deque([post_number])
+        while queue:
+            v = queue.popleft()
+            for w in edges[v]:
+                if w and w not in distance:
+                    distance[w] = distance[v] + 1
+                    order.append(w)
+                    queue.append(w)
+        return [dict(self.reader.node(w), distance=distance[w]) for w in order]
+
+    def ancestors(self, post_number):
+        return self._walk(post_number, self._adjacency()[0])
+
+    def descendants(self, post_number):
+        return self._walk(post_number, self._adjacency()[1])
+
+    def edges_from(self, post_number):
+        """post_number 的所有出边 (引用)，to=0 的是没匹配上的引用"""
+        self._check(post_number)
+        return [(post_number, t) for t in self._adjacency()[0][post_number]]
+
+    def edges_to(self, post_number):
+        self._check(post_number)
+        return [(f, post_number) for f in self._adjacency()[1][post_number]]
+
+
+class TreeService:
+    """
+    线程安全。max_bytes 按缓存里各棵树 tree_json 的长度之和算，超出时淘汰最久没用的树。
+        service.tree(topic_id)                      TopicTree，没有这个 topic 返回 None
+        service.tree_dict(topic_id)                 原来的 {"nodes", "edges"}
+        service.ancestors / descendants(topic_id, post_number)
+        service.build_author_index()                扫一遍 post_trees 建作者索引
+        service.author_posts(author)                [(topic_id, post_number), ...]
+        service.author_edges(author, direction)     这个作者的帖子引用别人 (out) / 被引用 (in) 的边
+        service.close()
+
+    缓存没命中时的读库都交给 readers 个固定的线程: TreeServer 每个请求一个新线程，
+    SQLiteStorage 每个线程一条连接、到 close() 才关，直接在请求线程里读的话
+    连接数 (和文件句柄) 跟着请求数一直涨。
+    """
+
+    def __init__(self, storage, max_bytes=256 * 1024 * 1024, readers=4):
+        self.storage = storage
+        self.max_bytes = max_bytes
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="tree-reader")
+        self._cache = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._authors = None
+        self._index_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def tree(self, topic_id):
+        with self._lock:
+            cached = self._cache.get(topic_id)
+            if cached is not None:
+                self._cache.move_to_end(topic_id)
+                self.hits += 1
+                return cached
+            self.misses += 1
+        # 读库和解码不持锁，同一个 topic 并发没命中时最多重复读一次
+        tree_json = self._readers.submit(self.storage.load_post_tree, topic_id).result()
+        if tree_json is None:
+            return None
+        tree = TopicTree(topic_id, tree_json)
+        with self._lock:
+            if topic_id not in self._cache:
+                self._cache[topic_id] = tree
+                self._bytes += tree.size
+                # 单棵超过 max_bytes 的树也留着，不然每次都要重新读
+                while self._bytes > self.max_bytes and len(self._cache) > 1:
+                    _, old = self._cache.popitem(last=False)
+                    self._bytes -= old.size
+            return self._cache[topic_id]
+
+    def invalidate(self, topic_id=None):
+        """topic_id 为 None 时清空整个缓存"""
+        with self._lock:
+            if topic_id is None:
+                self._cache.clear()
+                self._bytes = 0
+            else:
+                old = self._cache.pop(topic_id, None)
+                if old is not None:
+                    self._bytes -= old.size
+
+    def _require(self, topic_id):
+        tree = self.tree(topic_id)
+        if tree is None:
+            raise KeyError(f"post_trees 里没有 topic_id={topic_id}")
+        return tree
+
+    def tree_dict(self, topic_id):
+        tree = self.tree(topic_id)
+        return tree.reader.to_dict() if tree is not None else None
+
+    def ancestors(self, topic_id, post_number):
+        return self._require(topic_id).ancestors(post_number)
+
+    def descendants(self, topic_id, post_number):
+        return self._require(topic_id).descendants(post_number)
+
+    def build_author_index(self, topic_ids=None):
+        """
+        作者 -> 这个作者的所有帖子 (topic_id, post_number)。每个作者两个紧凑数组，
+        不为每帖建 tuple；扫描时只解码作者一列，不生成节点 dict。返回作者数。
+        """
+        start = time.time()
+        index = {}
+        for topic_id, tree_json in self.storage.iter_post_trees(topic_ids):
+            for post_number, author in enumerate(open_tree(tree_json).node_authors(), 1):
+                posts = index.get(author)
+                if posts is None:
+                    posts = index[author] = (array('q'), array('i'))
+                posts[0].append(topic_id)
+                posts[1].append(post_number)
+        self._authors = index
+        logging.info(f"作者索引: {len(index)} 个作者, 用时 {time.time() - start:.1f} 秒")
+        return len(index)
+
+    def author_posts(self, author):
+        if self._authors is None:
+            with self._index_lock:
+                if self._authors is None:
+                    self.build_author_index()
+        posts = self._authors.get(author)
+        return list(zip(*posts)) if posts else []
+
+    def author_edges(self, author, direction='out', limit=None):
+        """
+        direction: out = 这个作者的帖子引用了谁 (含 to=0 没匹配上的引用); in = 谁引用了这个作者的帖子; both
+        返回 [{"topic_id", "from", "to", "from_author", "to_author"}, ...]，按 topic 和帖子顺序
+        """
+        if direction not in ('out', 'in', 'both'):
+            raise ValueError(f"direction 只能是 out / in / both: {direction}")
+        edges = []
+        for topic_id, post_number in self.author_posts(author):
+            tree = self.tree(topic_id)
+            if tree is None or post_number > tree.num_nodes:
+                continue   # 索引建好之后树被删掉 / 重建了
+            found = []
+            if direction in ('out', 'both'):
+                found += tree.edges_from(post_number)
+            if direction in ('in', 'both'):
+                found += tree.edges_to(post_number)
+            for f, t in found:
+                edges.append({
+                    "topic_id": topic_id,
+                    "from": f,
+                    "to": t,
+                    "from_author": tree.reader.node(f)["author"],
+                    "to_author": tree.reader.node(t)["author"] if t else None,
+                })
+                if limit is not None and len(edges) >= limit:
+                    return edges
+        return edges
+
+    def close(self):
+        self._readers.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            return {'cached_trees': len(self._cache), 'cached_bytes': self._bytes,
+                    'hits': self.hits, 'misses': self.misses,
+                    'authors': len(self._authors) if self._authors is not None else None}
+
+
+class TreeServer:
+    """在后台线程里起一个只读的 HTTP 端点，默认只监听本机 (和 metrics.MetricsServer 一样)"""
+
+    def __init__(self, service, port, host='127.0.0.1'):
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                parts = [unquote(p) for p in url.path.strip('/').split('/')]
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                try:
+                    status, body = 200, route(parts, query)
+                except KeyError as e:
+                    status, body = 404, {'error': e.args[0] if e.args else 'not found'}
+                except ValueError as e:
+                    status, body = 400, {'error': str(e)}
+                except Exception as e:
+                    logging.error(f"树查询 {self.path} 失败: {e}")
+                    status, body = 500, {'error': str(e)}
+                data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        def route(parts, query):
+            if parts == ['stats']:
+                return service.stats()
+            if len(parts) == 3 and parts[0] == 'topics' and parts[2] == 'tree':
+                topic_id = int(parts[1])
+                tree = service.tree_dict(topic_id)
+                if tree is None:
+                    raise KeyError(f"post_trees 里没有 topic_id={topic_id}")
+                return {'topic_id': topic_id, **tree}
+            if len(parts) == 5 and parts[0] == 'topics' and parts[2] == 'posts':
+                topic_id, post_number = int(parts[1]), int(parts[3])
+                if parts[4] == 'ancestors':
+                    return service.ancestors(topic_id, post_number)
+                if parts[4] == 'descendants':
+                    return service.descendants(topic_id, post_number)
+            if len(parts) == 3 and parts[0] == 'authors':
+                if parts[2] == 'posts':
+                    return [{'topic_id': t, 'post_number': n} for t, n in service.author_posts(parts[1])]
+                if parts[2] == 'edges':
+                    limit = int(query['limit']) if 'limit' in query else None
+                    return service.author_edges(parts[1], query.get('direction', 'out'), limit)
+            raise KeyError(f"没有这个接口: /{'/'.join(parts)}")
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://{host}:{self._server.server_address[1]}/"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="tree-http", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        logging.info(f"树查询端点: {self.url}")
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main(argv=None):
+    global STORAGE
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    parser = argparse.ArgumentParser(description="post_trees 的只读查询服务")
+    parser.add_argument('--storage', choices=STORAGE_BACKENDS, default='mysql')
+    parser.add_argument('--storage-path', metavar='PATH',
+                        help="sqlite 的数据库文件 / parquet 的目录 (与 01_crawler.py 相同)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--cache-mb', type=int, default=256,
+                        help="解码好的树最多缓存多少 (按 tree_json 的长度算)，超过后淘汰最久没用的")
+    parser.add_argument('--author-index', action='store_true',
+                        help="启动时就扫一遍 post_trees 建作者索引 (否则第一次按作者查询时再建)")
+    args = parser.parse_args(argv)
+
+    STORAGE = open_storage(args.storage, args.storage_path, DB_POOL)
+    service = TreeService(STORAGE, args.cache_mb * 1024 * 1024)
+    if args.author_index:
+        service.build_author_index()
+    server = TreeServer(service, args.port, args.host).start()
+    print(f"树查询服务: {server.url}  (Ctrl+C 退出)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        service.close()
+        STORAGE.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+import argparse
+import csv
+import json
+import logging
+import sys
+import time
+
+import numpy as np
+
+try:
+    import pyarrow  # 可选，只有输出 .parquet 时需要
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from db_config import DB_CONFIG
+from db_pool import ConnectionPool
+from storage import STORAGE_BACKENDS, MySQLStorage, open_storage
+from tree_codec import open_tree
+
+
+# ============ 引用树的全库统计 ============
+# 读 post_trees (任何一种 tree_json 格式)，每 --batch-topics 个 topic 拼成一组扁平的 NumPy 数组 (TreeBatch)，
+# 所有指标都是对整组数组的向量化运算，不在 Python 里逐个节点循环:
+#   - 每个 topic 一行 (TOPIC_COLUMNS)，一组算完就追加写进 --output (.parquet 或 .csv)
+#   - 全库汇总 (深度 / 子节点数分布、lost 比例、回复间隔分位数) 最后打印成 JSON，--summary 另存一份
+#
+#   python tree_stats.py --storage sqlite --storage-path aops.sqlite3 --output tree_stats.parquet
+#
+# 约定:
+#   - 边 n -> m 表示第 n 帖引用 (回复) 了第 m 帖；m=0 是没匹配上的引用 (lost)，不进邻接表，单独计数
+#   - 深度沿 "主父节点" 算: 每帖第一条指向更早帖子的边；没有的 (首帖、只有 lost 引用的) 深度为 0
+#   - 子节点数 (branching) 数的是所有非 lost 的入边
+#   - 回复间隔 = 回复帖的 post_time - 被回复帖的 post_time (秒)，没有时间的边不算
+
+# 只读 post_trees，一条连接就够
+DB_POOL = ConnectionPool(DB_CONFIG, size=1)
+
+STORAGE = MySQLStorage(DB_POOL)
+
+TOPIC_COLUMNS = [
+    ('topic_id', 'int64'),
+    ('posts', 'int64'),
+    ('edges', 'int64'),             # 非 lost 的边
+    ('lost_edges', 'int64'),        # to=0 的边
+    ('lost_share', 'float64'),      # lost_edges / (edges + lost_edges)
+    ('max_depth', 'int64'),
+    ('mean_depth', 'float64'),
+    ('max_children', 'int64'),
+    ('mean_children', 'float64'),   # 只算有子节点的帖子
+    ('reply_seconds_median', 'float64'),
+    ('reply_seconds_mean', 'float64'),
+    ('first_post_time', 'float64'),  # Unix 秒数
+    ('duration_seconds', 'float64'),  # 最后一帖 - 第一帖
+]
+
+
+class TreeBatch:
+    """
+    一组 topic 的树拼成的扁平数组。全局节点下标 = topic_offsets[i] + post_number - 1:
+        topic_ids      [T]     int64
+        topic_offsets  [T+1]   第 i 个 topic 的节点是 [topic_offsets[i], topic_offsets[i+1])
+        node_time      [N]     float64 Unix 秒数，没有时间的是 NaN
+        indptr         [N+1]   CSR 邻接表: 节点 v 引用的帖子是 indices[indptr[v]:indptr[v+1]]
+        indices        [E]     int64，按出发节点排好
+        lost           [N]     每个节点 lost (to=0) 的边数
+    """
+
+    def __init__(self, topic_ids, topic_offsets, node_time, indptr, indices, lost):
+        self.topic_ids = topic_ids
+        self.topic_offsets = topic_offsets
+        self.node_time = node_time
+        self.indptr = indptr
+        self.indices = indices
+        self.lost = lost
+
+    @property
+    def num_nodes(self):
+        return len(self.node_time)
+
+    @classmethod
+    def from_trees(cls, trees):
+        """trees: [(topic_id, tree_json), ...]"""
+        topic_ids, sizes, times, edge_arrays = [], [], [], []
+        for topic_id, tree_json in trees:
+            tree = open_tree(tree_json)
+            topic_ids.append(topic_id)
+            sizes.append(tree.num_nodes)
+            if tree.format == 'json':
+                # 老格式的 post_time 是字符串，交给 NumPy 一次解析，比逐个 fromisoformat 快得多
+                parsed = np.array(tree.post_times(), dtype='datetime64[s]')
+                times.append(np.where(np.isnat(parsed), np.nan, parsed.astype(np.int64)))
+            else:
+                times.append(np.array(tree.timestamps(), dtype=np.float64))
+            edge_arrays.append(np.frombuffer(tree.edge_array(), dtype=np.intc))
+        topic_offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=topic_offsets[1:])
+        n = int(topic_offsets[-1])
+        node_time = np.concatenate(times) if times else np.zeros(0)
+
+        flat = np.concatenate(edge_arrays).astype(np.int64) if edge_arrays else np.zeros(0, dtype=np.int64)
+        src, dst = flat[0::2], flat[1::2]
+        # 每条边属于哪个 topic，换成全局下标
+        per_topic = np.array([len(e) // 2 for e in edge_arrays], dtype=np.int64)
+        edge_size = np.repeat(np.asarray(sizes, dtype=np.int64), per_topic)
+        base = np.repeat(topic_offsets[:-1], per_topic)
+        valid = (src >= 1) & (src <= edge_size) & (dst >= 0) & (dst <= edge_size)
+        if not valid.all():
+            logging.warning(f"忽略 {int((~valid).sum())} 条越界的边")
+        is_lost = valid & (dst == 0)
+        keep = valid & (dst > 0)
+        lost = np.bincount(base[is_lost] + src[is_lost] - 1, minlength=n).astype(np.int64)
+        s = base[keep] + src[keep] - 1
+        d = base[keep] + dst[keep] - 1
+        order = np.argsort(s, kind='stable')
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(s, minlength=n), out=indptr[1:])
+        return cls(np.asarray(topic_ids, dtype=np.int64), topic_offsets, node_time, indptr, d[order], lost)
+
+    def node_topics(self):
+        """[N] 每个节点属于第几个 topic (batch 内下标)"""
+        return np.repeat(np.arange(len(self.topic_ids)), np.diff(self.topic_offsets))
+
+    def edge_sources(self):
+        """[E] 每条边的出发节点"""
+        return np.repeat(np.arange(self.num_nodes), np.diff(self.indptr))
+
+    def parents(self):
+        """[N] 主父节点: 第一条指向更早帖子的边，没有为 -1"""
+        parent = np.full(self.num_nodes, -1, dtype=np.int64)
+        src = self.edge_sources()
+        earlier = self.indices < src
+        rows, first = np.unique(src[earlier], return_index=True)
+        parent[rows] = self.indices[earlier][first]
+        return parent
+
+    def depths(self):
+        """
+        [N] 沿主父节点到根的距离。指针倍增: 每轮每个节点跳到 "父节点的父节点"，
+        log2(最大深度) 轮就够 (一条 n->n-1 的长链也只要十几轮)；父节点总是更早的帖子，不会有环
+        """
+        jump = self.parents()
+        depth = (jump >= 0).astype(np.int64)
+        active = np.flatnonzero(jump >= 0)
+        while active.size:
+            j = jump[active]
+            depth[active] += depth[j]
+            jump[active] = jump[j]
+            active = active[jump[active] >= 0]
+        return depth
+
+    def children(self):
+        """[N] 每个节点被多少条 (非 lost) 边指向"""
+        return np.bincount(self.indices, minlength=self.num_nodes)
+
+    def reply_seconds(self):
+        """[E] 每条边的回复间隔，没有时间的是 NaN"""
+        return self.node_time[self.edge_sources()] - self.node_time[self.indices]
+
+
+def _segment_max(values, offsets, fill):
+    """每段的最大值，空段填 fill"""
+    out = np.full(len(offsets) - 1, fill, dtype=np.result_type(values, type(fill)))
+    nonempty = np.flatnonzero(np.diff(offsets) > 0)
+    if nonempty.size:
+        out[nonempty] = np.fmax.reduceat(values, offsets[nonempty])
+    return out
+
+
+def _segment_min(values, offsets, fill):
+    out = np.full(len(offsets) - 1, fill, dtype=np.result_type(values, type(fill)))
+    nonempty = np.flatnonzero(np.diff(offsets) > 0)
+    if nonempty.size:
+        out[nonempty] = np.fmin.reduceat(values, offsets[nonempty])
+    return out
+
+
+def _segment_median(values, groups, num_groups):
+    """groups 里每组的中位数 (values 已去掉 NaN)，空组是 NaN"""
+    order = np.lexsort((values, groups))
+    values, groups = values[order], groups[order]
+    counts = np.bincount(groups, minlength=num_groups)
+    starts = np.zeros(num_groups + 1, dtype=np.int64)
+    np.cumsum(counts, out=starts[1:])
+    out = np.full(num_groups, np.nan)
+    has = counts > 0
+    lo = starts[:-1][has] + (counts[has] - 1) // 2
+    hi = starts[:-1][has] + counts[has] // 2
+    out[has] = (values[lo] + values[hi]) / 2
+    return out
+
+
+def _divide(a, b):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(b > 0, a / np.where(b > 0, b, 1), np.nan)
+
+
+# 汇总里深度 / 子节点数的分布列到多少 (n->n-1 的长链深度可以到几万)
+HISTOGRAM_LIMIT = 64
+
+
+class CorpusSummary:
+    """跨 batch 累加的全库统计"""
+
+    def __init__(self):
+        self.topics = 0
+        self.posts = 0
+        self.edges = 0
+        self.lost_edges = 0
+        self.depth_hist = np.zeros(1, dtype=np.int64)
+        self.children_hist = np.zeros(1, dtype=np.int64)
+        self.reply_seconds = []
+
+    @staticmethod
+    def _add_hist(hist, values):
+        counts = np.bincount(values)
+        if len(counts) > len(hist):
+            hist = np.pad(hist, (0, len(counts) - len(hist)))
+        hist[:len(counts)] += counts
+        return hist
+
+    def add(self, batch, depth, children, reply_seconds):
+        self.topics += len(batch.topic_ids)
+        self.posts += batch.num_nodes
+        self.edges += len(batch.indices)
+        self.lost_edges += int(batch.lost.sum())
+        if batch.num_nodes:
+            self.depth_hist = self._add_hist(self.depth_hist, depth)
+            self.children_hist = self._add_hist(self.children_hist, children)
+        # 回复间隔只留有限值，float32 每条边 4 字节，几千万条边也就一两百 MB
+        self.reply_seconds.append(reply_seconds[np.isfinite(reply_seconds)].astype(np.float32))
+
+    @staticmethod
+    def _hist_summary(hist):
+        """histogram[k] 是取值为 k 的节点数，只列到 HISTOGRAM_LIMIT-1，更大的合并进 over_limit"""
+        total = int(hist.sum())
+        if not total:
+            return {'mean': 0.0, 'p50': 0, 'p90': 0, 'p99': 0, 'max': 0, 'histogram': [], 'over_limit': 0}
+        cumulative = np.cumsum(hist)
+        quantile = lambda q: int(np.searchsorted(cumulative, q * total))
+        return {
+            'mean': round(float((np.arange(len(hist)) * hist).sum() / total), 4),
+            'p50': quantile(0.5),
+            'p90': quantile(0.9),
+            'p99': quantile(0.99),
+            'max': int(np.flatnonzero(hist)[-1]),
+            'histogram': hist[:HISTOGRAM_LIMIT].tolist(),
+            'over_limit': int(hist[HISTOGRAM_LIMIT:].sum()),
+        }
+
+    def result(self):
+        reply = np.concatenate(self.reply_seconds) if self.reply_seconds else np.zeros(0, dtype=np.float32)
+        reply_summary = {'count': int(reply.size)}
+        if reply.size:
+            p50, p90, p99 = np.quantile(reply, [0.5, 0.9, 0.99])
+            reply_summary.update({'mean': round(float(reply.mean(dtype=np.float64)), 1),
+                                  'p50': round(float(p50), 1), 'p90': round(float(p90), 1),
+                                  'p99': round(float(p99), 1)})
+        # 有子节点的帖子平均有几个子节点
+        children = self.children_hist
+        parents = int(children[1:].sum())
+        return {
+            'topics': self.topics,
+            'posts': self.posts,
+            'edges': self.edges,
+            'lost_edges': self.lost_edges,
+            'lost_share': round(self.lost_edges / (self.edges + self.lost_edges), 6)
+            if self.edges + self.lost_edges else 0.0,
+            'depth': self._hist_summary(self.depth_hist),
+            'children': self._hist_summary(children),
+            'mean_children_of_parents': round(float((np.arange(len(children)) * children).sum() / parents), 4)
+            if parents else 0.0,
+            'reply_seconds': reply_summary,
+        }
+
+
+def topic_metrics(batch, summary=None):
+    """一组 topic 的 TOPIC_COLUMNS，{列名: 数组}；传了 summary 顺便累加进全库统计"""
+    num_topics = len(batch.topic_ids)
+    offsets = batch.topic_offsets
+    sizes = np.diff(offsets)
+    node_topic = batch.node_topics()
+    depth = batch.depths()
+    children = batch.children()
+    reply = batch.reply_seconds()
+    edge_topic = node_topic[batch.edge_sources()]
+
+    edges = np.bincount(edge_topic, minlength=num_topics)
+    lost = np.bincount(node_topic, weights=batch.lost, minlength=num_topics).astype(np.int64)
+    has_children = children > 0
+    parents = np.bincount(node_topic, weights=has_children, minlength=num_topics)
+    timed = np.isfinite(reply)
+    timed_count = np.bincount(edge_topic[timed], minlength=num_topics)
+    first = _segment_min(batch.node_time, offsets, np.nan)
+
+    if summary is not None:
+        summary.add(batch, depth, children, reply)
+    return {
+        'topic_id': batch.topic_ids,
+        'posts': sizes,
+        'edges': edges,
+        'lost_edges': lost,
+        'lost_share': _divide(lost, edges + lost),
+        'max_depth': _segment_max(depth, offsets, 0),
+        'mean_depth': _divide(np.bincount(node_topic, weights=depth, minlength=num_topics), sizes),
+        'max_children': _segment_max(children, offsets, 0),
+        'mean_children': _divide(np.bincount(node_topic, weights=children * has_children, minlength=num_topics),
+                                 parents),
+        'reply_seconds_median': _segment_median(reply[timed], edge_topic[timed], num_topics),
+        'reply_seconds_mean': _divide(np.bincount(edge_topic[timed], weights=reply[timed], minlength=num_topics),
+                                      timed_count),
+        'first_post_time': first,
+        'duration_seconds': _segment_max(batch.node_time, offsets, np.nan) - first,
+    }
+
+
+def iter_batches(trees, batch_topics):
+    """把 (topic_id, tree_json) 流切成每 batch_topics 个一组的 TreeBatch"""
+    chunk = []
+    for item in trees:
+        chunk.append(item)
+        if len(chunk) >= batch_topics:
+            yield TreeBatch.from_trees(chunk)
+            chunk = []
+    if chunk:
+        yield TreeBatch.from_trees(chunk)
+
+
+class CsvOutput:
+    def __init__(self, path):
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([name for name, _ in TOPIC_COLUMNS])
+
+    def write(self, columns):
+        self._writer.writerows(zip(*(columns[name].tolist() for name, _ in TOPIC_COLUMNS)))
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetOutput:
+    """每组 topic 写一个 row group"""
+
+    def __init__(self, path):
+        if pyarrow is None:
+            raise RuntimeError("输出 parquet 需要先安装 pyarrow: pip install pyarrow")
+        self._schema = pyarrow.schema([(name, pyarrow.from_numpy_dtype(np.dtype(dtype)))
+                                       for name, dtype in TOPIC_COLUMNS])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+
+    def write(self, columns):
+        arrays = [pyarrow.array(np.asarray(columns[name], dtype=dtype)) for name, dtype in TOPIC_COLUMNS]
+        self._writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+def open_output(path):
+    return ParquetOutput(path) if path.endswith('.parquet') else CsvOutput(path)
+
+
+def run(storage, output=None, batch_topics=2000, topic_ids=None):
+    """统计 storage 里的 post_trees，每个 topic 一行写进 output (路径，可以为 None)，返回全库汇总"""
+    summary = CorpusSummary()
+    writer = open_output(output) if output else None
+    start = time.time()
+    try:
+        for batch in iter_batches(storage.iter_post_trees(topic_ids), batch_topics):
+            columns = topic_metrics(batch, summary)
+            if writer is not None:
+                writer.write(columns)
+            logging.info(f"已统计 {summary.topics} 个 topic / {summary.posts} 帖, 用时 {time.time() - start:.1f} 秒")
+    finally:
+        if writer is not None:
+            writer.close()
+    result = summary.result()
+    result['seconds'] = round(time.time() - start, 3)
+    return result
+
+
+def main(argv=None):
+    global STORAGE
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    parser = argparse.ArgumentParser(description="post_trees 的全库引用结构统计")
+    parser.add_argument('--storage', choices=STORAGE_BACKENDS, default='mysql')
+    parser.add_argument('--storage-path', metavar='PATH',
+                        help="sqlite 的数据库文件 / parquet 的目录 (与 01_crawler.py 相同)")
+    parser.add_argument('--topic-ids', type=int, nargs='+', metavar='ID', help="只统计这些 topic")
+    parser.add_argument('--batch-topics', type=int, default=2000,
+                        help="多少个 topic 拼成一组数组一起算，越大越快、越占内存")
+    parser.add_argument('--output', metavar='PATH',
+                        help="每个 topic 一行的统计结果，.parquet 结尾写 Parquet (需要 pyarrow)，否则写 CSV")
+    parser.add_argument('--summary', metavar='PATH', help="全库汇总另存一份 JSON")
+    args = parser.parse_args(argv)
+
+    STORAGE = open_storage(args.storage, args.storage_path, DB_POOL)
+    try:
+        result = run(STORAGE, args.output, args.batch_topics, args.topic_ids)
+    finally:
+        STORAGE.close()
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    return result
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)